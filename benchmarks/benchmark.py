@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+from time import perf_counter
+import numpy as np
+from PIL import Image
+
+# Make src/ and the root directory importable
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "src"))
+sys.path.append(ROOT_DIR)
+
+import moderngl
+from extractColors import extract_kmean_colors, palette_delta_e
+from readback import PixelBufferRing
+from record import FrameRenderer, render_frames, load_images_from_folder
+from timeline import Timeline
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "2160p": (3840, 2160)}
+COVER_SIZES = [500, 1500, 3000]
+PALETTE_MODES = ["full", "fast"]
+# Pixel budget timed against full-resolution decoding (PALETTE_MAX_PIXELS is off by default)
+DECODE_BUDGET_PIXELS = 1_000_000
+
+
+########################
+# Synthetic Mix
+########################
+
+def make_cover(path, size, seed):
+    """Write a cover with smooth gradients and a few solid blobs, like real album art."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    image = np.zeros((size, size, 3))
+    for channel in range(3):
+        a, b, c = rng.random(3)
+        image[..., channel] = 0.5 + 0.5 * np.sin(6 * a * x + 4 * b * y + 6 * c)
+    for _ in range(6):
+        cx, cy, radius = rng.random(3)
+        mask = (x - cx) ** 2 + (y - cy) ** 2 < (0.25 * radius) ** 2
+        image[mask] = rng.random(3)
+    Image.fromarray((image * 255).astype(np.uint8)).save(path)
+
+def make_synthetic_mix(folder, num_covers=4, cover_size=600, static_seconds=20, transition_seconds=5):
+    """Create a mix folder with generated covers and a matching durations.txt."""
+    covers_folder = os.path.join(folder, "Album Covers")
+    os.makedirs(covers_folder, exist_ok=True)
+    for i in range(num_covers):
+        make_cover(os.path.join(covers_folder, f"cover_{i:02d}.png"), cover_size, seed=i)
+
+    def timestamp(seconds):
+        return f"{seconds // 60}:{seconds % 60:02d}"
+
+    lines, t = [], 0
+    for i in range(num_covers):
+        lines.append(f"{timestamp(t)}-{timestamp(t + static_seconds)}")
+        t += static_seconds
+        if i < num_covers - 1:
+            lines.append(f"{timestamp(t)}-{timestamp(t + transition_seconds)} transition")
+            t += transition_seconds
+    with open(os.path.join(folder, "durations.txt"), 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return folder
+
+########################
+# Render Benchmarks
+########################
+
+def frames_per_second(frames, seconds):
+    return frames / max(seconds, 1e-9)
+
+def bench_draw(renderer, timeline, fps, frames):
+    """Draw only; ctx.finish() makes sure the GPU work is inside the timing."""
+    times, palette_a, palette_b, progress = (c.tolist() for c in timeline.schedule(fps, 0, frames))
+    renderer.ctx.finish()
+    start = perf_counter()
+    for i, t in enumerate(times):
+        renderer.select(palette_a[i], palette_b[i], progress[i])
+        renderer.render(t)
+    renderer.ctx.finish()
+    return frames_per_second(frames, perf_counter() - start)
+
+def bench_draw_readback(renderer, timeline, fps, frames, readback_buffers=3):
+    """Draw and read every frame back through the pixel-buffer ring."""
+    times, palette_a, palette_b, progress = (c.tolist() for c in timeline.schedule(fps, 0, frames))
+    ring = PixelBufferRing(renderer.ctx, renderer.fbo, size=readback_buffers)
+    frame = np.empty((renderer.height, renderer.width, 3), dtype=np.uint8)
+    renderer.ctx.finish()
+    start = perf_counter()
+    for i, t in enumerate(times):
+        renderer.select(palette_a[i], palette_b[i], progress[i])
+        renderer.render(t)
+        if ring.full:
+            ring.pop(out=frame)
+        ring.queue()
+    while ring.pending:
+        ring.pop(out=frame)
+    elapsed = perf_counter() - start
+    ring.release()
+    check_not_dark(frame, f"draw_readback at {renderer.width}x{renderer.height}")
+    return frames_per_second(frames, elapsed)
+
+def check_not_dark(frame, label):
+    """
+    Fail if a frame shows nothing but the dot grid, e.g. because no palette
+    texture was bound: the numbers would time near-static black frames.
+    The dots alone stay below ~40; any real palette lights up most pixels.
+    """
+    if np.percentile(frame.max(axis=2), 90) <= 64:
+        raise RuntimeError(f"{label}: the rendered frame is almost black; the benchmark would be meaningless.")
+
+def check_equivalence(ctx, width, height, palettes, timeline, fps, frames=12):
+    """
+    Compare the wave-table shader against the original per-fragment wave
+    math on frames spread over the timeline. Returns the largest channel
+    difference and the fraction of pixels that differ at all.
+    """
+    reference = FrameRenderer(ctx, width, height, palettes, inline_wave_params=True)
+    renderer = FrameRenderer(ctx, width, height, palettes)
+    times, palette_a, palette_b, progress = timeline.schedule(fps)
+    max_diff, differing = 0, 0
+    for frame in np.linspace(0, len(times) - 1, frames).astype(int):
+        images = []
+        for r in (reference, renderer):
+            r.select(int(palette_a[frame]), int(palette_b[frame]), float(progress[frame]))
+            r.render(float(times[frame]))
+            images.append(np.frombuffer(r.fbo.read(components=3), dtype=np.uint8).astype(np.int16))
+        diff = np.abs(images[0] - images[1]).reshape(-1, 3).max(axis=1)
+        max_diff = max(max_diff, int(diff.max()))
+        differing += int(np.count_nonzero(diff))
+    reference.release()
+    renderer.release()
+    return {"max_diff": max_diff, "differing_pixels": differing / (frames * width * height)}
+
+def bench_encode(renderer, timeline, fps, frames, work_dir):
+    """The full record path: draw, readback and encode to H.264."""
+    output_path = os.path.join(work_dir, f"bench_{renderer.width}x{renderer.height}.mp4")
+    start = perf_counter()
+    render_frames(renderer, timeline, output_path, 0, frames, fps)
+    elapsed = perf_counter() - start
+    os.remove(output_path)
+    return frames_per_second(frames, elapsed)
+
+def run_render_benchmarks(mix_folder, resolutions, frames, fps, encode, results):
+    timeline = Timeline.from_file(os.path.join(mix_folder, "durations.txt"))
+    image_paths = load_images_from_folder(os.path.join(mix_folder, "Album Covers"))
+    palettes = [extract_kmean_colors(path, mode="fast") for path in image_paths]
+    ctx = moderngl.create_standalone_context()
+    results["meta"]["gl_renderer"] = ctx.info.get("GL_RENDERER", "unknown")
+
+    for name in resolutions:
+        width, height = RESOLUTIONS[name]
+        renderer = FrameRenderer(ctx, width, height, palettes)
+        bench_draw(renderer, timeline, fps, min(frames, 10))  # Warm up shader compilation
+        results["render"][f"draw/{name}"] = bench_draw(renderer, timeline, fps, frames)
+        # The original shader's per-fragment wave math, for comparison
+        reference = FrameRenderer(ctx, width, height, palettes, inline_wave_params=True)
+        bench_draw(reference, timeline, fps, min(frames, 10))
+        results["render"][f"draw_inline_waves/{name}"] = bench_draw(reference, timeline, fps, frames)
+        results["equivalence"][name] = check_equivalence(ctx, width, height, palettes, timeline, fps)
+        print(f"{'equivalence':>14} {name:>6}: max diff {results['equivalence'][name]['max_diff']}, "
+              f"{results['equivalence'][name]['differing_pixels']:.4%} pixels differ")
+        results["render"][f"draw_readback/{name}"] = bench_draw_readback(renderer, timeline, fps, frames)
+        if encode:
+            results["render"][f"encode/{name}"] = bench_encode(renderer, timeline, fps, frames, mix_folder)
+        for key in ("draw", "draw_inline_waves", "draw_readback", "encode"):
+            if f"{key}/{name}" in results["render"]:
+                print(f"{key:>14} {name:>6}: {results['render'][f'{key}/{name}']:8.1f} fps")
+        # Free each resolution's framebuffers before the next, larger one
+        reference.release()
+        renderer.release()
+    ctx.release()
+
+########################
+# Palette Benchmarks
+########################
+
+def run_palette_benchmarks(work_dir, sizes, modes, repeats, results):
+    for size in sizes:
+        path = os.path.join(work_dir, f"palette_{size}.png")
+        make_cover(path, size, seed=size)
+        for mode in modes:
+            timings = []
+            for _ in range(repeats):
+                start = perf_counter()
+                extract_kmean_colors(path, mode=mode)
+                timings.append(perf_counter() - start)
+            seconds = min(timings)
+            results["palette"][f"{mode}/{size}px"] = seconds
+            print(f"{'palette ' + mode:>14} {size:>5}px: {seconds:8.3f} s/cover")
+
+        # Reduced-size decoding: JPEG draft mode and memory-mapped BMP sampling,
+        # timed against full-resolution decoding and checked for palette drift
+        for ext in (".jpg", ".bmp"):
+            path = os.path.join(work_dir, f"palette_{size}{ext}")
+            make_cover(path, size, seed=size)
+            for label, max_pixels in (("full_res", None), ("budget", DECODE_BUDGET_PIXELS)):
+                timings = []
+                for _ in range(repeats):
+                    start = perf_counter()
+                    palette = extract_kmean_colors(path, mode="fast", max_pixels=max_pixels)
+                    timings.append(perf_counter() - start)
+                seconds = min(timings)
+                if max_pixels is None:
+                    reference = palette
+                key = f"decode_{label}{ext}/{size}px"
+                results["palette"][key] = seconds
+                print(f"{'decode ' + label + ext:>18} {size:>5}px: {seconds:8.3f} s/cover")
+            delta_e = palette_delta_e(reference, palette)
+            results["equivalence"][f"palette_budget{ext}/{size}px"] = {
+                "max_delta_e": float(delta_e.max()), "mean_delta_e": float(delta_e.mean()),
+            }
+            print(f"{'budget ΔE' + ext:>18} {size:>5}px: max {delta_e.max():.2f}, mean {delta_e.mean():.2f}")
+
+########################
+# Comparison
+########################
+
+# Metrics where a larger value is better; everything else is a duration
+HIGHER_IS_BETTER = {"render"}
+
+def compare_results(baseline, current, threshold):
+    """
+    Print the change of every metric against `baseline` and return the
+    metrics that regressed by more than `threshold` (a fraction).
+    """
+    regressions = []
+    for group in ("render", "palette"):
+        for key, value in current.get(group, {}).items():
+            old = baseline.get(group, {}).get(key)
+            if old is None or old <= 0:
+                continue
+            change = (value - old) / old
+            worse = -change if group in HIGHER_IS_BETTER else change
+            flag = "REGRESSION" if worse > threshold else ""
+            print(f"{group}/{key:<24} {old:10.3f} -> {value:10.3f} ({change:+.1%}) {flag}")
+            if worse > threshold:
+                regressions.append(f"{group}/{key}")
+    return regressions
+
+########################
+# Main
+########################
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark rendering, readback, encoding and palette extraction.")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slowdown as a fraction before a metric counts as a regression")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per render benchmark")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--resolutions", default="720p,1080p,2160p")
+    parser.add_argument("--cover-sizes", default=",".join(str(s) for s in COVER_SIZES))
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per palette benchmark (best is kept)")
+    parser.add_argument("--no-encode", action="store_true", help="Skip the full encode benchmark")
+    parser.add_argument("--skip-render", action="store_true")
+    parser.add_argument("--skip-palette", action="store_true")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "frames": args.frames,
+            "fps": args.fps,
+        },
+        "render": {},
+        "palette": {},
+        "equivalence": {},
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="wiiu-bench-")
+    try:
+        if not args.skip_render:
+            mix_folder = make_synthetic_mix(os.path.join(work_dir, "mix"))
+            resolutions = [r for r in args.resolutions.split(",") if r]
+            run_render_benchmarks(mix_folder, resolutions, args.frames, args.fps, not args.no_encode, results)
+        if not args.skip_palette:
+            sizes = [int(s) for s in args.cover_sizes.split(",") if s]
+            run_palette_benchmarks(work_dir, sizes, PALETTE_MODES, args.repeats, results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    # The wave table is computed with the GPU's own math, so any difference is a bug
+    mismatches = [name for name, check in results["equivalence"].items() if check.get("max_diff", 0) > 0]
+    if mismatches:
+        print(f"The wave-table shader differs from the original wave math at: {', '.join(mismatches)}")
+        exit(1)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            exit(1)
+        print("No regressions.")
+
+if __name__ == "__main__":
+    main()
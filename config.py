@@ -11,5 +11,26 @@ SRC_DIR = os.path.join(BASE_DIR, "src")
 # File paths
 FRAGMENT_SHADER_PATH = os.path.join(SHADERS_DIR, "wiiU.frag")
 VERTEX_SHADER_PATH = os.path.join(SHADERS_DIR, "wiiU.vert")
+YUV_FRAGMENT_SHADER_PATH = os.path.join(SHADERS_DIR, "yuv420.frag")
+DOWNSAMPLE_FRAGMENT_SHADER_PATH = os.path.join(SHADERS_DIR, "downsample.frag")
+SPRITE_FRAGMENT_SHADER_PATH = os.path.join(SHADERS_DIR, "sprite.frag")
+SPRITE_VERTEX_SHADER_PATH = os.path.join(SHADERS_DIR, "sprite.vert")
 ALBUM_COVERS_DIR = os.path.join(ASSETS_DIR, "Album Covers")
-DURATIONS_FILE_PATH = os.path.join(ASSETS_DIR, "durations.txt")
\ No newline at end of file
+DURATIONS_FILE_PATH = os.path.join(ASSETS_DIR, "durations.txt")
+
+# Palette cache (content-addressed, shared between mixes)
+PALETTE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "WiiUMiiBG", "palettes")
+PALETTE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Palette extraction mode: "full" clusters every pixel, "fast" clusters a
+# 5-bit-per-channel color histogram weighted by pixel counts
+PALETTE_MODE = "full"
+
+# Pixel budget for palette extraction, e.g. 1_000_000: larger covers are
+# decoded at reduced size (JPEG draft mode, memory-mapped sampling of
+# uncompressed TIFF/BMP, thumbnailing otherwise). This shifts the palettes
+# slightly, so it is opt-in; None always decodes at full resolution.
+PALETTE_MAX_PIXELS = None
+
+# Processes used to extract palettes (None uses every core)
+PALETTE_WORKERS = None
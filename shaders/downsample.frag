@@ -0,0 +1,32 @@
+#version 330 core
+
+precision highp float;
+
+// Box (area-average) downscale of a rendered frame to a smaller rendition.
+// Each output pixel averages the source texels under its footprint, weighting
+// the texels on the footprint's edge by how much of them it covers, so any
+// ratio works: 2x (2160p -> 1080p), 3x (2160p -> 720p) or 1.5x.
+
+uniform sampler2D source;            // Full-resolution frame
+uniform vec2 u_scale;                // Source pixels per output pixel on each axis
+
+out vec4 FragColor;
+
+void main() {
+    vec2 lo = floor(gl_FragCoord.xy) * u_scale;
+    vec2 hi = lo + u_scale;
+    ivec2 first = ivec2(floor(lo));
+    ivec2 last = ivec2(ceil(hi)) - 1;
+
+    vec3 sum = vec3(0.0);
+    float total = 0.0;
+    for (int y = first.y; y <= last.y; y++) {
+        float wy = min(hi.y, float(y + 1)) - max(lo.y, float(y));
+        for (int x = first.x; x <= last.x; x++) {
+            float w = wy * (min(hi.x, float(x + 1)) - max(lo.x, float(x)));
+            sum += w * texelFetch(source, ivec2(x, y), 0).rgb;
+            total += w;
+        }
+    }
+    FragColor = vec4(sum / total, 1.0);
+}
@@ -0,0 +1,12 @@
+#version 330 core
+
+// Textured quad for overlays drawn on top of the shader (text, UI)
+uniform sampler2D spriteTexture;
+uniform vec4 tint;
+
+in vec2 uv;
+out vec4 fragColor;
+
+void main() {
+    fragColor = texture(spriteTexture, uv) * tint;
+}
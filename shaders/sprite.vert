@@ -0,0 +1,12 @@
+#version 330 core
+layout(location = 0) in vec2 in_position;
+
+// Screen rectangle (x0, y0, x1, y1) in normalized device coordinates
+uniform vec4 rect;
+
+out vec2 uv;
+
+void main() {
+    uv = in_position * 0.5 + 0.5;
+    gl_Position = vec4(mix(rect.xy, rect.zw, uv), 0.0, 1.0);
+}
@@ -2,6 +2,22 @@
 
 precision highp float;
 
+// Every variant needs the wave constants #defined from src/waves.py by
+// waves.wave_defines(): BASE_AMPLITUDE, BASE_FREQUENCY, BASE_FLOW, THICKNESS.
+//
+// Variants, selected by injecting a #define after #version:
+//   CACHED_LAYERS   sample the baked gradient and dot-grid textures, draw only the waves
+//   BAKE_GRADIENT   output just the background gradient
+//   BAKE_DOTS       output just the dot-grid blend weight in .r
+//   WAVE_MASKS      output the 7 wave alphas and the dot weight instead of a
+//                   color: waves 0-3 in FragColor, waves 4-6 and the dots in
+//                   MaskColor (for src/waveMasks.py)
+//   INLINE_WAVE_PARAMS  derive the wave parameters per fragment like the
+//                   original shader instead of reading waveParams (reference
+//                   for equivalence checks)
+//   WAVE_TABLE      output wave i's waveParams entry at pixel (i, 0), so the
+//                   table is computed with the GPU's own sin()
+
 uniform vec2 u_resolution;           // Canvas resolution
 uniform float u_time;                // Time for animation
 uniform float u_lineAlpha;           // (0.5 to 1.0) line transparency scale
@@ -9,100 +25,161 @@ uniform float u_lineAlpha;           // (0.5 to 1.0) line transparency scale
 // Transition uniform (0.0 to 1.0) for color blending only
 uniform float transitionProgress;    
 
-// Wave colors
-uniform vec3 waveColor0;
-uniform vec3 waveColor1;
-uniform vec3 waveColor2;
-uniform vec3 waveColor3;
-uniform vec3 waveColor4;
-uniform vec3 waveColor5;
-uniform vec3 waveColor6;
-
-// Next wave colors (for transition blending)
-uniform vec3 nextWaveColor0;
-uniform vec3 nextWaveColor1;
-uniform vec3 nextWaveColor2;
-uniform vec3 nextWaveColor3;
-uniform vec3 nextWaveColor4;
-uniform vec3 nextWaveColor5;
-uniform vec3 nextWaveColor6;
-
-// Background gradient colors (current)
-uniform vec3 backgroundTopColor;
-uniform vec3 backgroundBottomColor;
-
-// Next background gradient colors (for transition)
-uniform vec3 nextBackgroundTopColor;
-uniform vec3 nextBackgroundBottomColor;
-
+// All palettes, uploaded once. Row p holds palette p:
+// (background top, background bottom, wave 0 .. wave 6)
+uniform sampler2D paletteTexture;
+uniform int paletteIndex;            // Current palette
+uniform int nextPaletteIndex;        // Palette being transitioned to
+
+// Per-wave (vertical offset, amplitude, frequency, flow), computed once by the
+// WAVE_TABLE variant (see record.gpu_wave_parameters), and the vertical band
+// (min y, max y) each wave can touch
+uniform vec4 waveParams[7];
+uniform vec2 waveBands[7];
+
+#ifdef CACHED_LAYERS
+// Time-invariant layers baked once by the BAKE_GRADIENT / BAKE_DOTS variants
+uniform sampler2D backgroundGradients;      // num_palettes x height, one column per palette
+uniform sampler2D dotMask;                  // width x height, dot blend weight
+#endif
+
+#ifdef WAVE_MASKS
+layout(location = 0) out vec4 FragColor;
+layout(location = 1) out vec4 MaskColor;
+#else
 out vec4 FragColor;
+#endif
 
 // A simple pseudo-random function
 float random(float x) {
     return fract(sin(x) * 43758.5453123);
 }
 
+#if defined(INLINE_WAVE_PARAMS) || defined(WAVE_TABLE)
+// Wave i's (vertical offset, amplitude, frequency, flow), derived from the
+// index with the original shader's math
+vec4 waveParameters(int i) {
+    // Base wave parameters (constant speed, no dynamic BPM), #defined
+    // from the constants in src/waves.py
+    float baseAmplitude = BASE_AMPLITUDE;
+    float baseFrequency = BASE_FREQUENCY;
+    float baseFlow      = BASE_FLOW;   // A fixed negative flow for horizontal wave motion
+
+    // Random vertical offset
+    float verticalOffset = mix(-.2, 0.6, random(float(i)))
+                   + 0.9 * sin(float(i) * 3.14); // Oscillation based on index
+    // Random amplitude/frequency
+    float amplitude       = baseAmplitude * mix(1.0, 5.3, random(float(i) + 2.0));
+    float frequency       = baseFrequency * mix(0.2, 2.5, random(float(i) + 1.0));
+
+    // Random factor for wave flow
+    float waveRandomFactor = mix(0.4, 1.5, random(float(i)));
+    // Combine baseFlow with waveRandomFactor
+    float waveFlow = baseFlow * waveRandomFactor;
+
+    // Reverse direction for certain waves
+    if (i == 3 || i == 5) {
+        waveFlow = -waveFlow;
+    }
+    if (i == 6) {
+        amplitude = amplitude +.01;
+        frequency = frequency - 2.0;
+        waveFlow = waveFlow -.15;
+    }
+
+    return vec4(verticalOffset, amplitude, frequency, waveFlow);
+}
+#endif
+
 // (Optional) function to create circular dots
 float drawDot(vec2 st, vec2 center, float radius) {
     float dist = length(st - center);
     return 1.0 - smoothstep(radius - 0.0067, radius + 0.00067, dist);
 }
 
-void main() {
-    vec2 st = gl_FragCoord.xy / u_resolution;
-    st.x *= u_resolution.x / u_resolution.y; // Adjust for aspect ratio 
+// Color `slot` of `palette` (0 = background top, 1 = background bottom, 2.. = waves)
+vec3 paletteColor(int palette, int slot) {
+    return texelFetch(paletteTexture, ivec2(slot, palette), 0).rgb;
+}
 
+// Background gradient blended between two palettes
+vec3 backgroundColor(vec2 st, int palette, int nextPalette, float progress) {
     // Interpolate background colors based on transitionProgress
-    vec3 interpolatedTopColor = mix(backgroundTopColor,    nextBackgroundTopColor,    transitionProgress);
-    vec3 interpolatedBottomColor = mix(backgroundBottomColor, nextBackgroundBottomColor, transitionProgress);
+    vec3 interpolatedTopColor = mix(paletteColor(palette, 0), paletteColor(nextPalette, 0), progress);
+    vec3 interpolatedBottomColor = mix(paletteColor(palette, 1), paletteColor(nextPalette, 1), progress);
 
     // Compute vertical gradient with smoother interpolation
-    vec3 color = mix(interpolatedBottomColor, interpolatedTopColor, pow(st.y, 1.2));
+    return mix(interpolatedBottomColor, interpolatedTopColor, pow(st.y, 1.2));
+}
+
+// Blend weight of the dot grid overlay at st
+float dotGridWeight(vec2 st) {
+    vec2 gridSize      = vec2(0.0045);
+    vec2 gridIndex     = floor(st / gridSize);
+    vec2 gridPosition  = gridIndex * gridSize + gridSize * 0.5;
+    float dotRadius    = 0.00275;
+    float dot          = drawDot(st, gridPosition, dotRadius);
 
-    // Base wave parameters (constant speed, no dynamic BPM)
-    float baseAmplitude = 0.025;
-    float baseFrequency = 3.0;
-    float baseFlow      = -0.1;   // A fixed negative flow for horizontal wave motion
-    float thickness     = 0.005;
+    float dotAlpha     = mod(gridIndex.x + gridIndex.y, 2.0) == 0.0 ? 0.1 : 0.0;
+    return dot * dotAlpha * 1.2;
+}
+
+void main() {
+    vec2 st = gl_FragCoord.xy / u_resolution;
+    st.x *= u_resolution.x / u_resolution.y; // Adjust for aspect ratio 
+
+#if defined(WAVE_TABLE)
+    // One pixel per wave
+    FragColor = waveParameters(int(gl_FragCoord.x));
+#elif defined(BAKE_DOTS)
+    FragColor = vec4(dotGridWeight(st), 0.0, 0.0, 1.0);
+#elif defined(BAKE_GRADIENT)
+    // One column per palette; u_resolution.y is the height of the final frame
+    int palette = int(gl_FragCoord.x);
+    FragColor = vec4(backgroundColor(st, palette, palette, 0.0), 1.0);
+#else
+
+#ifdef CACHED_LAYERS
+    ivec2 pixel = ivec2(gl_FragCoord.xy);
+    vec3 color = mix(texelFetch(backgroundGradients, ivec2(paletteIndex,     pixel.y), 0).rgb,
+                     texelFetch(backgroundGradients, ivec2(nextPaletteIndex, pixel.y), 0).rgb,
+                     transitionProgress);
+#else
+    vec3 color = backgroundColor(st, paletteIndex, nextPaletteIndex, transitionProgress);
+#endif
+
+    float thickness     = THICKNESS;
+
+    // Scale alpha by u_lineAlpha uniform
+    float scaledAlpha = mix(0.5, 1.0, u_lineAlpha);
+
+#ifdef WAVE_MASKS
+    float masks[7] = float[7](0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0);
+#endif
 
     // Draw multiple waves
     for (int i = 0; i < 7; i++) {
-        // Random vertical offset
-        float verticalOffset = mix(-.2, 0.6, random(float(i)))
-                       + 0.9 * sin(float(i) * 3.14); // Oscillation based on index
-        // Random amplitude/frequency
-        float amplitude       = baseAmplitude * mix(1.0, 5.3, random(float(i) + 2.0));
-        float frequency       = baseFrequency * mix(0.2, 2.5, random(float(i) + 1.0));
-
-        // Random factor for wave flow
-        float waveRandomFactor = mix(0.4, 1.5, random(float(i)));
-        // Combine baseFlow with waveRandomFactor
-        float waveFlow = baseFlow * waveRandomFactor;
-
-        // Reverse direction for certain waves
-        if (i == 3 || i == 5) {
-            waveFlow = -waveFlow;
-        }
-        if (i == 6) {
-            amplitude = amplitude +.01;
-            frequency = frequency - 2.0;
-            waveFlow = waveFlow -.15;
+#ifdef INLINE_WAVE_PARAMS
+        vec4 params          = waveParameters(i);
+        float verticalOffset = params.x;
+        float amplitude      = params.y;
+        float frequency      = params.z;
+        float waveFlow       = params.w;
+#else
+        // Outside its band a wave's alpha is exactly 0, so it can be skipped
+        if (st.y < waveBands[i].x || st.y > waveBands[i].y) {
+            continue;
         }
+        float verticalOffset = waveParams[i].x;
+        float amplitude      = waveParams[i].y;
+        float frequency      = waveParams[i].z;
+        float waveFlow       = waveParams[i].w;
+#endif
 
         // Interpolate wave colors based on transitionProgress
         vec3 waveColor = mix(
-            (i == 0) ? waveColor0 :
-            (i == 1) ? waveColor1 :
-            (i == 2) ? waveColor2 :
-            (i == 3) ? waveColor3 :
-            (i == 4) ? waveColor4 :
-            (i == 5) ? waveColor5 : waveColor6,
-            (i == 0) ? nextWaveColor0 :
-            (i == 1) ? nextWaveColor1 :
-            (i == 2) ? nextWaveColor2 :
-            (i == 3) ? nextWaveColor3 :
-            (i == 4) ? nextWaveColor4 :
-            (i == 5) ? nextWaveColor5 : nextWaveColor6,
+            paletteColor(paletteIndex, 2 + i),
+            paletteColor(nextPaletteIndex, 2 + i),
             transitionProgress
         );
 
@@ -113,28 +190,34 @@ void main() {
         // Wave alpha (smooth lines)
         float waveAlpha = smoothstep(waveY + thickness, waveY, st.y)
                         - smoothstep(waveY, waveY - thickness * 20.0, st.y);
-
-        // Scale alpha by u_lineAlpha uniform
-        float scaledAlpha = mix(0.5, 1.0, u_lineAlpha);
         waveAlpha *= scaledAlpha;
 
+#ifdef WAVE_MASKS
+        masks[i] = waveAlpha;
+#endif
+
         // Blend wave into the background color
         color = mix(color, waveColor, waveAlpha);
     }
 
     // OPTIONAL: Dot grid overlay
-    vec2 gridSize      = vec2(0.0045);
-    vec2 gridIndex     = floor(st / gridSize);
-    vec2 gridPosition  = gridIndex * gridSize + gridSize * 0.5;
-    float dotRadius    = 0.00275;
-    float dot          = drawDot(st, gridPosition, dotRadius);
-
-    float dotAlpha     = mod(gridIndex.x + gridIndex.y, 2.0) == 0.0 ? 0.1 : 0.0;
+#ifdef CACHED_LAYERS
+    float dotWeight    = texelFetch(dotMask, pixel, 0).r;
+#else
+    float dotWeight    = dotGridWeight(st);
+#endif
     vec3 dotColor      = vec3(1.3);
 
+#ifdef WAVE_MASKS
+    FragColor = vec4(masks[0], masks[1], masks[2], masks[3]);
+    MaskColor = vec4(masks[4], masks[5], masks[6], dotWeight);
+    return;
+#endif
+
     // Blend dots into color
-    color = mix(color, dotColor, dot * dotAlpha * 1.2);
+    color = mix(color, dotColor, dotWeight);
 
     // Final output
     FragColor = vec4(color, 1.0);
+#endif
 }
\ No newline at end of file
@@ -0,0 +1,65 @@
+#version 330 core
+
+precision highp float;
+
+// Converts a rendered RGB frame into a planar YUV 4:2:0 (yuv420p) image so it
+// can be read back at 1.5 bytes per pixel and piped to ffmpeg as-is.
+//
+// The target is an R8 texture of width x (height * 3 / 2) whose bytes, read
+// back bottom row first, are exactly ffmpeg's yuv420p layout: the full-size Y
+// plane, then the quarter-size U and V planes, each top-down. Each fragment
+// works out which plane and sample its byte belongs to from its linear
+// offset, so any even width and height works.
+//
+// BT.709 limited range. Chroma is left-sited (the H.264/MPEG-2 default):
+// horizontally co-sited with even luma columns, vertically halfway between
+// two luma rows.
+
+uniform sampler2D rgbFrame;          // Rendered frame, bottom-up like every GL texture
+uniform ivec2 u_frameSize;           // Frame width and height
+
+out vec4 FragColor;
+
+const vec3 LUMA = vec3(0.2126, 0.7152, 0.0722);
+
+// Pixel (x, y) of the frame counted from the top, like the video
+vec3 framePixel(int x, int y) {
+    x = clamp(x, 0, u_frameSize.x - 1);
+    y = clamp(y, 0, u_frameSize.y - 1);
+    return texelFetch(rgbFrame, ivec2(x, u_frameSize.y - 1 - y), 0).rgb;
+}
+
+void main() {
+    int width = u_frameSize.x;
+    int height = u_frameSize.y;
+    int offset = int(gl_FragCoord.y) * width + int(gl_FragCoord.x);
+    int lumaSize = width * height;
+    float value;
+
+    if (offset < lumaSize) {
+        vec3 rgb = framePixel(offset % width, offset / width);
+        value = (16.0 + 219.0 * dot(LUMA, rgb)) / 255.0;
+    } else {
+        int chromaWidth = width / 2;
+        int chromaSize = chromaWidth * (height / 2);
+        int chromaOffset = offset - lumaSize;
+        bool isV = chromaOffset >= chromaSize;
+        chromaOffset -= isV ? chromaSize : 0;
+        int x = 2 * (chromaOffset % chromaWidth);
+        int y = 2 * (chromaOffset / chromaWidth);
+
+        // [1 2 1] / 4 across columns x-1..x+1, averaged over rows y and y+1
+        vec3 rgb = vec3(0.0);
+        for (int row = 0; row < 2; row++) {
+            rgb += 0.25 * framePixel(x - 1, y + row)
+                 + 0.50 * framePixel(x, y + row)
+                 + 0.25 * framePixel(x + 1, y + row);
+        }
+        rgb *= 0.5;
+
+        float luma = dot(LUMA, rgb);
+        float chroma = isV ? (rgb.r - luma) / 1.5748 : (rgb.b - luma) / 1.8556;
+        value = (128.0 + 224.0 * chroma) / 255.0;
+    }
+    FragColor = vec4(value, 0.0, 0.0, 1.0);
+}
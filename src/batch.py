@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import argparse
+import traceback
+import multiprocessing
+from datetime import datetime, timezone
+from time import perf_counter
+import moderngl
+from paletteCache import load_palettes
+from record import (WIDTH, HEIGHT, FPS, BACKEND, CACHED_LAYERS, GPU_YUV, ENCODER_PARAMS,
+                    load_mix, find_audio, fit_to_audio, create_renderer, render_frames, override_params,
+                    limit_worker_threads)
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PALETTE_MODE, PALETTE_MAX_PIXELS
+
+# Render worker processes; each renders one job at a time
+WORKERS = 1
+# Settings a job may override, with their defaults
+JOB_DEFAULTS = {
+    "width": WIDTH,
+    "height": HEIGHT,
+    "fps": FPS,
+    "preset": None,         # x264 preset, e.g. "veryfast" for drafts
+    "crf": None,
+    "backend": BACKEND,
+    "cached_layers": CACHED_LAYERS,
+    "gpu_yuv": GPU_YUV,
+    "output": None,         # Default: output.mp4 in the mix folder
+    "audio": True,          # True: the mix folder's audio file, if any; a path; or False for silence
+}
+
+
+########################
+# Jobs
+########################
+
+def load_manifest(path):
+    """
+    Jobs from a JSON manifest: either a list of jobs or
+    {"defaults": {...}, "jobs": [...]}. A job is a mix folder path or an
+    object with "mix_folder" and any of the JOB_DEFAULTS keys. Relative
+    paths are resolved against the manifest's folder.
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for entry in manifest.get("jobs", []):
+        job = dict(defaults)
+        job.update({"mix_folder": entry} if isinstance(entry, str) else entry)
+        if "mix_folder" not in job:
+            raise ValueError(f"{path}: job without a mix_folder: {entry}")
+        for key in ("mix_folder", "output", "audio"):
+            if isinstance(job.get(key), str) and job[key]:
+                job[key] = os.path.join(base, job[key])
+        jobs.append(job)
+    return jobs
+
+def resolve_job(job, overrides):
+    """Fill in defaults: JOB_DEFAULTS < command-line overrides < the job's own settings."""
+    unknown = set(job) - set(JOB_DEFAULTS) - {"mix_folder"}
+    if unknown:
+        raise ValueError(f"Unknown job settings for {job['mix_folder']}: {', '.join(sorted(unknown))}")
+    resolved = dict(JOB_DEFAULTS)
+    resolved.update({key: value for key, value in overrides.items() if value is not None})
+    resolved.update(job)
+    resolved["output"] = resolved["output"] or os.path.join(resolved["mix_folder"], "output.mp4")
+    return resolved
+
+def job_encoder_params(job):
+    """ENCODER_PARAMS with the job's preset and CRF swapped in."""
+    overrides = []
+    for flag, value in (("-preset", job["preset"]), ("-crf", job["crf"])):
+        if value is not None:
+            overrides += [flag, value]
+    return override_params(ENCODER_PARAMS, overrides)
+
+def status_path(job):
+    return job["output"] + ".status.json"
+
+def write_status(job, status):
+    """Write the job's status file atomically, so watchers never read a partial one."""
+    path = status_path(job)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+########################
+# Render Workers
+########################
+
+# Per-process state: one GL context, and a renderer (with its compiled
+# programs and framebuffers) per output configuration, reused across jobs
+_worker = {}
+
+def _init_worker(threads):
+    limit_worker_threads(threads)
+    _worker["ctx"] = None
+    _worker["renderers"] = {}
+
+def get_renderer(job, palettes):
+    key = (job["backend"], job["width"], job["height"], job["cached_layers"], job["gpu_yuv"])
+    renderer = _worker["renderers"].get(key)
+    if renderer is not None:
+        renderer.set_palettes(palettes)
+        return renderer
+    if job["backend"] == "gl" and _worker["ctx"] is None:
+        _worker["ctx"] = moderngl.create_standalone_context()
+    renderer = create_renderer(job["width"], job["height"], palettes, job["backend"],
+                               job["cached_layers"], job["gpu_yuv"], ctx=_worker["ctx"])
+    if job["backend"] == "gl":
+        # The CPU renderer is cheap to rebuild and holds per-resolution arrays
+        _worker["renderers"][key] = renderer
+    return renderer
+
+def run_job(job):
+    """Render one job and return its final status; failures are reported, not raised."""
+    status = {"mix_folder": job["mix_folder"], "output": job["output"], "settings": job,
+              "state": "running", "started_at": now(), "pid": os.getpid()}
+    write_status(job, status)
+    start = perf_counter()
+    root, ext = os.path.splitext(job["output"])
+    partial_path = root + ".partial" + ext
+    try:
+        timeline, image_paths = load_mix(job["mix_folder"])
+        audio_path = job["audio"] if isinstance(job["audio"], str) else None
+        if job["audio"] is True:
+            audio_path = find_audio(job["mix_folder"])
+        if audio_path is not None:
+            timeline = fit_to_audio(timeline, audio_path)
+            status["audio"] = audio_path
+        # Pool workers are daemonic and can't start a palette pool of their own
+        palettes = load_palettes(image_paths, mode=PALETTE_MODE, workers=1, max_pixels=PALETTE_MAX_PIXELS)
+        renderer = get_renderer(job, palettes)
+
+        # Render under a temporary name so a failed job never leaves a truncated output
+        total_frames = timeline.frame_count(job["fps"])
+        stats = render_frames(renderer, timeline, partial_path, 0, total_frames, job["fps"],
+                              encoder_params=job_encoder_params(job), audio_path=audio_path)
+        os.replace(partial_path, job["output"])
+        status.update(state="done", frames=total_frames, duration_seconds=timeline.duration, pipeline=stats)
+    except Exception as e:
+        status.update(state="failed", error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    status["finished_at"] = now()
+    status["wall_seconds"] = perf_counter() - start
+    if status["state"] == "done":
+        status["render_fps"] = status["frames"] / max(status["wall_seconds"], 1e-9)
+    write_status(job, status)
+    return status
+
+########################
+# Main
+########################
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Render a queue of mix folders headlessly on a pool of render workers.")
+    parser.add_argument("mix_folders", nargs="*", help="Mix folders to render")
+    parser.add_argument("--manifest", help="JSON manifest of jobs with per-job settings")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Jobs rendered in parallel")
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--fps", type=int)
+    parser.add_argument("--preset", help="x264 preset for every job without its own")
+    parser.add_argument("--crf", type=int)
+    parser.add_argument("--backend", choices=["gl", "cpu"])
+    parser.add_argument("--report", help="Also write the statuses of all jobs to this JSON file")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    jobs = [{"mix_folder": os.path.abspath(folder)} for folder in args.mix_folders]
+    if args.manifest:
+        jobs += load_manifest(args.manifest)
+    if not jobs:
+        print("No jobs given. Pass mix folders or --manifest.")
+        exit(1)
+
+    overrides = {key: getattr(args, key) for key in ("width", "height", "fps", "preset", "crf", "backend")}
+    try:
+        jobs = [resolve_job(job, overrides) for job in jobs]
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
+    for job in jobs:
+        write_status(job, {"mix_folder": job["mix_folder"], "output": job["output"],
+                           "settings": job, "state": "queued", "queued_at": now()})
+
+    print(f"Rendering {len(jobs)} jobs on {args.workers} workers...")
+    # GL contexts don't survive fork(), so workers always start fresh
+    mp_context = multiprocessing.get_context("spawn")
+    results = []
+    # maxtasksperchild=None keeps each worker (and its context and programs) alive across jobs
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    with mp_context.Pool(args.workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        for status in pool.imap_unordered(run_job, jobs):
+            results.append(status)
+            detail = f"{status['render_fps']:.1f} fps" if status["state"] == "done" else status["error"]
+            print(f"[{len(results)}/{len(jobs)}] {status['state']}: {status['mix_folder']} ({detail})")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    failed = [status for status in results if status["state"] != "done"]
+    print(f"{len(results) - len(failed)} done, {len(failed)} failed.")
+    if failed:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
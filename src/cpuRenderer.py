@@ -0,0 +1,214 @@
+import argparse
+import numpy as np
+from extractColors import pack_palettes
+from waves import NUM_WAVES, THICKNESS, wave_parameters, wave_bands
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional, the NumPy path is used instead
+    njit = None
+
+
+########################
+# Shader Building Blocks
+########################
+
+def smoothstep(edge0, edge1, x):
+    """GLSL smoothstep(), including the reversed-edge form wiiU.frag relies on."""
+    t = np.clip((x - edge0) / (edge1 - edge0), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+def dot_grid_weight(width, height):
+    """The shader's dot-grid blend weight for every pixel, as (height, width) float32."""
+    f32 = np.float32
+    st_x = ((np.arange(width, dtype=f32) + f32(0.5)) / f32(width)) * (f32(width) / f32(height))
+    st_y = (np.arange(height, dtype=f32) + f32(0.5)) / f32(height)
+    st_x, st_y = np.meshgrid(st_x, st_y)
+
+    grid_size = f32(0.0045)
+    grid_x, grid_y = np.floor(st_x / grid_size), np.floor(st_y / grid_size)
+    center_x = grid_x * grid_size + grid_size * f32(0.5)
+    center_y = grid_y * grid_size + grid_size * f32(0.5)
+    dist = np.sqrt((st_x - center_x) ** 2 + (st_y - center_y) ** 2)
+    dot_radius = f32(0.00275)
+    dot = f32(1.0) - smoothstep(dot_radius - f32(0.0067), dot_radius + f32(0.00067), dist)
+    dot_alpha = np.where(np.mod(grid_x + grid_y, f32(2.0)) == 0.0, f32(0.1), f32(0.0))
+    return (dot * dot_alpha * f32(1.2)).astype(f32)
+
+def gradient_weights(height):
+    """pow(st.y, 1.2) of every row: the top color's weight in the background gradient, as (height, 1)."""
+    st_y = (np.arange(height, dtype=np.float32) + np.float32(0.5)) / np.float32(height)
+    return np.power(st_y, np.float32(1.2))[:, None]
+
+def blend_palette_colors(packed_palettes, gradient_t, palette, next_palette, progress):
+    """Background gradient column (height, 3) and wave colors (NUM_WAVES, 3) for a palette pair."""
+    p = np.float32(progress)
+    colors = packed_palettes[palette] * (np.float32(1.0) - p) + packed_palettes[next_palette] * p
+    top, bottom, wave_colors = colors[0], colors[1], colors[2:2 + NUM_WAVES]
+    gradient = bottom[None, :] * (np.float32(1.0) - gradient_t) + top[None, :] * gradient_t
+    return gradient.astype(np.float32), np.ascontiguousarray(wave_colors, dtype=np.float32)
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _composite_numba(out, gradient, wave_y, wave_colors, bands, dot_weight, scaled_alpha, thickness):
+        height, width = dot_weight.shape
+        for y in prange(height):
+            st_y = np.float32((y + np.float32(0.5)) / np.float32(height))
+            for x in range(width):
+                r, g, b = gradient[y, 0], gradient[y, 1], gradient[y, 2]
+                for i in range(wave_y.shape[0]):
+                    # Rows outside the wave's band can't be touched by it
+                    if st_y < bands[i, 0] or st_y > bands[i, 1]:
+                        continue
+                    wy = wave_y[i, x]
+                    e0, e1 = wy + thickness, wy
+                    t0 = min(max((st_y - e0) / (e1 - e0), np.float32(0.0)), np.float32(1.0))
+                    e0, e1 = wy, wy - thickness * np.float32(20.0)
+                    t1 = min(max((st_y - e0) / (e1 - e0), np.float32(0.0)), np.float32(1.0))
+                    alpha = (t0 * t0 * (np.float32(3.0) - np.float32(2.0) * t0)
+                             - t1 * t1 * (np.float32(3.0) - np.float32(2.0) * t1)) * scaled_alpha
+                    r = r * (np.float32(1.0) - alpha) + wave_colors[i, 0] * alpha
+                    g = g * (np.float32(1.0) - alpha) + wave_colors[i, 1] * alpha
+                    b = b * (np.float32(1.0) - alpha) + wave_colors[i, 2] * alpha
+                d = dot_weight[y, x]
+                r = r * (np.float32(1.0) - d) + np.float32(1.3) * d
+                g = g * (np.float32(1.0) - d) + np.float32(1.3) * d
+                b = b * (np.float32(1.0) - d) + np.float32(1.3) * d
+                out[y, x, 0] = np.uint8(np.rint(min(max(r, np.float32(0.0)), np.float32(1.0)) * np.float32(255.0)))
+                out[y, x, 1] = np.uint8(np.rint(min(max(g, np.float32(0.0)), np.float32(1.0)) * np.float32(255.0)))
+                out[y, x, 2] = np.uint8(np.rint(min(max(b, np.float32(0.0)), np.float32(1.0)) * np.float32(255.0)))
+
+def set_thread_limit(threads):
+    """Cap the Numba kernel's thread pool, e.g. to one worker's share of the cores."""
+    if njit is not None:
+        from numba import config, set_num_threads
+        set_num_threads(max(1, min(threads, config.NUMBA_NUM_THREADS)))
+
+########################
+# CPU Renderer
+########################
+
+class CpuRenderer:
+    """
+    Vectorized CPU reimplementation of shaders/wiiU.frag.
+
+    Frames come out in the same bottom-up row order as a GL readback, so they
+    can go through the same encoder pipeline (which flips them) and be compared
+    byte for byte against `fbo.read()`.
+    """
+
+    def __init__(self, width, height, palettes, use_numba=True, line_alpha=1.0, period=None):
+        f32 = np.float32
+        self.width, self.height = width, height
+        self.use_numba = use_numba and njit is not None
+        self.palettes = pack_palettes(palettes)
+        self.period = period
+        self.params = wave_parameters(period)
+        self.scaled_alpha = f32(0.5) * (f32(1.0) - f32(line_alpha)) + f32(line_alpha)
+        self.thickness = f32(THICKNESS)
+
+        self.st_x = ((np.arange(width, dtype=f32) + f32(0.5)) / f32(width)) * (f32(width) / f32(height))
+        self.st_y = (np.arange(height, dtype=f32) + f32(0.5)) / f32(height)
+        self.gradient_t = gradient_weights(height)
+        self.dot_weight = dot_grid_weight(width, height)
+
+        # Vertical band of rows each wave can touch
+        self.bands = wave_bands(self.params)
+
+    def wave_heights(self, elapsed_time):
+        """waveY of every wave at every column, as (NUM_WAVES, width) float32."""
+        offset, amplitude, frequency, flow = (self.params[:, i:i + 1] for i in range(4))
+        phase = frequency * self.st_x[None, :] + np.float32(elapsed_time) * flow
+        return (np.float32(0.5) + offset + amplitude * np.sin(phase)).astype(np.float32)
+
+    def blend_colors(self, palette, next_palette, progress):
+        """Background gradient column (height, 3) and wave colors (NUM_WAVES, 3) for a palette pair."""
+        return blend_palette_colors(self.palettes, self.gradient_t, palette, next_palette, progress)
+
+    def render(self, elapsed_time, palette, next_palette, progress, out=None):
+        """Render one frame as (height, width, 3) uint8, into `out` if given."""
+        if out is None:
+            out = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        gradient, wave_colors = self.blend_colors(palette, next_palette, progress)
+        wave_y = self.wave_heights(elapsed_time)
+        if self.use_numba:
+            _composite_numba(out, gradient, wave_y, wave_colors, self.bands, self.dot_weight,
+                             self.scaled_alpha, self.thickness)
+            return out
+
+        f32 = np.float32
+        color = np.repeat(gradient[:, None, :], self.width, axis=1)
+        for i in range(NUM_WAVES):
+            # Only the rows inside the wave's band can change
+            rows = np.nonzero((self.st_y >= self.bands[i, 0]) & (self.st_y <= self.bands[i, 1]))[0]
+            if len(rows) == 0:
+                continue
+            rows = slice(rows[0], rows[-1] + 1)
+            st_y = self.st_y[rows, None]
+            wy = wave_y[i][None, :]
+            alpha = (smoothstep(wy + self.thickness, wy, st_y)
+                     - smoothstep(wy, wy - self.thickness * f32(20.0), st_y)) * self.scaled_alpha
+            alpha = alpha[..., None]
+            color[rows] = color[rows] * (f32(1.0) - alpha) + wave_colors[i] * alpha
+        dot = self.dot_weight[..., None]
+        color = color * (f32(1.0) - dot) + f32(1.3) * dot
+        np.rint(np.clip(color, 0.0, 1.0) * f32(255.0), out=color)
+        out[...] = color
+        return out
+
+    def render_batch(self, times, palette_a, palette_b, progress):
+        """Render a batch of frames as (len(times), height, width, 3) uint8."""
+        frames = np.empty((len(times), self.height, self.width, 3), dtype=np.uint8)
+        for i in range(len(times)):
+            self.render(times[i], palette_a[i], palette_b[i], progress[i], out=frames[i])
+        return frames
+
+########################
+# Golden Reference Check
+########################
+
+def compare_with_gl(width=640, height=360, times=(0.0, 7.3, 61.0, 1800.0), tolerance=2):
+    """
+    Render a few frames with both the GL shader and the CPU renderer and
+    report the per-channel differences. Returns True if the 99.9th percentile
+    difference is within `tolerance` 8-bit levels.
+
+    The GL side is the INLINE_WAVE_PARAMS variant, which derives the waves
+    with the GPU's own sin() like the original shader, so the CPU's float32
+    wave table is checked too rather than copied into both renderers.
+    """
+    import moderngl
+    from record import FrameRenderer
+
+    rng = np.random.default_rng(0)
+    palettes = [(rng.random(3), rng.random(3), list(rng.random((NUM_WAVES, 3)))) for _ in range(2)]
+    ctx = moderngl.create_standalone_context()
+    gl_renderer = FrameRenderer(ctx, width, height, palettes, inline_wave_params=True)
+    cpu_renderer = CpuRenderer(width, height, palettes)
+
+    worst = 0.0
+    for t in times:
+        for palette, next_palette, progress in ((0, 0, 0.0), (0, 1, 0.37)):
+            gl_renderer.select(palette, next_palette, progress)
+            gl_renderer.render(t)
+            gl_frame = np.frombuffer(gl_renderer.fbo.read(components=3), dtype=np.uint8)
+            gl_frame = gl_frame.reshape(height, width, 3).astype(np.int16)
+            cpu_frame = cpu_renderer.render(t, palette, next_palette, progress).astype(np.int16)
+            diff = np.abs(gl_frame - cpu_frame)
+            p999 = float(np.percentile(diff, 99.9))
+            worst = max(worst, p999)
+            print(f"t={t:>7.1f}s palettes {palette}->{next_palette} @ {progress:.2f}: "
+                  f"max diff {diff.max()}, mean {diff.mean():.3f}, p99.9 {p999:.1f}")
+    ctx.release()
+    return worst <= tolerance
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the CPU renderer against the GL shader.")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--tolerance", type=float, default=2)
+    args = parser.parse_args()
+    if not compare_with_gl(args.width, args.height, tolerance=args.tolerance):
+        print("CPU renderer differs from the GL output beyond tolerance.")
+        exit(1)
+    print("CPU renderer matches the GL output within tolerance.")
@@ -0,0 +1,143 @@
+import queue
+import subprocess
+import threading
+from time import perf_counter
+
+import numpy as np
+import imageio_ffmpeg
+
+
+class FFmpegPipeline:
+    """
+    Producer/consumer pipeline that streams raw frames into an ffmpeg process.
+
+    The render thread takes a preallocated frame buffer with `acquire()`, fills
+    it (e.g. straight from a pixel buffer) and hands it back with `submit()`.
+    A writer thread pushes the raw bytes to ffmpeg's stdin and returns the
+    buffer to the free pool. Only `queue_size` buffers exist, so peak memory is
+    `queue_size` frames and the render thread blocks once all of them are
+    waiting on the encoder.
+
+    GL frames are bottom-up; `vflip=True` lets ffmpeg flip them for free
+    instead of copying every frame through np.flipud.
+    """
+
+    def __init__(self, output_path, width, height, fps, output_params, queue_size=8,
+                 pix_fmt="rgb24", vflip=True, input_params=None):
+        self.output_path = output_path
+        self.queue_size = max(1, queue_size)
+        if pix_fmt == "rgb24":
+            self.frame_shape = (height, width, 3)
+        elif pix_fmt == "yuv420p":
+            self.frame_shape = (height * 3 // 2, width)
+        else:
+            raise ValueError(f"Unsupported input pixel format: {pix_fmt}")
+
+        command = [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", pix_fmt,
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+        ]
+        command += list(input_params or [])
+        if vflip:
+            command += ["-vf", "vflip"]
+        command += list(output_params) + [output_path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for _ in range(self.queue_size):
+            self.free.put(np.empty(self.frame_shape, dtype=np.uint8))
+
+        self.error = None
+        self.frames_written = 0
+        self.render_blocked = 0.0  # Render thread waiting for a free buffer
+        self.writer_idle = 0.0     # Writer thread waiting for a filled buffer
+        self.writer_blocked = 0.0  # Writer thread blocked on ffmpeg's stdin
+        self.start_time = perf_counter()
+
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    @property
+    def peak_memory_bytes(self):
+        return self.queue_size * int(np.prod(self.frame_shape))
+
+    def acquire(self):
+        """Return a free frame buffer, blocking while the encoder is behind."""
+        start = perf_counter()
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"ffmpeg writer failed: {self.error}")
+            try:
+                buffer = self.free.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        self.render_blocked += perf_counter() - start
+        return buffer
+
+    def submit(self, buffer):
+        """Queue a filled buffer obtained from `acquire()` for encoding."""
+        self.filled.put(buffer)
+
+    def write(self, frame):
+        """Copy `frame` into a pipeline buffer and queue it."""
+        buffer = self.acquire()
+        np.copyto(buffer, frame.reshape(self.frame_shape))
+        self.submit(buffer)
+
+    def _write_loop(self):
+        while True:
+            start = perf_counter()
+            buffer = self.filled.get()
+            self.writer_idle += perf_counter() - start
+            if buffer is None:
+                break
+            if self.error is None:
+                start = perf_counter()
+                try:
+                    self.process.stdin.write(memoryview(buffer).cast("B"))
+                    self.frames_written += 1
+                except (BrokenPipeError, OSError) as e:
+                    self.error = e
+                self.writer_blocked += perf_counter() - start
+            self.free.put(buffer)
+
+    def close(self):
+        """Flush queued frames, wait for ffmpeg to finish and return the run stats."""
+        self.filled.put(None)
+        self.thread.join()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        returncode = self.process.wait()
+        if self.error is None and returncode != 0:
+            self.error = RuntimeError(f"ffmpeg exited with code {returncode}")
+        return self.stats()
+
+    def stats(self):
+        return {
+            "frames": self.frames_written,
+            "wall_seconds": perf_counter() - self.start_time,
+            "render_blocked_seconds": self.render_blocked,
+            "writer_idle_seconds": self.writer_idle,
+            "writer_blocked_seconds": self.writer_blocked,
+            "peak_queue_bytes": self.peak_memory_bytes,
+        }
+
+
+def print_pipeline_stats(stats):
+    """Print a short end-of-run report of where each stage spent its time blocked."""
+    wall = max(stats["wall_seconds"], 1e-9)
+    fps = stats["frames"] / wall
+    print(f"Encoded {stats['frames']} frames in {wall:.1f}s ({fps:.1f} fps)")
+    print(f"  Render thread blocked on full queue: {stats['render_blocked_seconds']:.1f}s "
+          f"({100 * stats['render_blocked_seconds'] / wall:.0f}%)")
+    print(f"  Writer idle waiting for frames:      {stats['writer_idle_seconds']:.1f}s "
+          f"({100 * stats['writer_idle_seconds'] / wall:.0f}%)")
+    print(f"  Writer blocked on ffmpeg stdin:      {stats['writer_blocked_seconds']:.1f}s "
+          f"({100 * stats['writer_blocked_seconds'] / wall:.0f}%)")
+    print(f"  Peak frame queue memory: {stats['peak_queue_bytes'] / 2**20:.0f} MB")
@@ -1,29 +1,142 @@
+import os
+import sys
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.cluster import KMeans
 from PIL import Image
 import numpy as np
-from tkinter import Tk, filedialog
+from threadpoolctl import threadpool_limits
 
-def extract_kmean_colors(image_path, num_colors=9):
+try:
+    from numba import njit
+except ImportError:  # Numba is optional, the NumPy histogram is used instead
+    njit = None
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PALETTE_MAX_PIXELS
+
+# Bump whenever a change to the extraction would produce different palettes,
+# so cached palettes from older versions are not reused.
+ALGORITHM_VERSION = 1
+
+def extract_kmean_colors(image_path, num_colors=9, mode="full", bits=5, tol=1e-4, use_numba=True,
+                         max_pixels=None):
     """
     Extracts `num_colors` dominant colors from an image using K-means clustering.
     Sorts the colors to assign the darkest color as the top of the gradient,
     the lightest color as the bottom, and the remaining colors by saturation.
+
+    mode="full" clusters every pixel. mode="fast" first reduces the image to a
+    histogram of colors quantized to `bits` bits per channel and clusters the
+    occupied bins weighted by their pixel counts. `tol` is the K-means
+    convergence tolerance in both modes. With `max_pixels`, larger images are
+    decoded at reduced size (see `load_pixels`).
+    """
+    pixels = load_pixels(image_path, max_pixels)
+
+    if mode == "fast":
+        colors = kmeans_color_histogram(pixels, num_colors, bits=bits, tol=tol, use_numba=use_numba)
+    elif mode == "full":
+        # Perform K-means clustering
+        kmeans = KMeans(n_clusters=num_colors, random_state=42, tol=tol)
+        kmeans.fit(pixels)
+
+        # Get the cluster centers (dominant colors)
+        colors = kmeans.cluster_centers_
+    else:
+        raise ValueError(f"Unknown palette extraction mode: {mode}")
+
+    return sort_palette(colors)
+
+########################
+# Image Loading
+########################
+
+# Pixel layouts of uncompressed rasters that can be sampled straight from the
+# file: raw mode -> (bytes per pixel, R, G, B byte offsets)
+RAW_LAYOUTS = {
+    "RGB": (3, (0, 1, 2)),
+    "BGR": (3, (2, 1, 0)),
+    "RGBX": (4, (0, 1, 2)),
+    "RGBA": (4, (0, 1, 2)),
+    "BGRX": (4, (2, 1, 0)),
+    "BGRA": (4, (2, 1, 0)),
+}
+
+def load_pixels(image_path, max_pixels=None):
     """
-    # Load the image
-    image = Image.open(image_path)
-    image = image.convert("RGB")  # Ensure it's in RGB mode
-    image_data = np.array(image)
+    The image's pixels as an (N, 3) uint8 array, in no particular order.
 
-    # Reshape the image data to a 2D array of pixels
-    pixels = image_data.reshape(-1, 3)
+    With `max_pixels`, images larger than that are reduced while decoding
+    instead of being decoded at full size first:
+    - uncompressed TIFF/BMP rasters are sampled on a regular grid through a
+      memory map, so only the sampled rows are ever read from disk
+    - JPEGs are decoded at 1/2, 1/4 or 1/8 scale (draft mode), then
+      everything else is box-filtered down to the budget with `thumbnail`
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if max_pixels is None or width * height <= max_pixels:
+            return np.asarray(image.convert("RGB")).reshape(-1, 3)
+
+        step = math.ceil(math.sqrt(width * height / max_pixels))
+        pixels = sample_raw_pixels(image, step)
+        if pixels is not None:
+            return pixels
 
-    # Perform K-means clustering
-    kmeans = KMeans(n_clusters=num_colors, random_state=42)
-    kmeans.fit(pixels)
+        scale = math.sqrt(max_pixels / (width * height))
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image.draft("RGB", size)  # Only JPEGs support this; a no-op otherwise
+        image = image.convert("RGB")
+        image.thumbnail(size, Image.BOX)
+        return np.asarray(image).reshape(-1, 3)
 
-    # Get the cluster centers (dominant colors)
-    colors = kmeans.cluster_centers_
+def sample_raw_pixels(image, step):
+    """
+    Every `step`-th pixel of every `step`-th row of an uncompressed,
+    interleaved raster, read through a memory map. None if the file isn't one.
+    """
+    tiles = sorted(image.tile, key=lambda tile: tile[1][1])
+    if not tiles or image.fp is None or not hasattr(image.fp, "fileno"):
+        return None
+    width, height = image.size
+    layouts = set()
+    for codec, extents, offset, args in tiles:
+        rawmode = args[0] if isinstance(args, tuple) else args
+        if codec != "raw" or rawmode not in RAW_LAYOUTS or extents[0] != 0 or extents[2] != width:
+            return None
+        stride = args[1] if isinstance(args, tuple) and len(args) > 1 and args[1] else 0
+        layouts.add((rawmode, stride))
+    if len(layouts) != 1:
+        return None
+    rawmode, stride = layouts.pop()
+    pixel_bytes, channels = RAW_LAYOUTS[rawmode]
+    stride = stride or width * pixel_bytes
 
+    # Strips (TIFF) must follow each other so the raster is one block in the file
+    first_offset = tiles[0][2]
+    if tiles[0][1][1] != 0 or tiles[-1][1][3] != height:
+        return None
+    for _, extents, offset, _ in tiles:
+        if offset != first_offset + extents[1] * stride:
+            return None
+
+    try:
+        raster = np.memmap(image.filename or image.fp.name, dtype=np.uint8, mode="r",
+                           offset=first_offset, shape=(height, stride))
+    except (OSError, ValueError, AttributeError):
+        return None
+    rows = raster[::step, :width * pixel_bytes].reshape(-1, width, pixel_bytes)
+    return np.ascontiguousarray(rows[:, ::step][..., list(channels)]).reshape(-1, 3)
+
+def sort_palette(colors):
+    """
+    Turn 0-255 cluster centers into a (background top, background bottom, waves) palette.
+    """
     # Normalize the colors to 0.0 - 1.0 for use in OpenGL
     normalized_colors = colors / 255.0
 
@@ -48,7 +161,165 @@ def extract_kmean_colors(image_path, num_colors=9):
 
     return background_top_color, background_bottom_color, sorted_colors_by_saturation
 
+def pack_palettes(palettes):
+    """
+    Stack palettes into a (num_palettes, 2 + num_waves, 3) float32 array laid
+    out as (background top, background bottom, wave 0 .. wave n) per row,
+    ready to upload as the shader's palette texture.
+    """
+    return np.array(
+        [np.vstack([bg_top, bg_bottom] + list(waves)) for bg_top, bg_bottom, waves in palettes],
+        dtype="f4",
+    )
+
+########################
+# Histogram-Quantized K-means
+########################
+
+if njit is not None:
+    @njit(cache=True)
+    def _color_histogram_numba(pixels, bits):
+        shift = 8 - bits
+        size = 1 << (3 * bits)
+        counts = np.zeros(size, np.int64)
+        sums = np.zeros((size, 3), np.int64)
+        for i in range(pixels.shape[0]):
+            r = np.int64(pixels[i, 0])
+            g = np.int64(pixels[i, 1])
+            b = np.int64(pixels[i, 2])
+            code = ((r >> shift) << (2 * bits)) | ((g >> shift) << bits) | (b >> shift)
+            counts[code] += 1
+            sums[code, 0] += r
+            sums[code, 1] += g
+            sums[code, 2] += b
+        return counts, sums
+
+def color_histogram(pixels, bits=5, use_numba=True):
+    """
+    Bin uint8 RGB pixels into 2**(3*bits) quantized colors.
+    Returns the mean color of every occupied bin and its pixel count.
+    """
+    if use_numba and njit is not None:
+        counts, sums = _color_histogram_numba(np.ascontiguousarray(pixels, dtype=np.uint8), bits)
+    else:
+        shift = 8 - bits
+        size = 1 << (3 * bits)
+        quantized = pixels.astype(np.int64) >> shift
+        codes = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+        counts = np.bincount(codes, minlength=size)
+        sums = np.stack(
+            [np.bincount(codes, weights=pixels[:, c], minlength=size) for c in range(3)], axis=1
+        )
+    occupied = counts > 0
+    weights = counts[occupied].astype(np.float64)
+    return sums[occupied] / weights[:, None], weights
+
+def kmeans_color_histogram(pixels, num_colors, bits=5, tol=1e-4, use_numba=True):
+    """Weighted K-means over the quantized color histogram of `pixels`."""
+    colors, weights = color_histogram(pixels, bits, use_numba)
+    if len(colors) < num_colors:
+        # Too few distinct colors to form the clusters from bins alone
+        colors, weights = pixels.astype(np.float64), None
+    kmeans = KMeans(n_clusters=num_colors, random_state=42, tol=tol)
+    kmeans.fit(colors, sample_weight=weights)
+    return kmeans.cluster_centers_
+
+########################
+# Batch Extraction
+########################
+
+def _limit_worker_threads(threads):
+    # Each worker gets its share of the cores for BLAS/OpenMP instead of
+    # every worker spawning one thread per core.
+    threadpool_limits(limits=threads)
+
+def iter_palettes(image_paths, num_colors=9, workers=None, progress=None, **options):
+    """
+    Extract palettes for `image_paths` on a process pool and yield them in
+    input order as they become available. `progress(done, total, image_path)`
+    is called as each image finishes. `workers=1` extracts in-process.
+    """
+    image_paths = list(image_paths)
+    total = len(image_paths)
+    cpu_count = os.cpu_count() or 1
+    workers = min(workers or cpu_count, max(1, total))
+
+    if workers <= 1:
+        for done, image_path in enumerate(image_paths, 1):
+            palette = extract_kmean_colors(image_path, num_colors, **options)
+            if progress is not None:
+                progress(done, total, image_path)
+            yield palette
+        return
+
+    lock = threading.Lock()
+    completed = [0]
+
+    def report(image_path):
+        def on_done(future):
+            if progress is None or future.cancelled() or future.exception() is not None:
+                return
+            with lock:
+                completed[0] += 1
+                progress(completed[0], total, image_path)
+        return on_done
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),  # Forking after OpenMP init can deadlock
+        initializer=_limit_worker_threads,
+        initargs=(max(1, cpu_count // workers),),
+    ) as executor:
+        futures = []
+        for image_path in image_paths:
+            future = executor.submit(extract_kmean_colors, image_path, num_colors, **options)
+            future.add_done_callback(report(image_path))
+            futures.append(future)
+        for future in futures:
+            yield future.result()
+
+def extract_palettes(image_paths, num_colors=9, workers=None, progress=None, **options):
+    """List form of `iter_palettes`."""
+    return list(iter_palettes(image_paths, num_colors, workers, progress, **options))
+
+def print_progress(done, total, image_path):
+    print(f"[{done}/{total}] Extracted palette for {os.path.basename(image_path)}")
+
+########################
+# Palette Comparison
+########################
+
+def srgb_to_lab(colors):
+    """Convert 0.0-1.0 sRGB colors (..., 3) to CIE L*a*b* (D65)."""
+    colors = np.asarray(colors, dtype=np.float64)
+    linear = np.where(colors <= 0.04045, colors / 12.92, ((colors + 0.055) / 1.055) ** 2.4)
+    to_xyz = np.array([
+        [0.4124, 0.3576, 0.1805],
+        [0.2126, 0.7152, 0.0722],
+        [0.0193, 0.1192, 0.9505],
+    ])
+    xyz = linear @ to_xyz.T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+def palette_delta_e(palette_a, palette_b):
+    """
+    Per-slot CIE76 color difference between two palettes, in the order
+    (background top, background bottom, wave 0..n).
+    """
+    def stack(palette):
+        bg_top, bg_bottom, waves = palette
+        return np.vstack([bg_top, bg_bottom] + list(waves))
+    return np.linalg.norm(srgb_to_lab(stack(palette_a)) - srgb_to_lab(stack(palette_b)), axis=1)
+
 if __name__ == "__main__":
+    # Only the command line needs Tk; pool workers and headless jobs import this module
+    from tkinter import Tk, filedialog
+
     # Open file dialog to select an image
     Tk().withdraw()  # Hide the root Tkinter window
     image_path = filedialog.askopenfilename(
@@ -67,4 +338,17 @@ if __name__ == "__main__":
         print(f"Background Top Color (Darkest): {background_top_color}")
         print(f"Background Bottom Color (Lightest): {background_bottom_color}")
         for i, color in enumerate(wave_colors):
-            print(f"waveColor{i}: {color}")
\ No newline at end of file
+            print(f"waveColor{i}: {color}")
+
+        # Compare against the histogram-quantized fast mode
+        fast_palette = extract_kmean_colors(image_path, mode="fast")
+        delta_e = palette_delta_e((background_top_color, background_bottom_color, wave_colors), fast_palette)
+        print(f"Fast mode ΔE vs full: max {delta_e.max():.2f}, mean {delta_e.mean():.2f}")
+
+        # Compare against decoding at reduced size
+        # The configured budget, or the suggested one while it is off
+        max_pixels = PALETTE_MAX_PIXELS if PALETTE_MAX_PIXELS is not None else 1_000_000
+        budget_palette = extract_kmean_colors(image_path, max_pixels=max_pixels)
+        delta_e = palette_delta_e((background_top_color, background_bottom_color, wave_colors), budget_palette)
+        print(f"Decoded at {max_pixels} pixels ΔE vs full resolution: "
+              f"max {delta_e.max():.2f}, mean {delta_e.mean():.2f}")
\ No newline at end of file
@@ -0,0 +1,175 @@
+import os
+import sys
+import moderngl
+import pygame
+import numpy as np
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SPRITE_FRAGMENT_SHADER_PATH, SPRITE_VERTEX_SHADER_PATH
+
+# Texture unit for sprites; 0-2 are taken by the wave shader
+SPRITE_TEXTURE_UNIT = 3
+
+
+def load_shader(file_path):
+    with open(file_path, 'r') as file:
+        return file.read()
+
+########################
+# Sprites
+########################
+
+class SpriteRenderer:
+    """Draws textured rectangles over the frame, positioned in window pixels from the top-left."""
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.program = ctx.program(
+            vertex_shader=load_shader(SPRITE_VERTEX_SHADER_PATH),
+            fragment_shader=load_shader(SPRITE_FRAGMENT_SHADER_PATH),
+        )
+        vertices = np.array([[-1.0, -1.0], [1.0, -1.0], [-1.0, 1.0], [1.0, 1.0]], dtype="f4")
+        self.vbo = ctx.buffer(vertices)
+        self.vao = ctx.simple_vertex_array(self.program, self.vbo, "in_position")
+        self.program["spriteTexture"].value = SPRITE_TEXTURE_UNIT
+        self.rect = self.program["rect"]
+        self.tint = self.program["tint"]
+
+    def draw(self, texture, x, y, width, height, screen_size, tint=(1.0, 1.0, 1.0, 1.0)):
+        screen_width, screen_height = screen_size
+        x0 = x / screen_width * 2.0 - 1.0
+        x1 = (x + width) / screen_width * 2.0 - 1.0
+        y0 = 1.0 - (y + height) / screen_height * 2.0
+        y1 = 1.0 - y / screen_height * 2.0
+        self.rect.value = (x0, y0, x1, y1)
+        self.tint.value = tint
+        texture.use(location=SPRITE_TEXTURE_UNIT)
+        self.ctx.enable(moderngl.BLEND)
+        self.ctx.blend_func = moderngl.SRC_ALPHA, moderngl.ONE_MINUS_SRC_ALPHA
+        self.vao.render(moderngl.TRIANGLE_STRIP)
+        self.ctx.disable(moderngl.BLEND)
+
+    def release(self):
+        self.vao.release()
+        self.vbo.release()
+        self.program.release()
+
+########################
+# Text
+########################
+
+class TextOverlay:
+    """
+    A few lines of text drawn with pygame.font into a texture. The texture is
+    only re-uploaded when the text changes, so it costs one quad per frame.
+    """
+
+    def __init__(self, ctx, sprites, font_size=18, padding=6):
+        pygame.font.init()
+        self.ctx = ctx
+        self.sprites = sprites
+        self.font = pygame.font.Font(None, font_size)
+        self.padding = padding
+        self.lines = None
+        self.texture = None
+
+    def set_text(self, lines):
+        if lines == self.lines:
+            return
+        self.lines = list(lines)
+        rendered = [self.font.render(line, True, (255, 255, 255)) for line in self.lines]
+        width = max((surface.get_width() for surface in rendered), default=0) + 2 * self.padding
+        height = sum(surface.get_height() for surface in rendered) + 2 * self.padding
+
+        # Text over a translucent backing so it stays readable on light palettes
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 150))
+        y = self.padding
+        for line in rendered:
+            surface.blit(line, (self.padding, y))
+            y += line.get_height()
+
+        if self.texture is None or self.texture.size != (width, height):
+            if self.texture is not None:
+                self.texture.release()
+            self.texture = self.ctx.texture((width, height), 4)
+        # Flipped, since GL textures start at the bottom row
+        self.texture.write(pygame.image.tobytes(surface, "RGBA", True))
+
+    def draw(self, screen_size, x=8, y=8):
+        if self.texture is not None:
+            width, height = self.texture.size
+            self.sprites.draw(self.texture, x, y, width, height, screen_size)
+
+    def release(self):
+        if self.texture is not None:
+            self.texture.release()
+
+########################
+# Scrub Bar
+########################
+
+class ScrubBar:
+    """
+    Timeline along the bottom of the window with the play head and a time
+    label. Static segments alternate between two grays and transitions are
+    highlighted. Click or drag on it to seek.
+    """
+
+    def __init__(self, ctx, sprites, timeline, screen_size, height=10, margin=16, resolution=2048):
+        self.sprites = sprites
+        self.timeline = timeline
+        self.screen_size = screen_size
+        self.height, self.margin = height, margin
+        self.dragging = False
+
+        # One texel per slice of the mix, colored by the segment playing there
+        times = (np.arange(resolution) + 0.5) / resolution * timeline.duration
+        indices = np.clip(np.searchsorted(timeline.starts, times, side="right") - 1, 0, None)
+        colors = np.where((indices % 2 == 0)[:, None], [[110, 110, 110, 200]], [[150, 150, 150, 200]])
+        colors[timeline.is_transition[indices]] = (255, 190, 60, 220)
+        self.texture = ctx.texture((resolution, 1), 4, colors.astype(np.uint8).tobytes())
+        self.texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+        self.white = ctx.texture((1, 1), 4, bytes([255, 255, 255, 255]))
+        self.label = TextOverlay(ctx, sprites)
+
+    @property
+    def rect(self):
+        screen_width, screen_height = self.screen_size
+        return self.margin, screen_height - self.margin - self.height, screen_width - 2 * self.margin, self.height
+
+    def fraction_at(self, x):
+        left, _, width, _ = self.rect
+        return min(max((x - left) / width, 0.0), 1.0)
+
+    def hit(self, pos):
+        left, top, width, height = self.rect
+        # A few pixels of slack around the thin bar
+        return left - 4 <= pos[0] <= left + width + 4 and top - 8 <= pos[1] <= top + height + 8
+
+    def handle_event(self, event, playback):
+        """Seek on click and drag; returns True if the event was used."""
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and self.hit(event.pos):
+            self.dragging = True
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 1 and self.dragging:
+            self.dragging = False
+        elif not (event.type == pygame.MOUSEMOTION and self.dragging):
+            return False
+        playback.seek_fraction(self.fraction_at(event.pos[0]))
+        return True
+
+    def draw(self, playback, label):
+        left, top, width, height = self.rect
+        self.sprites.draw(self.texture, left, top, width, height, self.screen_size)
+        head = left + playback.time / self.timeline.duration * width
+        self.sprites.draw(self.white, head - 1, top - 4, 3, height + 8, self.screen_size)
+        self.label.set_text([label])
+        label_height = self.label.texture.size[1]
+        self.label.draw(self.screen_size, left, top - 8 - label_height)
+
+    def release(self):
+        self.texture.release()
+        self.white.release()
+        self.label.release()
@@ -0,0 +1,100 @@
+import math
+from time import perf_counter, sleep
+
+# Sleep until this close to a frame deadline, then spin; OS sleeps overshoot by a millisecond or more
+SPIN_SECONDS = 0.002
+
+
+class FrameClock:
+    """
+    Monotonic frame clock for the preview. `tick()` is called once per frame
+    and returns the time since the previous tick; with `target_fps` it first
+    waits for the next frame deadline, so frames come out evenly spaced even
+    when vsync is unavailable.
+    """
+
+    def __init__(self, target_fps=None):
+        self.target_fps = target_fps
+        self.start = perf_counter()
+        self.last = self.start
+        self.deadline = self.start
+        self.delta = 0.0
+        self.frames = 0
+
+    @property
+    def time(self):
+        """Seconds since the clock started."""
+        return self.last - self.start
+
+    def wait(self):
+        if not self.target_fps:
+            return
+        period = 1.0 / self.target_fps
+        self.deadline += period
+        now = perf_counter()
+        if now > self.deadline + period:
+            # More than a frame late: start over instead of rushing to catch up
+            self.deadline = now
+            return
+        remaining = self.deadline - now
+        if remaining > SPIN_SECONDS:
+            sleep(remaining - SPIN_SECONDS)
+        while perf_counter() < self.deadline:
+            pass
+
+    def tick(self):
+        self.wait()
+        now = perf_counter()
+        self.delta = now - self.last
+        self.last = now
+        self.frames += 1
+        return self.delta
+
+
+class AdaptiveScale:
+    """
+    Internal render scale (a fraction of the window size on each axis) that
+    follows the measured frame cost: it drops when frames take longer than
+    `budget_ms` and creeps back up when there's headroom. Cost scales with the
+    pixel count, i.e. with scale squared.
+    """
+
+    def __init__(self, budget_ms, min_scale=0.5, max_scale=1.0, scale=1.0, interval=30, smoothing=0.1):
+        self.budget_ms = budget_ms
+        self.min_scale, self.max_scale = min_scale, max_scale
+        self.scale = min(max(scale, min_scale), max_scale)
+        self.interval = interval
+        self.smoothing = smoothing
+        self.average_ms = None
+        self.frames = 0
+
+    def update(self, frame_ms):
+        """Feed one frame's cost; returns True when the scale changed."""
+        if frame_ms is None:
+            return False
+        if self.average_ms is None:
+            self.average_ms = frame_ms
+        else:
+            self.average_ms += (frame_ms - self.average_ms) * self.smoothing
+        self.frames += 1
+        if self.frames < self.interval:
+            return False
+        self.frames = 0
+
+        # Aim slightly under the budget so small spikes don't cause oscillation
+        ideal = self.scale * math.sqrt(0.9 * self.budget_ms / max(self.average_ms, 1e-3))
+        # Grow slowly, shrink at once
+        ideal = min(ideal, self.scale + 0.05)
+        ideal = min(max(ideal, self.min_scale), self.max_scale)
+        if abs(ideal - self.scale) < 0.02:
+            return False
+        # Costs were measured at the old scale
+        self.average_ms *= (ideal / self.scale) ** 2
+        self.scale = ideal
+        return True
+
+    def size(self, width, height, multiple=8):
+        """Render size for a window, rounded to `multiple` to limit framebuffer reallocations."""
+        def scaled(n):
+            return max(multiple, int(round(n * self.scale / multiple)) * multiple)
+        return scaled(width), scaled(height)
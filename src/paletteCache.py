@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+from extractColors import extract_kmean_colors, iter_palettes, ALGORITHM_VERSION
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PALETTE_CACHE_DIR, PALETTE_CACHE_MAX_BYTES
+
+
+########################
+# Cache Keys
+########################
+
+def palette_cache_key(image_path, num_colors=9, **options):
+    """
+    Content hash of the image bytes plus everything that affects the result:
+    the number of colors, the algorithm version and any extraction options.
+    """
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    # Unset options are left out, so entries cached before an option existed stay valid
+    options = {name: value for name, value in options.items() if value is not None}
+    settings = json.dumps(
+        {"version": ALGORITHM_VERSION, "num_colors": num_colors, **options}, sort_keys=True
+    )
+    digest.update(settings.encode("utf-8"))
+    return digest.hexdigest()
+
+########################
+# Reading / Writing Entries
+########################
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+def _read_entry(path):
+    """Return the cached palette at `path` or None if it is missing or unreadable."""
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        palette = (
+            np.array(entry["bg_top"]),
+            np.array(entry["bg_bottom"]),
+            [np.array(color) for color in entry["waves"]],
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    try:
+        os.utime(path)  # Mark as recently used for eviction
+    except OSError:
+        pass  # Read-only or shared cache: recency is best-effort
+    return palette
+
+def _write_entry(path, palette):
+    bg_top, bg_bottom, waves = palette
+    entry = {
+        "bg_top": [float(c) for c in bg_top],
+        "bg_bottom": [float(c) for c in bg_bottom],
+        "waves": [[float(c) for c in color] for color in waves],
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(entry, f)
+    os.replace(temp_path, path)  # Atomic, so readers never see half an entry
+
+def evict(cache_dir=PALETTE_CACHE_DIR, max_bytes=PALETTE_CACHE_MAX_BYTES):
+    """Delete least recently used entries until the cache fits in `max_bytes`."""
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".json"):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+########################
+# Cached Extraction
+########################
+
+def load_palette(image_path, num_colors=9, cache_dir=PALETTE_CACHE_DIR, **options):
+    """
+    Same result as `extract_kmean_colors(image_path, num_colors, **options)`,
+    served from the on-disk cache when the image has been seen before.
+    Pass `cache_dir=None` to bypass the cache.
+    """
+    if cache_dir is None:
+        return extract_kmean_colors(image_path, num_colors, **options)
+
+    path = _entry_path(cache_dir, palette_cache_key(image_path, num_colors, **options))
+    palette = _read_entry(path)
+    if palette is None:
+        palette = extract_kmean_colors(image_path, num_colors, **options)
+        _store(cache_dir, path, palette)
+    return palette
+
+def load_palettes(image_paths, num_colors=9, cache_dir=PALETTE_CACHE_DIR, workers=None,
+                  progress=None, **options):
+    """
+    Palettes for all `image_paths`, in order. Cache hits are read directly and
+    the misses are extracted in parallel with `iter_palettes`.
+    """
+    image_paths = list(image_paths)
+    palettes = [None] * len(image_paths)
+    paths = [None] * len(image_paths)
+    if cache_dir is not None:
+        for i, image_path in enumerate(image_paths):
+            paths[i] = _entry_path(cache_dir, palette_cache_key(image_path, num_colors, **options))
+            palettes[i] = _read_entry(paths[i])
+
+    missing = [i for i, palette in enumerate(palettes) if palette is None]
+    if len(missing) < len(image_paths):
+        print(f"{len(image_paths) - len(missing)}/{len(image_paths)} palettes loaded from cache.")
+    misses = iter_palettes([image_paths[i] for i in missing], num_colors, workers, progress, **options)
+    for i, palette in zip(missing, misses):
+        palettes[i] = palette
+        if cache_dir is not None:
+            _store(cache_dir, paths[i], palette, evict_entries=False)
+    if cache_dir is not None and missing:
+        evict(cache_dir)
+    return palettes
+
+def _store(cache_dir, path, palette, evict_entries=True):
+    try:
+        _write_entry(path, palette)
+        if evict_entries:
+            evict(cache_dir)
+    except OSError as e:
+        print(f"Warning: could not write palette cache entry {path}: {e}")
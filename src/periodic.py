@@ -0,0 +1,185 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import imageio_ffmpeg
+from extractColors import pack_palettes
+from waves import flow_drift
+from record import (ENCODER_PARAMS, GOP_SECONDS, CHUNK_SECONDS, CHUNK_CACHE_VERSION, PERIOD_SECONDS,
+                    _worker, _init_worker, _render_chunk, render_frames, chunk_encoder_params,
+                    chunk_key, renderer_source, concat_chunks, prune_chunks)
+
+
+########################
+# Loop Planning
+########################
+
+class LoopSchedule:
+    """One static palette from frame 0; stands in for a Timeline when rendering a palette loop."""
+
+    def __init__(self, palette):
+        self.palette = palette
+
+    def schedule(self, fps, start_frame=0, end_frame=None):
+        count = end_frame - start_frame
+        times = np.arange(start_frame, end_frame, dtype=np.float64) / fps
+        palettes = np.full(count, self.palette, dtype=np.int32)
+        return times, palettes, palettes, np.zeros(count)
+
+def period_frames_for(period, fps, gop_frames):
+    """Loop length in frames: `period` seconds rounded to whole GOPs, so loops split on keyframes."""
+    return max(1, round(period * fps / gop_frames)) * gop_frames
+
+def plan_periodic(timeline, fps, period_frames, gop_frames):
+    """
+    Walk the timeline one GOP at a time. A full GOP that shows a single
+    static palette is ("loop", palette, GOP index within that palette's
+    loop); everything else (transitions, GOPs straddling a segment boundary,
+    the final partial GOP) is ("render", start, end), with neighbouring
+    rendered GOPs merged into one range.
+    """
+    total_frames = timeline.frame_count(fps)
+    _, palette_a, palette_b, _ = timeline.schedule(fps)
+    units = []
+    for start in range(0, total_frames, gop_frames):
+        end = min(start + gop_frames, total_frames)
+        a, b = palette_a[start:end], palette_b[start:end]
+        if end - start == gop_frames and (a == b).all() and (a == a[0]).all():
+            units.append(("loop", int(a[0]), (start % period_frames) // gop_frames))
+        elif units and units[-1][0] == "render" and units[-1][2] == start:
+            units[-1] = ("render", units[-1][1], end)
+        else:
+            units.append(("render", start, end))
+    return units
+
+def loop_key(palette_colors, period_frames, width, height, fps, encoder_params, source, renderer_options):
+    """Content hash of one palette loop, like `chunk_key` for timeline chunks."""
+    digest = hashlib.sha256()
+    digest.update(repr((CHUNK_CACHE_VERSION, "loop", period_frames, width, height, fps,
+                        list(encoder_params), sorted(renderer_options.items()))).encode())
+    digest.update(source.encode())
+    digest.update(np.ascontiguousarray(palette_colors).tobytes())
+    return digest.hexdigest()[:32]
+
+########################
+# Loop Rendering
+########################
+
+def split_gops(video_path, output_dir, gop_frames, fps):
+    """Cut a video of fixed-length closed GOPs into one file per GOP (gop_00000.mp4, ...) without re-encoding."""
+    subprocess.run([
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-i", video_path, "-map", "0", "-c", "copy",
+        "-f", "segment", "-segment_format", "mp4",
+        "-segment_time", str(gop_frames / fps),
+        "-segment_time_delta", str(0.5 / fps),   # Split on the keyframe at the boundary
+        "-reset_timestamps", "1",
+        os.path.join(output_dir, "gop_%05d.mp4"),
+    ], check=True)
+
+def _render_loop(palette, loop_dir, period_frames, gop_frames):
+    # Built under a temporary name so an interrupted loop is never reused
+    partial_dir = loop_dir + ".partial"
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+    loop_path = os.path.join(partial_dir, "loop.mp4")
+    render_frames(_worker["renderer"], LoopSchedule(palette), loop_path, 0, period_frames,
+                  _worker["fps"], encoder_params=_worker["encoder_params"])
+    split_gops(loop_path, partial_dir, gop_frames, _worker["fps"])
+    os.remove(loop_path)
+    gops = len([name for name in os.listdir(partial_dir) if name.startswith("gop_")])
+    if gops != period_frames // gop_frames:
+        raise RuntimeError(f"Loop for palette {palette} split into {gops} GOPs, "
+                           f"expected {period_frames // gop_frames}")
+    os.replace(partial_dir, loop_dir)
+
+def _render_job(job):
+    kind, *args = job
+    if kind == "loop":
+        _render_loop(*args)
+    else:
+        _render_chunk(tuple(args))
+    return job
+
+def render_periodic(timeline, palettes, output_path, width, height, fps, workers=1, chunk_dir=None,
+                    period=PERIOD_SECONDS, encoder_params=ENCODER_PARAMS, audio_path=None, **renderer_options):
+    """
+    Render the timeline with the wave flows snapped so the animation repeats
+    every `period` seconds (rounded to whole GOPs). Each palette's loop is
+    rendered once and cut into GOPs; static stretches are assembled from
+    those GOPs by stream copy and only the GOPs around transitions are
+    rendered. Loops and rendered ranges are cached in `chunk_dir` like
+    `render_sharded` chunks. An `audio_path` is muxed in while joining them.
+    """
+    gop_frames = max(1, int(round(GOP_SECONDS * fps)))
+    period_frames = period_frames_for(period, fps, gop_frames)
+    renderer_options = dict(renderer_options, period=period_frames / fps)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    params = chunk_encoder_params(encoder_params, gop_frames, threads)
+    key_params = chunk_encoder_params(encoder_params, gop_frames)
+    source = renderer_source(**renderer_options)
+    packed = pack_palettes(palettes)
+    chunk_frames = max(1, round(CHUNK_SECONDS * fps / gop_frames)) * gop_frames
+
+    if chunk_dir is None:
+        work_dir = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(os.path.abspath(output_path)))
+    else:
+        work_dir = chunk_dir
+        os.makedirs(work_dir, exist_ok=True)
+
+    # The output as a list of files to concat, and the jobs to create the missing ones
+    sequence, jobs, loop_dirs = [], [], {}
+    copied_frames = rendered_frames = 0
+    for unit in plan_periodic(timeline, fps, period_frames, gop_frames):
+        if unit[0] == "loop":
+            _, palette, gop = unit
+            if palette not in loop_dirs:
+                key = loop_key(packed[palette], period_frames, width, height, fps,
+                               key_params, source, renderer_options)
+                loop_dirs[palette] = os.path.join(work_dir, f"loop-{key}")
+                if not os.path.isdir(loop_dirs[palette]):
+                    jobs.append(("loop", palette, loop_dirs[palette], period_frames, gop_frames))
+                    rendered_frames += period_frames
+            sequence.append(os.path.join(loop_dirs[palette], f"gop_{gop:05d}.mp4"))
+            copied_frames += gop_frames
+            continue
+        _, start, end = unit
+        for chunk_start in range(start, end, chunk_frames):
+            chunk_end = min(chunk_start + chunk_frames, end)
+            path = os.path.join(work_dir, chunk_key(timeline, packed, chunk_start, chunk_end, width, height,
+                                                    fps, key_params, source, renderer_options) + ".mp4")
+            if not os.path.exists(path):
+                jobs.append(("chunk", chunk_start, chunk_end, path))
+                rendered_frames += chunk_end - chunk_start
+            sequence.append(path)
+
+    total_frames = timeline.frame_count(fps)
+    print(f"Periodic mode: {period_frames / fps:g}s loops, {copied_frames} of {total_frames} frames "
+          f"copied from {len(loop_dirs)} palette loops; rendering {rendered_frames} frames in {len(jobs)} jobs.")
+    print(f"Snapping the wave speeds to the loop changes them by up to {flow_drift(period_frames / fps):.0%}.")
+
+    try:
+        if jobs:
+            initargs = (timeline, palettes, width, height, fps, params, threads, renderer_options)
+            # Loops first: they are the longest jobs
+            jobs.sort(key=lambda job: job[0] != "loop")
+            if workers > 1:
+                # GL contexts don't survive fork(), so workers always start fresh
+                mp_context = multiprocessing.get_context("spawn")
+                with mp_context.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+                    for done, job in enumerate(pool.imap_unordered(_render_job, jobs), 1):
+                        print(f"Job {done}/{len(jobs)} done ({job[0]})")
+            else:
+                _init_worker(*initargs)
+                for done, job in enumerate(jobs, 1):
+                    _render_job(job)
+                    print(f"Job {done}/{len(jobs)} done ({job[0]})")
+        concat_chunks(sequence, output_path, audio_path)
+        if chunk_dir is not None:
+            prune_chunks(chunk_dir, list(loop_dirs.values()) + sequence)
+    finally:
+        if chunk_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,78 @@
+import pygame
+
+# Seek steps in seconds for the arrow keys (hold Shift for the larger one)
+SEEK_STEP, LARGE_SEEK_STEP = 5.0, 60.0
+MIN_SPEED, MAX_SPEED = 1 / 8, 64.0
+
+
+class Playback:
+    """
+    Play position in the mix with pause, seek and a speed multiplier. The
+    shader is stateless in u_time, so seeking just moves `time`; the next
+    frame renders the new position directly.
+    """
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self.time = 0.0
+        self.speed = 1.0
+        self.paused = False
+
+    def advance(self, delta):
+        """Move forward by a clock delta, looping over the mix."""
+        if not self.paused:
+            self.seek(self.time + delta * self.speed)
+
+    def seek(self, t):
+        self.time = t % self.timeline.duration
+
+    def seek_fraction(self, fraction):
+        self.seek(min(max(fraction, 0.0), 0.9999) * self.timeline.duration)
+
+    def seek_segment(self, offset):
+        """Jump to the start of the segment `offset` away from the current one."""
+        i = self.timeline.index_at(self.time)
+        start, _ = self.timeline.segment_bounds(i)
+        # A little past the start counts as "in" it, so going back twice works
+        if offset < 0 and self.time - start > 1.0:
+            offset += 1
+        i = min(max(i + offset, 0), len(self.timeline) - 1)
+        self.seek(self.timeline.segment_bounds(i)[0])
+
+    def set_speed(self, speed):
+        self.speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+
+    def handle_key(self, event):
+        """
+        Space pause, Left/Right seek (Shift for a minute), PageUp/PageDown
+        previous/next segment, Up/Down double/halve speed, Backspace normal
+        speed, Home/End start/last segment, 0-9 jump to 0-90% of the mix.
+        Returns True if the key was used.
+        """
+        step = LARGE_SEEK_STEP if event.mod & pygame.KMOD_SHIFT else SEEK_STEP
+        key = event.key
+        if key == pygame.K_SPACE:
+            self.paused = not self.paused
+        elif key == pygame.K_LEFT:
+            self.seek(self.time - step)
+        elif key == pygame.K_RIGHT:
+            self.seek(self.time + step)
+        elif key == pygame.K_PAGEUP:
+            self.seek_segment(-1)
+        elif key == pygame.K_PAGEDOWN:
+            self.seek_segment(1)
+        elif key == pygame.K_UP:
+            self.set_speed(self.speed * 2.0)
+        elif key == pygame.K_DOWN:
+            self.set_speed(self.speed / 2.0)
+        elif key == pygame.K_BACKSPACE:
+            self.set_speed(1.0)
+        elif key == pygame.K_HOME:
+            self.seek(0.0)
+        elif key == pygame.K_END:
+            self.seek(self.timeline.segment_bounds(len(self.timeline) - 1)[0])
+        elif pygame.K_0 <= key <= pygame.K_9:
+            self.seek_fraction((key - pygame.K_0) / 10.0)
+        else:
+            return False
+        return True
@@ -4,172 +4,62 @@ import sys
 # Add the root directory to the module search path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from tkinter import Tk, filedialog
+import argparse
+import importlib
+from types import SimpleNamespace
 import moderngl
 import pygame
 import numpy as np
 from pygame.locals import DOUBLEBUF, OPENGL
-from extractColors import extract_kmean_colors  # Import your K-means function
-from time import time
-from config import FRAGMENT_SHADER_PATH, VERTEX_SHADER_PATH
+from paletteCache import load_palettes  # Cached K-means palettes
+from extractColors import print_progress, pack_palettes
+from timeline import format_timestamp
+import waves
+from record import gpu_wave_parameters, with_defines, load_mix
+from profiler import FrameProfiler
+from overlay import SpriteRenderer, TextOverlay, ScrubBar
+from pacing import FrameClock, AdaptiveScale
+from playback import Playback
+from shaderReload import ShaderWatcher, ProgramCache
+from config import (FRAGMENT_SHADER_PATH, VERTEX_SHADER_PATH, PALETTE_MODE, PALETTE_WORKERS,
+                    PALETTE_MAX_PIXELS)
 
 ########################
-# Parsing Durations
+# Preview Settings
 ########################
 
-def parse_durations(file_path):
-    """
-    Parse song segments and transitions from a text file where lines are either:
-      'MM:SS-MM:SS' for a static segment
-      'MM:SS-MM:SS transition' for a transition
-    No 'speed' or BPM concept is used.
-    
-    Example lines:
-      0:00-0:20
-      0:20-0:32 transition
-      0:32-0:52
-      0:52-1:04 transition
-      1:04-1:24
-    """
-    segments = []
-
-    with open(file_path, 'r') as f:
-        lines = [line.strip() for line in f if line.strip()]  # Remove empty lines
-
-    for line in lines:
-        parts = line.split()
-        # Example line: "0:00-1:15" or "0:00-1:15 transition"
-        time_range = parts[0]
-        start_str, end_str = time_range.split('-')
-        start_minutes, start_seconds = map(int, start_str.split(':'))
-        end_minutes, end_seconds = map(int, end_str.split(':'))
-        start_time = start_minutes * 60 + start_seconds
-        end_time = end_minutes * 60 + end_seconds
-
-        if len(parts) > 1 and parts[1].lower() == "transition":
-            # It's a transition segment
-            segments.append({
-                "start": start_time,
-                "end": end_time,
-                "transition": True
-            })
-        else:
-            # Static segment (no speed)
-            segments.append({
-                "start": start_time,
-                "end": end_time
-            })
-
-    return segments
-
-########################
-# Load Images
-########################
-
-def load_images_from_folder(folder_path):
-    """Return all image paths from a folder in sorted order."""
-    supported_formats = [".png", ".jpg", ".jpeg", ".bmp", ".tiff"]
-    image_paths = [
-        os.path.join(folder_path, f)
-        for f in os.listdir(folder_path)
-        if os.path.splitext(f)[-1].lower() in supported_formats
-    ]
-    return sorted(image_paths)
+WINDOW_SIZE = (1600, 900)
+# "vsync" waits for the display refresh, "fixed" sleeps to TARGET_FPS,
+# "off" renders as fast as possible
+PACING = "vsync"
+TARGET_FPS = 60
+# Render offscreen at a fraction of the window size that adapts to keep the
+# GPU time per frame inside the frame budget, then upscale to the window
+ADAPTIVE_SCALE = True
+MIN_SCALE, MAX_SCALE = 0.5, 1.0
+
+# Frame-time overlay in the top-left corner (toggle with F1)
+SHOW_FRAME_STATS = True
+# Timeline scrub bar along the bottom (toggle with F2); click or drag to seek
+SHOW_SCRUB_BAR = True
+# Seconds between overlay text updates
+STATS_INTERVAL = 0.25
+# Recent frames kept for the overlay percentiles and the trace
+PROFILE_WINDOW = 3600
+# Write the per-stage trace here on exit (.csv or .json), None to skip
+PROFILE_TRACE_PATH = None
+# Recompile the shaders when wiiU.vert / wiiU.frag change on disk, and
+# re-upload the wave table when src/waves.py does
+HOT_RELOAD = True
 
 ########################
 # Open Mix Folder
 ########################
 
-Tk().withdraw()  # Hide Tkinter root window
-mix_folder = filedialog.askdirectory(title="Select the Mix Folder")
-
-if not mix_folder:
-    print("No folder selected. Exiting...")
-    exit(1)
-
-album_covers_folder = os.path.join(mix_folder, "Album Covers")
-durations_file = os.path.join(mix_folder, "durations.txt")
-
-# Validate the folder structure
-if not os.path.exists(album_covers_folder):
-    print(f"Error: {album_covers_folder} not found. Exiting...")
-    exit(1)
-if not os.path.exists(durations_file):
-    print(f"Error: {durations_file} not found. Exiting...")
-    exit(1)
-
-# Load data
-image_paths = load_images_from_folder(album_covers_folder)
-segments = parse_durations(durations_file)
-
-if not image_paths:
-    print("No valid images found in the Album Covers folder. Exiting...")
-    exit(1)
-
-########################
-# Assign Palettes
-########################
-
-# We assign a 'palette_id' to each non-transition (static) segment
-palette_index = 0
-for seg in segments:
-    # If it doesn't have "transition", it's a static segment
-    if not seg.get("transition", False):
-        seg["palette_id"] = palette_index
-        palette_index += 1
-
-# Validate the number of static segments matches the covers
-static_segments = [s for s in segments if not s.get("transition", False)]
-if len(static_segments) != len(image_paths):
-    print(f"Error: Number of static segments ({len(static_segments)}) does not match "
-          f"the number of album covers ({len(image_paths)}). Exiting...")
-    exit(1)
-
-# For transitions, find the palettes they blend between
-for i, seg in enumerate(segments):
-    if seg.get("transition", False):
-        # Find previous static
-        prev_static = None
-        for j in range(i - 1, -1, -1):
-            if "palette_id" in segments[j]:
-                prev_static = segments[j]
-                break
-
-        # Find next static
-        next_static = None
-        for j in range(i + 1, len(segments)):
-            if "palette_id" in segments[j]:
-                next_static = segments[j]
-                break
-
-        if not prev_static or not next_static:
-            print("Error: Transition segment without proper static segments before/after.")
-            exit(1)
-
-        seg["start_palette"] = prev_static["palette_id"]
-        seg["end_palette"]   = next_static["palette_id"]
-
-########################
-# Preload Palettes
-########################
-
-print("Preloading palettes...")
-palettes = [extract_kmean_colors(img_path) for img_path in image_paths]
-print("Palettes preloaded.")
-
-########################
-# Initialize Pygame & OpenGL
-########################
-
-pygame.init()
-
-# Request OpenGL 3.3 Core Profile
-pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 3)
-pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 3)
-pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_CORE)
-
-screen = pygame.display.set_mode((1600, 900), DOUBLEBUF | OPENGL)
-ctx = moderngl.create_context()
+def select_mix_folder():
+    from tkinter import Tk, filedialog  # For folder selection
+    Tk().withdraw()  # Hide Tkinter root window
+    return filedialog.askdirectory(title="Select the Mix Folder")
 
 ########################
 # Shader Load Helper
@@ -179,155 +69,279 @@ def load_shader(file_path):
     with open(file_path, 'r') as file:
         return file.read()
 
-vertex_shader = load_shader(VERTEX_SHADER_PATH)
-fragment_shader = load_shader(FRAGMENT_SHADER_PATH)
-
 ########################
-# Compile/Link Shader
+# Palette Functions
 ########################
 
-try:
-    program = ctx.program(
-        vertex_shader=vertex_shader,
-        fragment_shader=fragment_shader,
-    )
-except Exception as e:
-    print(f"Shader compilation/linking error: {e}")
-    pygame.quit()
-    exit(1)
+def upload_palettes(ctx, palettes):
+    """Upload every palette once as a (9, num_palettes) float texture on unit 0."""
+    data = pack_palettes(palettes)
+    texture = ctx.texture((data.shape[1], data.shape[0]), 3, data.tobytes(), dtype="f4")
+    texture.use(location=0)
+    return texture
 
 ########################
-# Setup Geometry
+# Program Setup
 ########################
 
-vertices = np.array([
-    [-1.0, -1.0],
-    [ 1.0, -1.0],
-    [-1.0,  1.0],
-    [ 1.0,  1.0],
-], dtype="f4")
+def set_uniform(program, name, value):
+    """Set a uniform, skipping it if the shader doesn't use it (e.g. mid-edit)."""
+    uniform = program.get(name, None)
+    if uniform is not None:
+        uniform.value = value
 
-vbo = ctx.buffer(vertices)
-vao = ctx.simple_vertex_array(program, vbo, "in_position")
+def configure_program(program, render_size, wave_table):
+    """Uniforms that only change with the render size or the wave code."""
+    set_uniform(program, "u_resolution", render_size)
+    set_uniform(program, "u_lineAlpha", 1.0)
+    set_uniform(program, "paletteTexture", 0)
+    waves.upload_wave_table(program, wave_table)
 
-# Initialize some uniform defaults
-program["u_resolution"].value         = (1600, 900)
-program["u_lineAlpha"].value          = 1.0
-program["transitionProgress"].value   = 0.0
+def frame_uniforms(program):
+    """
+    Handles of the per-frame uniforms, looked up once per program. Uniforms
+    an edited shader doesn't use get a stand-in that ignores the values.
+    """
+    handles = []
+    for name in ("u_time", "transitionProgress", "paletteIndex", "nextPaletteIndex"):
+        uniform = program.get(name, None)
+        handles.append(uniform if uniform is not None else SimpleNamespace(value=None))
+    return tuple(handles)
 
 ########################
-# Palette Functions
+# Frame Stats
 ########################
 
-def set_static_palette(palette):
-    """Set uniform colors for a static (non-transition) segment."""
-    bg_top, bg_bottom, waves = palette
-    program["backgroundTopColor"].value         = tuple(bg_top)
-    program["backgroundBottomColor"].value      = tuple(bg_bottom)
-    program["nextBackgroundTopColor"].value     = tuple(bg_top)
-    program["nextBackgroundBottomColor"].value  = tuple(bg_bottom)
-
-    for i, c in enumerate(waves):
-        program[f"waveColor{i}"].value     = tuple(c)
-        program[f"nextWaveColor{i}"].value = tuple(c)
-
-def update_transition_palettes(start_palette, end_palette):
-    """Blend between two palettes during transition."""
-    bg_top_s,    bg_bottom_s,    waves_s = start_palette
-    bg_top_e,    bg_bottom_e,    waves_e = end_palette
-
-    program["backgroundTopColor"].value         = tuple(bg_top_s)
-    program["backgroundBottomColor"].value      = tuple(bg_bottom_s)
-    program["nextBackgroundTopColor"].value     = tuple(bg_top_e)
-    program["nextBackgroundBottomColor"].value  = tuple(bg_bottom_e)
-
-    for i in range(7):
-        program[f"waveColor{i}"].value     = tuple(waves_s[i])
-        program[f"nextWaveColor{i}"].value = tuple(waves_e[i])
+def frame_stats_lines(profiler, point, render_size, pacing, last=120):
+    """Overlay text: frame rate, frame and draw times over the last `last` frames, resolution and segment."""
+    summary = profiler.summary(last=last)
+    lines = []
+    frame = summary.get("frame")
+    if frame:
+        lines.append(f"{1000.0 / max(frame['mean'], 1e-6):5.1f} fps  frame p50 {frame['p50']:.2f} "
+                     f"p95 {frame['p95']:.2f} p99 {frame['p99']:.2f} ms")
+    for name in ("draw", "gpu_draw", "flip"):
+        if name in summary:
+            lines.append(f"{name:<9} p50 {summary[name]['p50']:.2f}  p95 {summary[name]['p95']:.2f} ms")
+    lines.append(f"render {render_size[0]}x{render_size[1]} ({render_size[0] / WINDOW_SIZE[0]:.0%}), pacing {pacing}")
+    kind = "transition" if point.transition else "static"
+    lines.append(f"segment {point.index} ({kind}) progress {point.progress:.2f}")
+    return lines
+
+def playback_label(playback, timeline):
+    label = f"{format_timestamp(playback.time)} / {format_timestamp(timeline.duration)}  x{playback.speed:g}"
+    if playback.paused:
+        label += "  paused"
+    return label
 
 ########################
-# Main Loop
+# Main
 ########################
 
-start_time = time()
-current_segment_index = 0
-last_log_time = time()
-
-# Initialize the very first segment
-current_segment = segments[current_segment_index]
-if not current_segment.get("transition", False):
-    # It's a static segment
-    program["transitionProgress"].value = 0.0
-    set_static_palette(palettes[current_segment["palette_id"]])
-else:
-    # It's a transition (should be rare as the first segment)
-    sp = palettes[current_segment["start_palette"]]
-    ep = palettes[current_segment["end_palette"]]
-    update_transition_palettes(sp, ep)
-    program["transitionProgress"].value = 0.0
-
-running = True
-
-try:
-    while running:
-        # Handle Pygame events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        # Current time in seconds since start
-        elapsed_time = time() - start_time
-        program["u_time"].value = elapsed_time
-
-        # Figure out where we are in the segment timeline
-        current_segment = segments[current_segment_index]
-        seg_start = current_segment["start"]
-        seg_end   = current_segment["end"]
-        seg_duration = seg_end - seg_start
-        seg_progress = (elapsed_time - seg_start) / seg_duration if seg_duration > 0 else 1.0
-        seg_progress = max(0.0, min(seg_progress, 1.0))
-
-        # Decide if this is a static or transition segment
-        if not current_segment.get("transition", False):
-            # Static segment
-            program["transitionProgress"].value = 0.0
-            # We already set the palette in the code below,
-            # but let's re-set for safety each frame:
-            set_static_palette(palettes[current_segment["palette_id"]])
-
-            # Log once a second
-            if time() - last_log_time >= 1.0:
-                print(f"[STATIC] Segment index: {current_segment_index}, progress: 0.0")
-                last_log_time = time()
-
-        else:
-            # It's a transition
-            program["transitionProgress"].value = seg_progress
-
-            sp = palettes[current_segment["start_palette"]]
-            ep = palettes[current_segment["end_palette"]]
-            update_transition_palettes(sp, ep)
-
-            # Log once a second
-            if time() - last_log_time >= 1.0:
-                print(f"[TRANSITION] Segment index: {current_segment_index}, progress: {seg_progress:.2f}")
-                last_log_time = time()
-
-        # If we've passed the end of the current segment, move on
-        if elapsed_time > seg_end:
-            current_segment_index += 1
-            if current_segment_index >= len(segments):
-                # Start over or exit
-                current_segment_index = 0
-            continue
-
-        # Clear, render, flip
-        ctx.clear(0.0, 0.0, 0.0)
-        vao.render(moderngl.TRIANGLE_STRIP)
-        pygame.display.flip()
-
-except KeyboardInterrupt:
-    print("\nRender loop interrupted by user.")
-finally:
-    pygame.quit()
-    print("Program terminated.")
\ No newline at end of file
+def parse_args():
+    parser = argparse.ArgumentParser(description="Preview the shader animation for a mix in real time.")
+    parser.add_argument("mix_folder", nargs="?", help="Mix folder (asks with a dialog if omitted)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    mix_folder = args.mix_folder or select_mix_folder()
+
+    if not mix_folder:
+        print("No folder selected. Exiting...")
+        exit(1)
+
+    # Same validation and loading as record.py
+    try:
+        timeline, image_paths = load_mix(mix_folder)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e} Exiting...")
+        exit(1)
+
+    # Preload palettes
+    print("Preloading palettes...")
+    palettes = load_palettes(image_paths, mode=PALETTE_MODE, workers=PALETTE_WORKERS,
+                             max_pixels=PALETTE_MAX_PIXELS, progress=print_progress)
+    print("Palettes preloaded.")
+
+    # Initialize Pygame & OpenGL
+    pygame.init()
+
+    # Request OpenGL 3.3 Core Profile
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 3)
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 3)
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_CORE)
+
+    pacing = PACING
+    try:
+        screen = pygame.display.set_mode(WINDOW_SIZE, DOUBLEBUF | OPENGL, vsync=1 if pacing == "vsync" else 0)
+    except pygame.error:
+        print("Vsync is not available, pacing frames with a timer instead.")
+        pacing = "fixed"
+        screen = pygame.display.set_mode(WINDOW_SIZE, DOUBLEBUF | OPENGL)
+    ctx = moderngl.create_context()
+
+    # Setup geometry
+    vertices = np.array([
+        [-1.0, -1.0],
+        [ 1.0, -1.0],
+        [-1.0,  1.0],
+        [ 1.0,  1.0],
+    ], dtype="f4")
+
+    vbo = ctx.buffer(vertices)
+
+    # Compile/link shader; programs are cached by source so reloads can reuse them
+    programs = ProgramCache(ctx, vbo)
+    try:
+        program, vao = programs.get(load_shader(VERTEX_SHADER_PATH),
+                                    with_defines(load_shader(FRAGMENT_SHADER_PATH), waves.wave_defines()))
+        wave_table = gpu_wave_parameters(ctx)
+    except Exception as e:
+        print(f"Shader compilation/linking error: {e}")
+        pygame.quit()
+        exit(1)
+    configure_program(program, WINDOW_SIZE, wave_table)
+    u_time, transition_progress, palette_index, next_palette_index = frame_uniforms(program)
+    shader_status = None
+
+    # Palettes live on the GPU; per frame we only pick two of them
+    palette_texture = upload_palettes(ctx, palettes)
+
+    watcher = ShaderWatcher([VERTEX_SHADER_PATH, FRAGMENT_SHADER_PATH, waves.__file__]).start() if HOT_RELOAD else None
+
+    # Per-stage frame timings, shown in the overlay instead of printing
+    profiler = FrameProfiler(ctx, max_frames=PROFILE_WINDOW)
+    sprites = SpriteRenderer(ctx)
+    stats_overlay = TextOverlay(ctx, sprites)
+    show_stats = SHOW_FRAME_STATS
+
+    # Offscreen target at the adaptive internal resolution
+    if ADAPTIVE_SCALE:
+        scale = AdaptiveScale(1000.0 / TARGET_FPS, MIN_SCALE, MAX_SCALE, scale=MAX_SCALE)
+    else:
+        scale = AdaptiveScale(1000.0 / TARGET_FPS, 1.0, 1.0)
+    render_target = render_texture = None
+
+    # Frames are timed by the clock (and paced by it in "fixed" mode);
+    # the play position follows it at the playback speed
+    clock = FrameClock(TARGET_FPS if pacing == "fixed" else None)
+    playback = Playback(timeline)
+    scrub_bar = ScrubBar(ctx, sprites, timeline, WINDOW_SIZE)
+    show_scrub_bar = SHOW_SCRUB_BAR
+    last_stats_time = 0.0
+
+    running = True
+
+    try:
+        while running:
+            # Handle Pygame events
+            with profiler.stage("events"):
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        running = False
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_F1:
+                        show_stats = not show_stats
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+                        show_scrub_bar = not show_scrub_bar
+                    elif event.type == pygame.KEYDOWN:
+                        playback.handle_key(event)
+                    elif show_scrub_bar:
+                        scrub_bar.handle_event(event, playback)
+
+            # Swap in the edited shaders; palettes and the timeline stay as they are
+            sources = watcher.poll() if watcher is not None else None
+            if sources is not None:
+                with profiler.stage("reload"):
+                    try:
+                        # The wave table comes from waves.py, which may be the file that changed
+                        importlib.reload(waves)
+                        vertex_source, fragment_source = sources[:2]
+                        program, vao = programs.get(vertex_source, with_defines(fragment_source, waves.wave_defines()))
+                        wave_table = gpu_wave_parameters(ctx)
+                        configure_program(program, scale.size(*WINDOW_SIZE), wave_table)
+                        u_time, transition_progress, palette_index, next_palette_index = frame_uniforms(program)
+                        shader_status = None
+                        print("Shaders reloaded.")
+                    except Exception as e:
+                        # Keep drawing with the last program that compiled
+                        shader_status = str(e).strip().splitlines()[0] if str(e).strip() else "compile error"
+                        print(f"Reload error, keeping the previous shaders and wave table:\n{e}")
+
+            with profiler.stage("uniforms"):
+                # u_time is the play position, so every frame matches record.py at that timestamp
+                playback.advance(clock.delta)
+                u_time.value = playback.time
+
+                # Figure out where we are in the segment timeline, in O(log n)
+                point = timeline.at(playback.time)
+                transition_progress.value = point.progress
+                palette_index.value       = point.palette
+                next_palette_index.value  = point.next_palette
+
+            # Reallocate the offscreen target when the scale changed
+            render_size = scale.size(*WINDOW_SIZE)
+            if render_target is None or render_target.size != render_size:
+                if render_target is not None:
+                    render_target.release()
+                    render_texture.release()
+                render_texture = ctx.texture(render_size, 3)
+                render_target = ctx.framebuffer(color_attachments=[render_texture])
+                set_uniform(program, "u_resolution", render_size)
+
+            # Clear, render offscreen
+            with profiler.gpu("draw"):
+                render_target.use()
+                ctx.clear(0.0, 0.0, 0.0)
+                vao.render(moderngl.TRIANGLE_STRIP)
+
+            # Bilinear upscale to the window
+            with profiler.stage("upscale"):
+                ctx.screen.use()
+                sprites.draw(render_texture, 0, 0, *WINDOW_SIZE, WINDOW_SIZE)
+
+            if show_stats:
+                with profiler.stage("overlay"):
+                    if clock.time - last_stats_time >= STATS_INTERVAL:
+                        lines = frame_stats_lines(profiler, point, render_size, pacing)
+                        if shader_status:
+                            lines.append(f"shader error (showing last good): {shader_status[:80]}")
+                        stats_overlay.set_text(lines)
+                        last_stats_time = clock.time
+                    stats_overlay.draw(WINDOW_SIZE)
+
+            if show_scrub_bar:
+                with profiler.stage("scrub_bar"):
+                    scrub_bar.draw(playback, playback_label(playback, timeline))
+
+            with profiler.stage("flip"):
+                pygame.display.flip()
+            clock.tick()
+            profiler.end_frame()
+
+            # GPU time drives the scale; frame time is pinned to the refresh under vsync
+            gpu_time = profiler.latest("gpu_draw")
+            scale.update(gpu_time * 1000.0 if gpu_time is not None else None)
+
+    except KeyboardInterrupt:
+        print("\nRender loop interrupted by user.")
+    finally:
+        profiler.print_summary()
+        if PROFILE_TRACE_PATH:
+            profiler.export(PROFILE_TRACE_PATH)
+            print(f"Frame trace written to {PROFILE_TRACE_PATH}")
+        if render_target is not None:
+            render_target.release()
+            render_texture.release()
+        if watcher is not None:
+            watcher.stop()
+        programs.release()
+        scrub_bar.release()
+        stats_overlay.release()
+        sprites.release()
+        palette_texture.release()
+        pygame.quit()
+        print("Program terminated.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import csv
+import json
+from time import perf_counter
+from contextlib import contextmanager, nullcontext
+from collections import deque
+import numpy as np
+
+_NULL_CONTEXT = nullcontext()
+
+
+class FrameProfiler:
+    """
+    Per-frame wall time of each named stage of a render loop, plus GPU time
+    measured with timer queries.
+
+    Wrap each stage in `with profiler.stage("name"):` (or `profiler.gpu("name")`
+    for GPU work) and call `end_frame()` once per frame. Timer queries are kept
+    in a small ring and read a few frames later, so measuring the GPU never
+    stalls the pipeline. With `enabled=False` every call is a no-op.
+
+    `max_frames` keeps only the most recent frames (for long-running loops
+    like the preview); None keeps everything.
+    """
+
+    def __init__(self, ctx=None, enabled=True, gpu_timing=True, max_frames=None, query_depth=4):
+        self.enabled = enabled
+        self.frames = deque(maxlen=max_frames)
+        self.current = {}
+        self.frame_index = 0
+        self.frame_start = perf_counter()
+
+        self.queries = []
+        if enabled and gpu_timing and ctx is not None:
+            self.queries = [ctx.query(time=True) for _ in range(query_depth)]
+        self.query_owners = [None] * len(self.queries)  # (frame record, stage) per query
+        self.next_query = 0
+
+    @contextmanager
+    def _timed(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.current[name] = self.current.get(name, 0.0) + perf_counter() - start
+
+    def stage(self, name):
+        """Time a CPU-side stage of the current frame."""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timed(name)
+
+    @contextmanager
+    def _gpu_timed(self, name):
+        slot = self.next_query
+        self.next_query = (slot + 1) % len(self.queries)
+        self._collect(slot)
+        query = self.queries[slot]
+        self.query_owners[slot] = (self.current, "gpu_" + name)
+        with self._timed(name):
+            with query:
+                yield
+
+    def gpu(self, name):
+        """Time a stage on the CPU and, when timer queries are available, on the GPU."""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        if not self.queries:
+            return self._timed(name)
+        return self._gpu_timed(name)
+
+    def _collect(self, slot):
+        owner = self.query_owners[slot]
+        if owner is not None:
+            record, name = owner
+            record[name] = self.queries[slot].elapsed / 1e9  # Nanoseconds
+            self.query_owners[slot] = None
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        now = perf_counter()
+        self.current["frame"] = now - self.frame_start
+        self.frame_start = now
+        self.frames.append(self.current)
+        self.current = {}
+        self.frame_index += 1
+
+    def latest(self, name):
+        """Most recent recorded time of a stage in seconds (GPU times arrive a few frames late)."""
+        for i, record in enumerate(reversed(self.frames)):
+            if name in record:
+                return record[name]
+            if i > len(self.queries):
+                break
+        return None
+
+    def flush(self):
+        """Read back the timer queries still in flight."""
+        for slot in range(len(self.queries)):
+            self._collect(slot)
+
+    ########################
+    # Reporting
+    ########################
+
+    def stages(self):
+        names = []
+        for record in self.frames:
+            for name in record:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def summary(self, last=None):
+        """{stage: {"p50", "p95", "p99", "mean"}} in milliseconds, over the last `last` frames."""
+        frames = list(self.frames)[-last:] if last else list(self.frames)
+        result = {}
+        for name in self.stages():
+            values = np.array([record[name] for record in frames if name in record]) * 1000.0
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {"p50": float(p50), "p95": float(p95), "p99": float(p99),
+                            "mean": float(values.mean())}
+        return result
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"{'stage':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+        for name, stats in summary.items():
+            print(f"{name:<18}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['mean']:>10.3f}")
+
+    def export(self, path):
+        """Write the per-frame trace as CSV, or as JSON (trace plus summary) for a .json path."""
+        self.flush()
+        names = self.stages()
+        if os.path.splitext(path)[1].lower() == ".json":
+            with open(path, 'w') as f:
+                json.dump({"stages": names, "frames": list(self.frames), "summary": self.summary()}, f)
+            return
+        with open(path, 'w', newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame"] + [f"{name}_ms" for name in names])
+            first = self.frame_index - len(self.frames)
+            for i, record in enumerate(self.frames):
+                writer.writerow([first + i] + [
+                    f"{record[name] * 1000.0:.4f}" if name in record else "" for name in names
+                ])
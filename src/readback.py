@@ -0,0 +1,56 @@
+import numpy as np
+from collections import deque
+
+
+class PixelBufferRing:
+    """
+    Ring of pixel pack buffers for reading frames back from the GPU without
+    stalling the render loop.
+
+    `fbo.read_into(buffer)` only queues the copy into a GPU-side buffer; the
+    buffer is mapped `size` frames later, by which point the driver has long
+    finished with it and the draw calls for the following frames are already
+    in flight.
+    """
+
+    def __init__(self, ctx, fbo, size=3, components=3):
+        width, height = fbo.size
+        self.fbo = fbo
+        self.components = components
+        self.shape = (height, width, components)
+        self.frame_bytes = width * height * components
+        self.buffers = [ctx.buffer(reserve=self.frame_bytes) for _ in range(max(1, size))]
+        self.pending = deque()  # Slots holding frames that have not been mapped yet
+        self.next_slot = 0
+
+    @property
+    def full(self):
+        """True when the next `queue()` would overwrite an unread frame."""
+        return len(self.pending) == len(self.buffers)
+
+    def queue(self):
+        """Queue an asynchronous readback of the framebuffer's current contents."""
+        if self.full:
+            raise RuntimeError("Pixel buffer ring is full; pop() a frame before queueing another.")
+        slot = self.next_slot
+        self.fbo.read_into(self.buffers[slot], components=self.components)
+        self.pending.append(slot)
+        self.next_slot = (slot + 1) % len(self.buffers)
+
+    def pop(self, out=None):
+        """
+        Map the oldest queued frame and return it as a (height, width, components)
+        uint8 array. If `out` is given the pixels are copied straight into it.
+        """
+        slot = self.pending.popleft()
+        if out is not None:
+            self.buffers[slot].read_into(out)
+            return out
+        data = self.buffers[slot].read()
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.shape)
+
+    def release(self):
+        for buffer in self.buffers:
+            buffer.release()
+        self.buffers = []
+        self.pending.clear()
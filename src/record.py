@@ -1,39 +1,103 @@
 import os
+import re
+import sys
+import math
+import shutil
+import hashlib
+import inspect
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
 import moderngl
 import numpy as np
-from PIL import Image
-import imageio
-from time import time
-from tkinter import Tk, filedialog  # For folder selection
-from extractColors import extract_kmean_colors
+import imageio_ffmpeg
+from paletteCache import load_palettes
+from extractColors import print_progress, pack_palettes
+from readback import PixelBufferRing
+from encoder import FFmpegPipeline, print_pipeline_stats
+from timeline import Timeline, format_timestamp
+from cpuRenderer import CpuRenderer, set_thread_limit
+from profiler import FrameProfiler
+import waves
 # Add the root directory to the module search path
-import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import FRAGMENT_SHADER_PATH, VERTEX_SHADER_PATH
+from config import (FRAGMENT_SHADER_PATH, VERTEX_SHADER_PATH, YUV_FRAGMENT_SHADER_PATH,
+                    PALETTE_MODE, PALETTE_WORKERS, PALETTE_MAX_PIXELS)
 
 
 ########################
-# Parsing Durations
+# Render Settings
 ########################
 
-def parse_durations(file_path):
-    segments = []
-    with open(file_path, 'r') as f:
-        lines = [line.strip() for line in f if line.strip()]
-    for line in lines:
-        parts = line.split()
-        time_range = parts[0]
-        start_str, end_str = time_range.split('-')
-        start_minutes, start_seconds = map(int, start_str.split(':'))
-        end_minutes, end_seconds = map(int, end_str.split(':'))
-        start_time = start_minutes * 60 + start_seconds
-        end_time = end_minutes * 60 + end_seconds
-        if len(parts) > 1 and parts[1].lower() == "transition":
-            segments.append({"start": start_time, "end": end_time, "transition": True})
-        else:
-            segments.append({"start": start_time, "end": end_time})
-    return segments
+WIDTH, HEIGHT = 1920, 1080
+FPS = 60
+# Number of pixel buffers kept in flight between draw and readback.
+# 0 falls back to a synchronous fbo.read() after every frame.
+READBACK_BUFFERS = 3
+# Preallocated frames queued between the render thread and the ffmpeg writer.
+# Bounds peak memory (FRAME_QUEUE_SIZE * WIDTH * HEIGHT * 3 bytes) and
+# blocks the render loop once the encoder falls behind.
+FRAME_QUEUE_SIZE = 8
+# Worker processes for timeline-sharded rendering (1 renders in-process)
+WORKERS = 1
+# Keyframe interval in seconds. Sharded chunks always start on a GOP boundary
+# so they can be joined without re-encoding.
+GOP_SECONDS = 2
+# Chunks handed to each worker, so fast workers pick up the slack of slow ones
+CHUNKS_PER_WORKER = 4
+# Length of the chunks kept between runs for resumable, incremental renders
+# (rounded to whole GOPs). Shorter chunks re-render less after a change but
+# add more files to concat.
+CHUNK_SECONDS = 30
+# Bump when a change outside the shader or encoder settings alters the output
+CHUNK_CACHE_VERSION = 2
+# Loop length for --periodic, in seconds (rounded to whole GOPs). The wave
+# speeds are snapped so the animation repeats exactly after it, which changes
+# the slowest wave's speed by up to ~31% at 120 s (~7% at 300 s, <1% at
+# 3000 s; see waves.flow_drift). Longer periods stay closer to a normal render
+# but make each palette's loop longer to render, and a loop longer than a
+# palette's segments saves nothing.
+PERIOD_SECONDS = 120
+# Bake the background gradient (per palette) and dot grid into textures once
+# and only draw the animated waves per frame
+CACHED_LAYERS = False
+# "gl" renders with the shader; "cpu" uses the NumPy/Numba reimplementation in
+# cpuRenderer.py and needs no GL driver at all
+BACKEND = "gl"
+# Convert frames to YUV 4:2:0 on the GPU and pipe them to ffmpeg as yuv420p:
+# half the readback of RGB and no swscale conversion on the CPU
+GPU_YUV = False
+
+# ffmpeg output options for the final video
+ENCODER_PARAMS = [
+    "-c:v", "libx264",
+    "-pix_fmt", "yuv420p",        # YUV 4:2:0 format
+    "-crf", "18",                 # High-quality compression
+    "-preset", "slow",            # Balances speed and quality
+    "-profile:v", "high",         # High profile for H.264
+    "-level", "4.2",              # Compatible level
+    "-b:v", "12M",                # Target bitrate for 1080p60
+    "-maxrate", "15M",            # Max bitrate for buffering
+    "-bufsize", "24M",            # Larger buffer size for smoother encoding
+    "-movflags", "faststart",     # Ensures playback starts immediately
+]
+
+# Color tags for frames converted by shaders/yuv420.frag
+YUV_COLOR_PARAMS = [
+    "-colorspace", "bt709",
+    "-color_primaries", "bt709",
+    "-color_trc", "bt709",
+    "-color_range", "tv",
+]
+
+# Audio muxed into the output: a file with one of these extensions in the mix
+# folder is picked up automatically, and encoded in the same ffmpeg pass
+AUDIO_EXTENSIONS = [".wav", ".flac", ".mp3", ".m4a", ".aac", ".ogg", ".opus"]
+AUDIO_PARAMS = ["-c:a", "aac", "-b:a", "320k"]
+# Warn when durations.txt and the audio differ by more than this many seconds
+AUDIO_MISMATCH_SECONDS = 1.0
 
 ########################
 # Load Images
@@ -44,199 +108,750 @@ def load_images_from_folder(folder_path):
     return sorted([os.path.join(folder_path, f) for f in os.listdir(folder_path) if os.path.splitext(f)[-1].lower() in supported_formats])
 
 ########################
-# Setup Moderngl Context
+# Shader Rendering
 ########################
 
-WIDTH, HEIGHT = 1920, 1080
-FPS = 60
-
-ctx = moderngl.create_standalone_context()
-
 # Load vertex and fragment shaders
 def load_shader(file_path):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Shader file not found: {file_path}")
     with open(file_path, 'r') as f:
         return f.read()
-    
-vertex_shader = load_shader(VERTEX_SHADER_PATH)
-fragment_shader = load_shader(FRAGMENT_SHADER_PATH)
 
-program = ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
+def with_defines(source, defines):
+    """Insert `#define` lines right after the `#version` directive of a shader."""
+    if not defines:
+        return source
+    lines = source.splitlines()
+    for i, line in enumerate(lines):
+        if line.strip().startswith("#version"):
+            break
+    else:
+        i = -1
+    lines[i + 1:i + 1] = [f"#define {name}" for name in defines]
+    return "\n".join(lines) + "\n"
+
+def gpu_wave_parameters(ctx, period=None):
+    """
+    The (NUM_WAVES, 4) wave table of waves.wave_parameters(), computed by the
+    WAVE_TABLE variant of wiiU.frag instead: the original shader's math with
+    the GPU's sin(), which float32 NumPy only approximates. With a `period`
+    the flows are snapped with waves.snap_flows.
+    """
+    program = ctx.program(
+        vertex_shader=load_shader(VERTEX_SHADER_PATH),
+        fragment_shader=with_defines(load_shader(FRAGMENT_SHADER_PATH), ["WAVE_TABLE"] + waves.wave_defines()),
+    )
+    vbo = ctx.buffer(np.array([[-1.0, -1.0], [1.0, -1.0], [-1.0, 1.0], [1.0, 1.0]], dtype="f4"))
+    vao = ctx.simple_vertex_array(program, vbo, "in_position")
+    fbo = ctx.framebuffer(color_attachments=[ctx.texture((waves.NUM_WAVES, 1), 4, dtype="f4")])
+    fbo.use()
+    vao.render(moderngl.TRIANGLE_STRIP)
+    params = np.frombuffer(fbo.read(components=4, dtype="f4"), dtype=np.float32).reshape(waves.NUM_WAVES, 4).copy()
+    for resource in (vao, fbo.color_attachments[0], fbo, vbo, program):
+        resource.release()
+    if period:
+        params = waves.snap_flows(params, period)
+    return params
+
+class FrameRenderer:
+    """Draws the wave shader into an offscreen framebuffer at a fixed resolution."""
+
+    def __init__(self, ctx, width, height, palettes, cached_layers=False, gpu_yuv=False,
+                 inline_wave_params=False, period=None):
+        if gpu_yuv and (width % 2 or height % 2):
+            raise ValueError(f"YUV 4:2:0 output needs an even width and height, got {width}x{height}")
+        self.ctx = ctx
+        self.width, self.height = width, height
+        self.cached_layers = cached_layers
+        self.gpu_yuv = gpu_yuv
+        # Loop period in seconds when the wave flows are snapped to repeat (see waves.snap_flows)
+        self.period = period
+        defines = ["CACHED_LAYERS"] if cached_layers else []
+        if inline_wave_params:
+            # The original per-fragment wave math, as a reference for equivalence checks
+            defines.append("INLINE_WAVE_PARAMS")
+        self.program = self.create_program(defines)
+        vertices = np.array([[-1.0, -1.0], [1.0, -1.0], [-1.0, 1.0], [1.0, 1.0]], dtype="f4")
+        self.vbo = ctx.buffer(vertices)
+        self.vao = ctx.simple_vertex_array(self.program, self.vbo, "in_position")
+        self.fbo = ctx.framebuffer(color_attachments=[ctx.texture((width, height), 4)])
+
+        self.set_uniform("u_resolution", (width, height))
+        self.set_uniform("u_lineAlpha", 1.0)
+        # Computed with the GPU's own sin(), so the table matches the original shader exactly
+        self.wave_table = gpu_wave_parameters(ctx, period)
+        waves.upload_wave_table(self.program, self.wave_table)
+
+        # Per-frame uniforms, looked up once
+        self.u_time = self.program["u_time"]
+        self.transition_progress = self.program["transitionProgress"]
+        self.palette_index = self.program["paletteIndex"]
+        self.next_palette_index = self.program["nextPaletteIndex"]
+
+        # Texture units: 0 palettes, 1 dot mask, 2 baked gradients, 4 frame for the YUV pass
+        # (rebound by every render, see bind)
+        self.palette_texture = None
+        self.dot_mask = None
+        self.gradients = None
+        self.set_palettes(palettes)
+
+        # Frames are read back from `output_fbo`: the RGB frame itself, or its
+        # yuv420p conversion packed into a width x height*3/2 R8 texture
+        self.output_fbo = self.fbo
+        self.output_components = 3
+        if gpu_yuv:
+            self.yuv_program = ctx.program(
+                vertex_shader=load_shader(VERTEX_SHADER_PATH),
+                fragment_shader=load_shader(YUV_FRAGMENT_SHADER_PATH),
+            )
+            self.yuv_vao = ctx.simple_vertex_array(self.yuv_program, self.vbo, "in_position")
+            self.yuv_fbo = ctx.framebuffer(color_attachments=[ctx.texture((width, height * 3 // 2), 1)])
+            self.fbo.color_attachments[0].use(location=4)
+            self.yuv_program["rgbFrame"].value = 4
+            self.yuv_program["u_frameSize"].value = (width, height)
+            self.output_fbo = self.yuv_fbo
+            self.output_components = 1
+
+    def create_program(self, defines):
+        return self.ctx.program(
+            vertex_shader=load_shader(VERTEX_SHADER_PATH),
+            fragment_shader=with_defines(load_shader(FRAGMENT_SHADER_PATH), defines + waves.wave_defines()),
+        )
+
+    def set_uniform(self, name, value, program=None):
+        """Set a uniform, skipping it if the shader variant doesn't use it."""
+        uniform = (program or self.program).get(name, None)
+        if uniform is not None:
+            uniform.value = value
+
+    def set_palettes(self, palettes):
+        """Upload every palette once as a (9, num_palettes) float texture."""
+        if self.palette_texture is not None:
+            self.palette_texture.release()
+        data = pack_palettes(palettes)
+        self.num_palettes = len(data)
+        self.palette_texture = self.ctx.texture((data.shape[1], data.shape[0]), 3, data.tobytes(), dtype="f4")
+        self.palette_texture.use(location=0)
+        self.set_uniform("paletteTexture", 0)
+        if self.cached_layers:
+            self.bake_layers()
+
+    def bake_layers(self):
+        """
+        Render the time-invariant layers once: one background gradient column
+        per palette and the palette-independent dot-grid mask.
+        """
+        ctx = self.ctx
+        if self.dot_mask is None:
+            # Dot grid depends only on the resolution
+            dots_program = self.create_program(["BAKE_DOTS"])
+            self.set_uniform("u_resolution", (self.width, self.height), dots_program)
+            self.dot_mask = ctx.texture((self.width, self.height), 1, dtype="f4")
+            fbo = ctx.framebuffer(color_attachments=[self.dot_mask])
+            fbo.use()
+            vao = ctx.simple_vertex_array(dots_program, self.vbo, "in_position")
+            vao.render(moderngl.TRIANGLE_STRIP)
+            vao.release()
+            fbo.release()
+            dots_program.release()
+
+        # The gradient only varies along y, so one column per palette is enough.
+        # Transitions mix two columns, which equals the gradient of the mixed colors.
+        if self.gradients is not None:
+            self.gradients.release()
+        gradient_program = self.create_program(["BAKE_GRADIENT"])
+        self.set_uniform("u_resolution", (self.width, self.height), gradient_program)
+        self.set_uniform("paletteTexture", 0, gradient_program)
+        self.gradients = ctx.texture((self.num_palettes, self.height), 4, dtype="f4")
+        fbo = ctx.framebuffer(color_attachments=[self.gradients])
+        fbo.use()
+        vao = ctx.simple_vertex_array(gradient_program, self.vbo, "in_position")
+        vao.render(moderngl.TRIANGLE_STRIP)
+        vao.release()
+        fbo.release()
+        gradient_program.release()
+
+        self.dot_mask.use(location=1)
+        self.gradients.use(location=2)
+        self.set_uniform("dotMask", 1)
+        self.set_uniform("backgroundGradients", 2)
+
+    def select(self, palette, next_palette, progress):
+        """Blend from `palette` to `next_palette` by `progress` (equal ids for static segments)."""
+        self.palette_index.value = palette
+        self.next_palette_index.value = next_palette
+        self.transition_progress.value = progress
+
+    def bind(self):
+        """
+        Bind this renderer's textures to their units. Renderers sharing a
+        context (batch workers, benchmarks) overwrite each other's bindings.
+        """
+        self.palette_texture.use(location=0)
+        if self.cached_layers:
+            self.dot_mask.use(location=1)
+            self.gradients.use(location=2)
+        if self.gpu_yuv:
+            self.fbo.color_attachments[0].use(location=4)
+
+    def render(self, elapsed_time):
+        self.bind()
+        self.u_time.value = elapsed_time
+        self.fbo.use()
+        self.ctx.clear(0.0, 0.0, 0.0)
+        self.vao.render(moderngl.TRIANGLE_STRIP)
+        if self.gpu_yuv:
+            self.yuv_fbo.use()
+            self.yuv_vao.render(moderngl.TRIANGLE_STRIP)
+
+    def release(self):
+        """Free the GPU objects; the context itself belongs to the caller."""
+        resources = [self.vao, self.program, self.fbo, self.fbo.color_attachments[0], self.vbo,
+                     self.palette_texture, self.dot_mask, self.gradients]
+        if self.gpu_yuv:
+            resources += [self.yuv_vao, self.yuv_program, self.yuv_fbo, self.yuv_fbo.color_attachments[0]]
+        for resource in resources:
+            if resource is not None:
+                resource.release()
+
+def create_renderer(width, height, palettes, backend=BACKEND, cached_layers=CACHED_LAYERS, gpu_yuv=GPU_YUV,
+                    period=None, ctx=None):
+    """Renderer for the chosen backend; GL renderers get their own standalone context unless given `ctx`."""
+    if backend == "cpu":
+        return CpuRenderer(width, height, palettes, period=period)
+    if backend != "gl":
+        raise ValueError(f"Unknown render backend: {backend}")
+    if ctx is None:
+        ctx = moderngl.create_standalone_context()
+    return FrameRenderer(ctx, width, height, palettes, cached_layers, gpu_yuv, period=period)
+
+class FrameEncoder:
+    """
+    Reads frames back from `fbo` (through a pixel buffer ring when
+    `readback_buffers` > 0) and encodes them with ffmpeg. `gpu_yuv` frames
+    are already converted, top-down and in yuv420p, so ffmpeg only encodes.
+    Without an `fbo` (the CPU backend) frames go straight to `writer`.
+    """
+
+    def __init__(self, ctx, fbo, components, output_path, width, height, fps,
+                 encoder_params=ENCODER_PARAMS, gpu_yuv=False, audio_path=None,
+                 readback_buffers=READBACK_BUFFERS, frame_queue_size=FRAME_QUEUE_SIZE):
+        self.output_path = output_path
+        self.fbo, self.components = fbo, components
+        input_params, output_params = audio_params(audio_path)
+        output_params += list(encoder_params)
+        if gpu_yuv:
+            self.writer = FFmpegPipeline(output_path, width, height, fps, output_params + YUV_COLOR_PARAMS,
+                                         queue_size=frame_queue_size, pix_fmt="yuv420p", vflip=False,
+                                         input_params=input_params)
+        else:
+            self.writer = FFmpegPipeline(output_path, width, height, fps, output_params,
+                                         queue_size=frame_queue_size, input_params=input_params)
+        self.ring = None
+        if readback_buffers > 0 and fbo is not None:
+            self.ring = PixelBufferRing(ctx, fbo, size=readback_buffers, components=components)
+
+    def read_back(self, profiler):
+        """Hand the frame just drawn to the encoder (ffmpeg or the YUV pass flips it upright)."""
+        if self.ring is None:
+            with profiler.stage("encoder_wait"):
+                buffer = self.writer.acquire()
+            with profiler.stage("readback"):
+                self.fbo.read_into(buffer, components=self.components)
+            with profiler.stage("submit"):
+                self.writer.submit(buffer)
+            return
+        # Map the oldest frame in the ring while the newer ones are still rendering
+        if self.ring.full:
+            with profiler.stage("encoder_wait"):
+                buffer = self.writer.acquire()
+            with profiler.stage("readback"):
+                self.ring.pop(out=buffer)
+            with profiler.stage("submit"):
+                self.writer.submit(buffer)
+        with profiler.stage("readback_queue"):
+            self.ring.queue()
+
+    def flush(self):
+        """Encode the frames still in flight."""
+        if self.ring is not None:
+            while self.ring.pending:
+                self.writer.submit(self.ring.pop(out=self.writer.acquire()))
+
+    def close(self):
+        """Finish encoding and free the ring; returns the encoder pipeline stats."""
+        stats = self.writer.close()
+        if self.ring is not None:
+            self.ring.release()
+        return stats
+
+    def check(self):
+        if self.writer.error is not None:
+            raise RuntimeError(f"Encoding {self.output_path} failed: {self.writer.error}")
+
+def frame_schedule(renderer, timeline, fps, start_frame, end_frame):
+    """
+    (times, palette_a, palette_b, progress) lists for frames [start_frame,
+    end_frame), computed up front. For a looping renderer the time wraps at
+    its period.
+    """
+    times, palette_a, palette_b, progress = timeline.schedule(fps, start_frame, end_frame)
+    if renderer.period:
+        # The animation repeats, so wrap the time from the frame number: exact,
+        # and keeps u_time small for float32
+        period_frames = int(round(renderer.period * fps))
+        times = (np.arange(start_frame, end_frame) % period_frames) / fps
+    return tuple(column.tolist() for column in (times, palette_a, palette_b, progress))
+
+def render_frames(renderer, timeline, output_path, start_frame, end_frame, fps,
+                  encoder_params=ENCODER_PARAMS, readback_buffers=READBACK_BUFFERS,
+                  frame_queue_size=FRAME_QUEUE_SIZE, profiler=None, audio_path=None):
+    """
+    Render frames [start_frame, end_frame) of the timeline and encode them to
+    `output_path`. Returns the encoder pipeline stats.
+
+    Pass a FrameProfiler to time each stage of the loop per frame, and an
+    `audio_path` to mux that audio into the output in the same ffmpeg run.
+    """
+    cpu_backend = isinstance(renderer, CpuRenderer)
+    if cpu_backend:
+        encoder = FrameEncoder(None, None, 3, output_path, renderer.width, renderer.height, fps,
+                               encoder_params, audio_path=audio_path, frame_queue_size=frame_queue_size)
+    else:
+        encoder = FrameEncoder(renderer.ctx, renderer.output_fbo, renderer.output_components, output_path,
+                               renderer.width, renderer.height, fps, encoder_params, renderer.gpu_yuv,
+                               audio_path, readback_buffers, frame_queue_size)
+    if profiler is None:
+        profiler = FrameProfiler(enabled=False)
+    times, palette_a, palette_b, progress = frame_schedule(renderer, timeline, fps, start_frame, end_frame)
+
+    try:
+        for i, elapsed_time in enumerate(times):
+            if cpu_backend:
+                # Rendered straight into the encoder's buffer, bottom-up like a GL readback
+                with profiler.stage("encoder_wait"):
+                    buffer = encoder.writer.acquire()
+                with profiler.stage("render"):
+                    renderer.render(elapsed_time, palette_a[i], palette_b[i], progress[i], out=buffer)
+                with profiler.stage("submit"):
+                    encoder.writer.submit(buffer)
+                profiler.end_frame()
+                continue
+
+            with profiler.stage("uniforms"):
+                renderer.select(palette_a[i], palette_b[i], progress[i])
+            with profiler.gpu("draw"):
+                renderer.render(elapsed_time)
+            encoder.read_back(profiler)
+            profiler.end_frame()
+        encoder.flush()
+    finally:
+        stats = encoder.close()
+    encoder.check()
+    return stats
 
-vertices = np.array([[-1.0, -1.0], [1.0, -1.0], [-1.0, 1.0], [1.0, 1.0]], dtype="f4")
-vbo = ctx.buffer(vertices)
-vao = ctx.simple_vertex_array(program, vbo, "in_position")
+########################
+# Timeline-Sharded Rendering
+########################
 
-fbo = ctx.framebuffer(color_attachments=[ctx.texture((WIDTH, HEIGHT), 4)])
-fbo.use()
+# Per-process state for sharded render workers
+_worker = {}
+
+def limit_worker_threads(threads):
+    """Cap the render threads of a worker process (llvmpipe and Numba)."""
+    # llvmpipe and Numba spawn one thread per core by default; with one
+    # renderer per worker that oversubscribes the machine.
+    os.environ.setdefault("LP_NUM_THREADS", str(threads))
+    set_thread_limit(threads)
+
+def _init_worker(timeline, palettes, width, height, fps, encoder_params, threads, renderer_options):
+    limit_worker_threads(threads)
+    _worker["renderer"] = create_renderer(width, height, palettes, **renderer_options)
+    _worker["timeline"] = timeline
+    _worker["fps"] = fps
+    _worker["encoder_params"] = encoder_params
+
+def _render_chunk(chunk):
+    start_frame, end_frame, output_path = chunk
+    # Render under a temporary name so an interrupted chunk is never mistaken for a finished one
+    root, ext = os.path.splitext(output_path)
+    partial_path = root + ".partial" + ext
+    render_frames(_worker["renderer"], _worker["timeline"], partial_path,
+                  start_frame, end_frame, _worker["fps"], encoder_params=_worker["encoder_params"])
+    os.replace(partial_path, output_path)
+    return chunk
+
+def split_into_chunks(total_frames, gop_frames, num_chunks):
+    """Split [0, total_frames) into at most `num_chunks` ranges that start on GOP boundaries."""
+    gops = math.ceil(total_frames / gop_frames)
+    gops_per_chunk = max(1, math.ceil(gops / max(1, num_chunks)))
+    chunk_frames = gops_per_chunk * gop_frames
+    return [(start, min(start + chunk_frames, total_frames))
+            for start in range(0, total_frames, chunk_frames)]
+
+def chunk_encoder_params(encoder_params, gop_frames, threads=None):
+    """Encoder options that make every chunk a run of closed, fixed-length GOPs."""
+    params = list(encoder_params)
+    params += [
+        "-g", str(gop_frames),
+        "-keyint_min", str(gop_frames),
+        "-sc_threshold", "0",         # No extra keyframes on scene cuts
+        "-flags", "+cgop",            # Closed GOPs so chunks decode on their own
+    ]
+    if threads is not None:
+        params += ["-threads", str(threads)]
+    return params
+
+def concat_chunks(chunk_paths, output_path, audio_path=None):
+    """
+    Join encoded chunks with ffmpeg's concat demuxer, copying the video
+    stream. An `audio_path` is encoded and muxed in during the same pass.
+    """
+    list_path = output_path + ".chunks.txt"
+    with open(list_path, 'w') as f:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    input_params, output_params = audio_params(audio_path)
+    try:
+        subprocess.run([
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path, *input_params,
+            *output_params, "-c:v", "copy", "-movflags", "faststart", output_path,
+        ], check=True)
+    finally:
+        os.remove(list_path)
+
+def fixed_length_chunks(total_frames, chunk_frames):
+    """Split [0, total_frames) into ranges of `chunk_frames` that don't move when the mix gets longer."""
+    return [(start, min(start + chunk_frames, total_frames))
+            for start in range(0, total_frames, chunk_frames)]
+
+def renderer_source(backend=BACKEND, gpu_yuv=GPU_YUV, **_):
+    """Source code that determines the rendered pixels of a backend."""
+    if backend == "cpu":
+        import cpuRenderer
+        return inspect.getsource(waves) + inspect.getsource(cpuRenderer)
+    # The wave table uploaded to the shader is computed by waves.py
+    source = inspect.getsource(waves) + load_shader(VERTEX_SHADER_PATH) + load_shader(FRAGMENT_SHADER_PATH)
+    if gpu_yuv:
+        source += load_shader(YUV_FRAGMENT_SHADER_PATH)
+    return source
+
+def chunk_key(timeline, packed_palettes, start_frame, end_frame, width, height, fps,
+              encoder_params, source, renderer_options):
+    """
+    Content hash of one chunk: its frame range, the timeline schedule and
+    colors of the palettes it touches, the renderer source, the output format
+    and the encoder settings. Anything else in the mix can change without
+    invalidating it.
+    """
+    _, palette_a, palette_b, progress = timeline.schedule(fps, start_frame, end_frame)
+    # Palettes by content rather than id, so inserting a cover elsewhere keeps this chunk
+    used, local_ids = np.unique(np.concatenate([palette_a, palette_b]), return_inverse=True)
+    digest = hashlib.sha256()
+    digest.update(repr((CHUNK_CACHE_VERSION, start_frame, end_frame, width, height, fps,
+                        list(encoder_params), sorted(renderer_options.items()))).encode())
+    digest.update(source.encode())
+    digest.update(np.ascontiguousarray(packed_palettes[used]).tobytes())
+    digest.update(local_ids.astype(np.int32).tobytes())
+    digest.update(progress.astype(np.float64).tobytes())
+    return digest.hexdigest()[:32]
+
+# Names prune_chunks may delete: chunks and loop folders named by chunk_key /
+# periodic.loop_key, and their partial renders. Anything else in the chunk
+# folder (which the user may point anywhere) is left alone.
+CHUNK_NAME = re.compile(r"[0-9a-f]{32}(\.partial)?\.mp4")
+LOOP_NAME = re.compile(r"loop-[0-9a-f]{32}(\.partial)?")
+
+def prune_chunks(chunk_dir, keep_paths):
+    """Delete chunks, loop folders and leftover partial renders that the current mix no longer uses."""
+    keep = {os.path.abspath(path) for path in keep_paths}
+    for name in os.listdir(chunk_dir):
+        path = os.path.abspath(os.path.join(chunk_dir, name))
+        if path in keep:
+            continue
+        if CHUNK_NAME.fullmatch(name) and os.path.isfile(path):
+            os.remove(path)
+        elif LOOP_NAME.fullmatch(name) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+def render_sharded(timeline, palettes, output_path, width, height, fps, workers=WORKERS,
+                   chunk_dir=None, encoder_params=ENCODER_PARAMS, audio_path=None, **renderer_options):
+    """
+    Render the timeline in chunks, each worker process with its own renderer
+    (and standalone GL context), then join the chunks without re-encoding.
+    `renderer_options` are passed on to `create_renderer`.
+
+    With a `chunk_dir`, chunks are CHUNK_SECONDS long, named by `chunk_key`
+    and kept there between runs: a re-run only renders chunks that are missing
+    (e.g. after an interruption) or whose inputs changed, and reuses the rest.
+    Without one, chunks go to a temporary folder that is removed afterwards.
+    An `audio_path` is muxed in while joining the chunks.
+    """
+    total_frames = timeline.frame_count(fps)
+    gop_frames = max(1, int(round(GOP_SECONDS * fps)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    params = chunk_encoder_params(encoder_params, gop_frames, threads)
+
+    if chunk_dir is None:
+        chunks = split_into_chunks(total_frames, gop_frames, workers * CHUNKS_PER_WORKER)
+        work_dir = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(os.path.abspath(output_path)))
+        paths = [os.path.join(work_dir, f"chunk_{i:05d}.mp4") for i in range(len(chunks))]
+    else:
+        # Whole GOPs per chunk, so every chunk starts on a keyframe
+        chunk_frames = max(1, round(CHUNK_SECONDS * fps / gop_frames)) * gop_frames
+        chunks = fixed_length_chunks(total_frames, chunk_frames)
+        os.makedirs(chunk_dir, exist_ok=True)
+        packed = pack_palettes(palettes)
+        # Threads don't change the output, so they stay out of the key
+        key_params = chunk_encoder_params(encoder_params, gop_frames)
+        source = renderer_source(**renderer_options)
+        paths = [
+            os.path.join(chunk_dir, chunk_key(timeline, packed, start, end, width, height, fps,
+                                              key_params, source, renderer_options) + ".mp4")
+            for start, end in chunks
+        ]
+    jobs = [(start, end, path) for (start, end), path in zip(chunks, paths) if not os.path.exists(path)]
+    if len(jobs) < len(chunks):
+        print(f"Reusing {len(chunks) - len(jobs)} of {len(chunks)} rendered chunks.")
+
+    try:
+        if jobs:
+            print(f"Rendering {sum(end - start for start, end, _ in jobs)} of {total_frames} frames "
+                  f"in {len(jobs)} chunks across {workers} workers...")
+            initargs = (timeline, palettes, width, height, fps, params, threads, renderer_options)
+            if workers > 1:
+                # GL contexts don't survive fork(), so workers always start fresh
+                mp_context = multiprocessing.get_context("spawn")
+                with mp_context.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+                    for done, (start, end, _) in enumerate(pool.imap_unordered(_render_chunk, jobs), 1):
+                        print(f"Chunk {done}/{len(jobs)} done (frames {start}-{end - 1})")
+            else:
+                _init_worker(*initargs)
+                for done, job in enumerate(jobs, 1):
+                    start, end, _ = _render_chunk(job)
+                    print(f"Chunk {done}/{len(jobs)} done (frames {start}-{end - 1})")
+        concat_chunks(paths, output_path, audio_path)
+        if chunk_dir is not None:
+            prune_chunks(chunk_dir, paths)
+    finally:
+        if chunk_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 ########################
-# Initialize Uniforms
+# Load Mix
 ########################
 
-program["u_resolution"].value = (WIDTH, HEIGHT)
-program["u_lineAlpha"].value = 1.0
-program["transitionProgress"].value = 0.0
+def load_mix(mix_folder):
+    """
+    Timeline and cover paths of a mix folder. Raises FileNotFoundError for a
+    missing folder or durations.txt, ValueError for an invalid timeline or one
+    that doesn't match the covers.
+    """
+    album_covers_folder = os.path.join(mix_folder, "Album Covers")
+    durations_file = os.path.join(mix_folder, "durations.txt")
+    if not os.path.exists(album_covers_folder):
+        raise FileNotFoundError(f"{album_covers_folder} not found.")
+    if not os.path.exists(durations_file):
+        raise FileNotFoundError(f"{durations_file} not found.")
+
+    image_paths = load_images_from_folder(album_covers_folder)
+    if not image_paths:
+        raise ValueError(f"No valid images found in {album_covers_folder}.")
+    timeline = Timeline.from_file(durations_file)
+    if timeline.num_palettes != len(image_paths):
+        raise ValueError(f"Number of static segments ({timeline.num_palettes}) does not match "
+                         f"the number of album covers ({len(image_paths)}).")
+    return timeline, image_paths
 
 ########################
-# Select Folder for Mix
+# Encoder Settings
 ########################
 
-Tk().withdraw()  # Hide the Tkinter root window
-mix_folder = filedialog.askdirectory(title="Select the Mix Folder")
-
-if not mix_folder:
-    print("No folder selected. Exiting...")
-    exit(1)
-
-album_covers_folder = os.path.join(mix_folder, "Album Covers")
-durations_file = os.path.join(mix_folder, "durations.txt")
-
-# Validate the folder structure
-if not os.path.exists(album_covers_folder):
-    print(f"Error: {album_covers_folder} not found. Exiting...")
-    exit(1)
-if not os.path.exists(durations_file):
-    print(f"Error: {durations_file} not found. Exiting...")
-    exit(1)
-
-# Load data
-image_paths = load_images_from_folder(album_covers_folder)
-segments = parse_durations(durations_file)
-
-palettes = [extract_kmean_colors(img) for img in image_paths]
-palette_index = 0
-for seg in segments:
-    if not seg.get("transition", False):
-        seg["palette_id"] = palette_index
-        palette_index += 1
-for i, seg in enumerate(segments):
-    if seg.get("transition", False):
-        prev_static = next_static = None
-        for j in range(i - 1, -1, -1):
-            if "palette_id" in segments[j]:
-                prev_static = segments[j]
-                break
-        for j in range(i + 1, len(segments)):
-            if "palette_id" in segments[j]:
-                next_static = segments[j]
-                break
-        seg["start_palette"] = prev_static["palette_id"]
-        seg["end_palette"] = next_static["palette_id"]
-
-########################
-# Palette Handling Functions
-########################
-
-def set_static_palette(palette):
-    """Set uniform colors for a static (non-transition) segment."""
-    bg_top, bg_bottom, waves = palette
-    program["backgroundTopColor"].value = tuple(bg_top)
-    program["backgroundBottomColor"].value = tuple(bg_bottom)
-    for i, color in enumerate(waves):
-        program[f"waveColor{i}"].value = tuple(color)
-
-def update_transition_palettes(start_palette, end_palette):
-    """Blend between two palettes during a transition."""
-    bg_top_s, bg_bottom_s, waves_s = start_palette
-    bg_top_e, bg_bottom_e, waves_e = end_palette
-
-    # Assign the transition palettes
-    program["backgroundTopColor"].value = tuple(bg_top_s)
-    program["backgroundBottomColor"].value = tuple(bg_bottom_s)
-    program["nextBackgroundTopColor"].value = tuple(bg_top_e)
-    program["nextBackgroundBottomColor"].value = tuple(bg_bottom_e)
-    for i in range(len(waves_s)):
-        program[f"waveColor{i}"].value = tuple(waves_s[i])
-        program[f"nextWaveColor{i}"].value = tuple(waves_e[i])
-
-########################
-# Main Rendering Loop
-########################
-
-frame_index = 0  # Track the number of frames rendered
-output_path = os.path.join(mix_folder, "output.mp4")
-writer = imageio.get_writer(
-    output_path,
-    fps=FPS,
-    codec="libx264",
-    quality=10,
-    ffmpeg_params=[
-        "-pix_fmt", "yuv420p",        # YUV 4:2:0 format
-        "-crf", "18",                 # High-quality compression
-        "-preset", "slow",            # Balances speed and quality
-        "-profile:v", "high",         # High profile for H.264
-        "-level", "4.2",              # Compatible level
-        "-b:v", "12M",                # Target bitrate for 1080p60
-        "-maxrate", "15M",            # Max bitrate for buffering
-        "-bufsize", "24M",            # Larger buffer size for smoother encoding
-        "-movflags", "faststart"      # Ensures playback starts immediately
-    ]
-)
-
-start_time = time()
-current_segment_index = 0
-running = True
-
-# Initialize the first segment (static or transition)
-current_segment = segments[current_segment_index]
-if not current_segment.get("transition", False):
-    program["transitionProgress"].value = 0.0
-    set_static_palette(palettes[current_segment["palette_id"]])
-else:
-    start_palette = palettes[current_segment["start_palette"]]
-    end_palette = palettes[current_segment["end_palette"]]
-    update_transition_palettes(start_palette, end_palette)
-    program["transitionProgress"].value = 0.0
-
-try:
-    while running:
-        # Determine elapsed time based on frame count
-        elapsed_time = frame_index / FPS
-        program["u_time"].value = elapsed_time
-
-        # Determine current segment
-        current_segment = segments[current_segment_index]
-        seg_start = current_segment["start"]
-        seg_end = current_segment["end"]
-
-        # Update segment progress
-        seg_progress = (elapsed_time - seg_start) / (seg_end - seg_start)
-        seg_progress = max(0.0, min(seg_progress, 1.0))
-
-        if not current_segment.get("transition", False):
-            # Static palette
-            program["transitionProgress"].value = 0.0
-            set_static_palette(palettes[current_segment["palette_id"]])
+def override_params(params, overrides):
+    """ffmpeg options with the values of `overrides` (flag, value, flag, value, ...) swapped in or appended."""
+    params = list(params)
+    for flag, value in zip(overrides[::2], overrides[1::2]):
+        if flag in params:
+            params[params.index(flag) + 1] = str(value)
         else:
-            # Transition palette
-            program["transitionProgress"].value = seg_progress
-            start_palette = palettes[current_segment["start_palette"]]
-            end_palette = palettes[current_segment["end_palette"]]
-            update_transition_palettes(start_palette, end_palette)
-
-        # Move to the next segment if necessary
-        if elapsed_time > seg_end:
-            current_segment_index += 1
-            if current_segment_index >= len(segments):
-                break
-
-        # Render to framebuffer
-        ctx.clear(0.0, 0.0, 0.0)
-        vao.render(moderngl.TRIANGLE_STRIP)
+            params += [flag, str(value)]
+    return params
+
+########################
+# Audio
+########################
+
+def find_audio(mix_folder):
+    """
+    The mix audio: the one file in the mix folder with an AUDIO_EXTENSIONS
+    extension, or None. Raises ValueError if there are several.
+    """
+    found = sorted(name for name in os.listdir(mix_folder)
+                   if os.path.splitext(name)[-1].lower() in AUDIO_EXTENSIONS)
+    if len(found) > 1:
+        raise ValueError(f"Several audio files in {mix_folder} ({', '.join(found)}); pick one with --audio.")
+    return os.path.join(mix_folder, found[0]) if found else None
+
+def probe_duration(path):
+    """Duration of a media file in seconds, from ffmpeg's stream info."""
+    result = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-i", path],
+                            capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match is None:
+        raise ValueError(f"Could not read the duration of {path}.")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def fit_to_audio(timeline, audio_path):
+    """
+    The timeline cut to the length of the audio, or padded by holding the
+    last palette, so the video ends with it; segment timings are never
+    scaled. Warns when durations.txt and the audio disagree by more
+    than AUDIO_MISMATCH_SECONDS, which usually means a wrong timestamp.
+    """
+    audio_duration = probe_duration(audio_path)
+    difference = timeline.duration - audio_duration
+    if difference > AUDIO_MISMATCH_SECONDS:
+        print(f"Warning: durations.txt runs {difference:.1f}s past the end of {os.path.basename(audio_path)} "
+              f"({format_timestamp(audio_duration)}); the video is cut to the audio.")
+    elif difference < -AUDIO_MISMATCH_SECONDS:
+        print(f"Warning: durations.txt ends {-difference:.1f}s before {os.path.basename(audio_path)} "
+              f"({format_timestamp(audio_duration)}); the last palette is held until the audio ends.")
+    return timeline.with_duration(audio_duration)
+
+def audio_params(audio_path):
+    """Extra ffmpeg (input, output) options that mux `audio_path` next to the video on input 0."""
+    if audio_path is None:
+        return [], []
+    return ["-i", audio_path], ["-map", "0:v:0", "-map", "1:a:0"] + AUDIO_PARAMS
 
-        # Capture frame
-        image_data = fbo.read(components=3)
-        frame = np.frombuffer(image_data, dtype=np.uint8).reshape(HEIGHT, WIDTH, 3)
-        frame = np.flipud(frame)  # Correct upside-down issue
-        writer.append_data(frame)
+########################
+# Select Folder for Mix
+########################
 
-        # Increment frame index
-        frame_index += 1
+def select_mix_folder():
+    from tkinter import Tk, filedialog  # For folder selection
+    Tk().withdraw()  # Hide the Tkinter root window
+    return filedialog.askdirectory(title="Select the Mix Folder")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render the shader animation for a mix to video.")
+    parser.add_argument("mix_folder", nargs="?", help="Mix folder (asks with a dialog if omitted)")
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Render timeline chunks in this many processes")
+    parser.add_argument("--cached-layers", action="store_true", default=CACHED_LAYERS,
+                        help="Bake the gradient and dot grid once and only draw the waves per frame")
+    parser.add_argument("--backend", choices=["gl", "cpu"], default=BACKEND,
+                        help="Render with the GL shader or the CPU reference renderer")
+    parser.add_argument("--gpu-yuv", action="store_true", default=GPU_YUV,
+                        help="Convert frames to YUV 4:2:0 (BT.709) on the GPU and read back half the data")
+    parser.add_argument("--periodic", action="store_true",
+                        help="Snap the wave speeds to a loop, render one loop per palette and build "
+                             "static segments by copying it; only transitions are rendered fresh")
+    parser.add_argument("--period", type=float, default=PERIOD_SECONDS,
+                        help="Loop length in seconds for --periodic")
+    parser.add_argument("--output", help="Output path (default: output.mp4 in the mix folder)")
+    parser.add_argument("--audio", help="Audio to mux into the video (default: the audio file in the mix folder)")
+    parser.add_argument("--no-audio", action="store_true", help="Render a silent video")
+    parser.add_argument("--renditions", metavar="LIST",
+                        help="Render once at the largest of these sizes (e.g. 2160p,1080p,720p or WxH) and "
+                             "encode each one from a GPU-downscaled copy with its own bitrate, in a single "
+                             "pass; --width and --height are ignored")
+    parser.add_argument("--profile", metavar="TRACE",
+                        help="Time every stage of the render loop and write the per-frame trace "
+                             "to TRACE (.csv or .json); renders in a single pass without the chunk cache")
+    parser.add_argument("--chunk-dir",
+                        help="Where finished chunks are kept between runs (default: .chunks in the mix folder)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Render from scratch without reusing or keeping chunks")
+    return parser.parse_args()
 
-except KeyboardInterrupt:
-    print("Rendering interrupted by user.")
-finally:
-    writer.close()
-    print(f"Rendering completed. Video saved to {output_path}")
\ No newline at end of file
+########################
+# Main
+########################
+
+def main():
+    args = parse_args()
+    mix_folder = args.mix_folder or select_mix_folder()
+
+    if not mix_folder:
+        print("No folder selected. Exiting...")
+        exit(1)
+
+    try:
+        timeline, image_paths = load_mix(mix_folder)
+        audio_path = None if args.no_audio else (args.audio or find_audio(mix_folder))
+        if audio_path is not None:
+            timeline = fit_to_audio(timeline, audio_path)
+            print(f"Muxing audio from {audio_path}")
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e} Exiting...")
+        exit(1)
+
+    palettes = load_palettes(image_paths, mode=PALETTE_MODE, workers=PALETTE_WORKERS,
+                             max_pixels=PALETTE_MAX_PIXELS, progress=print_progress)
+    output_path = args.output or os.path.join(mix_folder, "output.mp4")
+
+    chunk_dir = None if args.no_resume else (args.chunk_dir or os.path.join(mix_folder, ".chunks"))
+
+    renditions = None
+    if args.renditions:
+        from renditions import parse_renditions
+        try:
+            renditions = parse_renditions(args.renditions, args.fps)
+        except ValueError as e:
+            print(f"Error: {e} Exiting...")
+            exit(1)
+        if args.backend != "gl":
+            print("Error: --renditions downscales on the GPU and needs --backend gl. Exiting...")
+            exit(1)
+
+    try:
+        if renditions:
+            from renditions import render_renditions
+            _, width, height, _ = renditions[0]
+            renderer = create_renderer(width, height, palettes, args.backend, args.cached_layers, gpu_yuv=False)
+            stats = render_renditions(renderer, timeline, output_path, renditions, 0, timeline.frame_count(args.fps),
+                                      args.fps, gpu_yuv=args.gpu_yuv, audio_path=audio_path)
+            for name, rendition_stats in stats.items():
+                print(f"{name}:")
+                print_pipeline_stats(rendition_stats)
+        elif args.periodic:
+            from periodic import render_periodic
+            render_periodic(timeline, palettes, output_path, args.width, args.height, args.fps, args.workers,
+                            chunk_dir=chunk_dir, period=args.period, audio_path=audio_path, backend=args.backend,
+                            cached_layers=args.cached_layers, gpu_yuv=args.gpu_yuv)
+        elif not args.profile and (chunk_dir is not None or args.workers > 1):
+            render_sharded(timeline, palettes, output_path, args.width, args.height, args.fps, args.workers,
+                           chunk_dir=chunk_dir, audio_path=audio_path, backend=args.backend,
+                           cached_layers=args.cached_layers, gpu_yuv=args.gpu_yuv)
+        else:
+            renderer = create_renderer(args.width, args.height, palettes, args.backend, args.cached_layers,
+                                       args.gpu_yuv)
+            profiler = None
+            if args.profile:
+                profiler = FrameProfiler(getattr(renderer, "ctx", None))
+            stats = render_frames(renderer, timeline, output_path,
+                                  0, timeline.frame_count(args.fps), args.fps, profiler=profiler,
+                                  audio_path=audio_path)
+            print_pipeline_stats(stats)
+            if profiler is not None:
+                profiler.export(args.profile)
+                profiler.print_summary()
+                print(f"Frame trace written to {args.profile}")
+    except KeyboardInterrupt:
+        print("Rendering interrupted by user.")
+        exit(1)
+    if renditions:
+        from renditions import rendition_path
+        output_path = ", ".join(rendition_path(output_path, name) for name, _, _, _ in renditions)
+    print(f"Rendering completed. Video saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
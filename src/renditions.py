@@ -0,0 +1,232 @@
+import os
+import sys
+import math
+import moderngl
+from profiler import FrameProfiler
+from record import (FPS, ENCODER_PARAMS, READBACK_BUFFERS, FRAME_QUEUE_SIZE, FrameEncoder,
+                    load_shader, override_params, frame_schedule)
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import VERTEX_SHADER_PATH, YUV_FRAGMENT_SHADER_PATH, DOWNSAMPLE_FRAGMENT_SHADER_PATH
+
+# Texture unit the rendition passes sample their source frame from; 0-4 are
+# taken by the wave shader, sprites and the renderer's own YUV pass
+RENDITION_TEXTURE_UNIT = 5
+
+# Named output sizes with their (bitrate, maxrate, bufsize) in kbit/s; the
+# H.264 level is derived from the size, frame rate and maxrate
+RENDITIONS = {
+    "2160p": (3840, 2160, (40000, 50000, 80000)),
+    "1440p": (2560, 1440, (20000, 25000, 40000)),
+    "1080p": (1920, 1080, (12000, 15000, 24000)),
+    "720p": (1280, 720, (7500, 9000, 15000)),
+}
+
+# H.264 levels as (level, max macroblocks per second, max macroblocks per
+# frame, max High profile bitrate in kbit/s), from Table A-1 of the standard
+H264_LEVELS = [
+    ("3.1", 108000, 3600, 17500),
+    ("3.2", 216000, 5120, 25000),
+    ("4.0", 245760, 8192, 25000),
+    ("4.1", 245760, 8192, 62500),
+    ("4.2", 522240, 8704, 62500),
+    ("5.0", 589824, 22080, 168750),
+    ("5.1", 983040, 36864, 300000),
+    ("5.2", 2073600, 36864, 300000),
+    ("6.0", 4177920, 139264, 300000),
+    ("6.1", 8355840, 139264, 600000),
+    ("6.2", 16711680, 139264, 1000000),
+]
+
+
+########################
+# Rendition Settings
+########################
+
+def h264_level(width, height, fps, max_kbps):
+    """The lowest H.264 level that allows the frame size, macroblock rate and bitrate."""
+    frame_mbs = math.ceil(width / 16) * math.ceil(height / 16)
+    for level, max_mbps, max_frame_mbs, max_level_kbps in H264_LEVELS:
+        if frame_mbs <= max_frame_mbs and frame_mbs * fps <= max_mbps and max_kbps <= max_level_kbps:
+            return level
+    raise ValueError(f"{width}x{height} at {fps} fps is beyond every H.264 level.")
+
+def custom_rendition_rates(width, height, fps=FPS):
+    """
+    (bitrate, maxrate, bufsize) in kbit/s for a WIDTHxHEIGHT rendition, scaled
+    from the 1080p60 entry of RENDITIONS: the bitrate grows with the pixel
+    count to the power 0.85 (about what the named ladder does) and linearly
+    with the frame rate.
+    """
+    kbps = round(12000 * (width * height / (1920 * 1080)) ** 0.85 * fps / 60)
+    return kbps, round(kbps * 1.25), round(kbps * 2)
+
+def rendition_params(width, height, fps, rates):
+    """Encoder overrides for a rendition: its rates and the lowest H.264 level that fits."""
+    kbps, max_kbps, buffer_kbits = rates
+    return ["-b:v", f"{kbps}k", "-maxrate", f"{max_kbps}k", "-bufsize", f"{buffer_kbits}k",
+            "-level", h264_level(width, height, fps, max_kbps)]
+
+def parse_renditions(text, fps=FPS):
+    """
+    Renditions from a comma-separated list of RENDITIONS names or WxH sizes,
+    as (name, width, height, encoder overrides), largest first. WxH sizes get
+    a bitrate derived from their size and `fps`; every rendition gets the
+    H.264 level its size, `fps` and maxrate need.
+    """
+    renditions = []
+    for name in (part.strip() for part in text.split(",")):
+        if not name:
+            continue
+        if name in RENDITIONS:
+            width, height, rates = RENDITIONS[name]
+        else:
+            try:
+                width, height = (int(n) for n in name.lower().split("x"))
+            except ValueError:
+                raise ValueError(f"Unknown rendition '{name}': use one of {', '.join(RENDITIONS)} "
+                                 f"or WIDTHxHEIGHT.") from None
+            if width <= 0 or height <= 0:
+                raise ValueError(f"Invalid rendition size '{name}'.")
+            rates = custom_rendition_rates(width, height, fps)
+        renditions.append((name, width, height, rendition_params(width, height, fps, rates)))
+    if not renditions:
+        raise ValueError("No renditions given.")
+    return sorted(renditions, key=lambda rendition: rendition[1] * rendition[2], reverse=True)
+
+def rendition_path(output_path, name):
+    """output.mp4 -> output_1080p.mp4"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_{name}{ext}"
+
+########################
+# Rendition Passes
+########################
+
+class Rendition:
+    """
+    One output size of a multi-rendition render: the frame box-filtered down
+    from the full-resolution render (or the render itself at full size),
+    optionally converted to YUV, and read back and encoded by its own
+    FrameEncoder (pixel buffer ring and ffmpeg process).
+    """
+
+    def __init__(self, renderer, name, width, height, output_path, fps, encoder_params,
+                 gpu_yuv=False, audio_path=None, readback_buffers=READBACK_BUFFERS,
+                 frame_queue_size=FRAME_QUEUE_SIZE):
+        if gpu_yuv and (width % 2 or height % 2):
+            raise ValueError(f"YUV 4:2:0 output needs an even width and height, got {width}x{height}")
+        if width > renderer.width or height > renderer.height:
+            raise ValueError(f"Rendition {name} ({width}x{height}) is larger than the render "
+                             f"({renderer.width}x{renderer.height}).")
+        ctx = renderer.ctx
+        self.name = name
+        self.width, self.height = width, height
+        self.output_path = output_path
+        self.scale = (renderer.width / width, renderer.height / height)
+        self.downsample = (width, height) != (renderer.width, renderer.height)
+        if self.downsample:
+            self.fbo = ctx.framebuffer(color_attachments=[ctx.texture((width, height), 4)])
+        else:
+            self.fbo = renderer.fbo
+        self.output_fbo, self.output_components = self.fbo, 3
+        self.yuv_fbo = None
+        if gpu_yuv:
+            self.yuv_fbo = ctx.framebuffer(color_attachments=[ctx.texture((width, height * 3 // 2), 1)])
+            self.output_fbo, self.output_components = self.yuv_fbo, 1
+
+        self.encoder = FrameEncoder(ctx, self.output_fbo, self.output_components, output_path,
+                                    width, height, fps, encoder_params, gpu_yuv, audio_path,
+                                    readback_buffers, frame_queue_size)
+
+    def close(self):
+        """Finish encoding and free the GPU resources; returns the encoder pipeline stats."""
+        stats = self.encoder.close()
+        if self.downsample:
+            self.fbo.color_attachments[0].release()
+            self.fbo.release()
+        if self.yuv_fbo is not None:
+            self.yuv_fbo.color_attachments[0].release()
+            self.yuv_fbo.release()
+        return stats
+
+class RenditionPasses:
+    """The downsample and YUV programs shared by every rendition of a renderer."""
+
+    def __init__(self, renderer):
+        ctx = renderer.ctx
+        self.ctx = ctx
+        self.source = renderer.fbo.color_attachments[0]
+        self.downsample_program = ctx.program(
+            vertex_shader=load_shader(VERTEX_SHADER_PATH),
+            fragment_shader=load_shader(DOWNSAMPLE_FRAGMENT_SHADER_PATH),
+        )
+        self.yuv_program = ctx.program(
+            vertex_shader=load_shader(VERTEX_SHADER_PATH),
+            fragment_shader=load_shader(YUV_FRAGMENT_SHADER_PATH),
+        )
+        self.downsample_vao = ctx.simple_vertex_array(self.downsample_program, renderer.vbo, "in_position")
+        self.yuv_vao = ctx.simple_vertex_array(self.yuv_program, renderer.vbo, "in_position")
+        self.downsample_program["source"].value = RENDITION_TEXTURE_UNIT
+        self.yuv_program["rgbFrame"].value = RENDITION_TEXTURE_UNIT
+
+    def draw(self, rendition):
+        """Fill a rendition's framebuffers from the frame the renderer just drew."""
+        if rendition.downsample:
+            self.source.use(location=RENDITION_TEXTURE_UNIT)
+            self.downsample_program["u_scale"].value = rendition.scale
+            rendition.fbo.use()
+            self.downsample_vao.render(moderngl.TRIANGLE_STRIP)
+        if rendition.yuv_fbo is not None:
+            rendition.fbo.color_attachments[0].use(location=RENDITION_TEXTURE_UNIT)
+            self.yuv_program["u_frameSize"].value = (rendition.width, rendition.height)
+            rendition.yuv_fbo.use()
+            self.yuv_vao.render(moderngl.TRIANGLE_STRIP)
+
+    def release(self):
+        self.downsample_vao.release()
+        self.yuv_vao.release()
+        self.downsample_program.release()
+        self.yuv_program.release()
+
+########################
+# Multi-Rendition Rendering
+########################
+
+def render_renditions(renderer, timeline, output_path, renditions, start_frame, end_frame, fps,
+                      encoder_params=ENCODER_PARAMS, gpu_yuv=False, audio_path=None):
+    """
+    Render frames [start_frame, end_frame) once at the renderer's resolution
+    and encode every rendition from it: each gets a box-filtered copy of the
+    frame drawn on the GPU and its own encoder with its own bitrate. The
+    renderer must be a GL FrameRenderer without its own YUV pass, at least
+    as large as the largest rendition. Returns {name: encoder pipeline stats}.
+    """
+    if renderer.gpu_yuv:
+        raise ValueError("The renditions convert to YUV themselves; create the renderer with gpu_yuv=False.")
+    passes = RenditionPasses(renderer)
+    outputs = []
+    try:
+        for name, width, height, overrides in renditions:
+            outputs.append(Rendition(renderer, name, width, height, rendition_path(output_path, name), fps,
+                                     override_params(encoder_params, overrides), gpu_yuv, audio_path))
+
+        profiler = FrameProfiler(enabled=False)
+        times, palette_a, palette_b, progress = frame_schedule(renderer, timeline, fps, start_frame, end_frame)
+        for i, elapsed_time in enumerate(times):
+            renderer.select(palette_a[i], palette_b[i], progress[i])
+            renderer.render(elapsed_time)
+            for rendition in outputs:
+                passes.draw(rendition)
+            for rendition in outputs:
+                rendition.encoder.read_back(profiler)
+        for rendition in outputs:
+            rendition.encoder.flush()
+    finally:
+        stats = {rendition.name: rendition.close() for rendition in outputs}
+        passes.release()
+    for rendition in outputs:
+        rendition.encoder.check()
+    return stats
@@ -0,0 +1,108 @@
+import os
+import hashlib
+import threading
+
+
+class ShaderWatcher:
+    """
+    Background thread that polls shader files for changes. The GL context
+    belongs to the render thread, so the watcher only reads the new sources;
+    `poll()` hands them to the render loop, which compiles them.
+    """
+
+    def __init__(self, paths, interval=0.25):
+        self.paths = list(paths)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.pending = None
+        self.mtimes = self._mtimes()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _mtimes(self):
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)  # Mid-save in some editors
+        return mtimes
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            mtimes = self._mtimes()
+            if mtimes == self.mtimes or None in mtimes:
+                continue
+            # Wait for the editor to finish writing before reading
+            self.stop_event.wait(self.interval)
+            if self._mtimes() != mtimes:
+                continue
+            self.mtimes = mtimes
+            try:
+                sources = []
+                for path in self.paths:
+                    with open(path, 'r') as f:
+                        sources.append(f.read())
+            except OSError:
+                continue
+            with self.lock:
+                self.pending = sources
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def poll(self):
+        """The sources after the latest change, or None if nothing changed since the last poll."""
+        with self.lock:
+            sources, self.pending = self.pending, None
+        return sources
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+class ProgramCache:
+    """
+    Linked programs, each with a vertex array over `vbo`, keyed by a hash of
+    their sources. Going back to a source seen before (e.g. undoing an edit)
+    is a dictionary lookup instead of a recompile. Sources that failed to
+    compile are remembered as well and fail again without recompiling.
+    """
+
+    def __init__(self, ctx, vbo):
+        self.ctx = ctx
+        self.vbo = vbo
+        self.entries = {}
+        self.errors = {}
+
+    @staticmethod
+    def key(vertex_source, fragment_source):
+        digest = hashlib.sha1()
+        digest.update(vertex_source.encode())
+        digest.update(b"\0")
+        digest.update(fragment_source.encode())
+        return digest.hexdigest()
+
+    def get(self, vertex_source, fragment_source):
+        """(program, vao) for the sources. Raises the compile/link error for bad sources."""
+        key = self.key(vertex_source, fragment_source)
+        if key in self.entries:
+            return self.entries[key]
+        if key in self.errors:
+            raise self.errors[key]
+        try:
+            program = self.ctx.program(vertex_shader=vertex_source, fragment_shader=fragment_source)
+        except Exception as e:
+            self.errors[key] = e
+            raise
+        vao = self.ctx.simple_vertex_array(program, self.vbo, "in_position")
+        self.entries[key] = (program, vao)
+        return program, vao
+
+    def release(self):
+        for program, vao in self.entries.values():
+            vao.release()
+            program.release()
+        self.entries.clear()
@@ -0,0 +1,244 @@
+import os
+import sys
+import stat
+import argparse
+import threading
+import numpy as np
+from paletteCache import load_palettes
+from extractColors import print_progress
+from pacing import FrameClock
+from cpuRenderer import CpuRenderer
+from record import WIDTH, HEIGHT, FPS, BACKEND, CACHED_LAYERS, load_mix, create_renderer
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PALETTE_MODE, PALETTE_WORKERS, PALETTE_MAX_PIXELS
+
+# Output formats: raw frames without any framing, or YUV4MPEG2 (y4m), which
+# carries the size, rate and color siting so consumers need no flags
+FORMATS = ["y4m", "yuv420p", "rgb24"]
+FORMAT = "y4m"
+
+
+########################
+# Live Output
+########################
+
+class LiveStream:
+    """
+    Writes frames to a pipe at a steady wall-clock rate, whatever the
+    renderer and the reader are doing.
+
+    The render thread `publish()`es frames into a one-frame mailbox; a writer
+    thread takes the newest one every 1/fps seconds. A frame replaced before
+    it was written is dropped; when no new frame arrived in time the last
+    one is written again. When the reader stalls the writer, the ticks it
+    missed are skipped rather than caught up on, so the stream stays live.
+    """
+
+    def __init__(self, output, width, height, fps, pix_fmt="yuv420p", container="y4m"):
+        if container == "y4m" and pix_fmt != "yuv420p":
+            raise ValueError("y4m output carries YUV 4:2:0 frames only")
+        self.output = output
+        self.fps = fps
+        if pix_fmt == "rgb24":
+            self.frame_shape = (height, width, 3)
+        else:
+            self.frame_shape = (height * 3 // 2, width)
+        self.header = self.frame_header = b""
+        if container == "y4m":
+            # Left-sited chroma in BT.709 limited range, like shaders/yuv420.frag
+            self.header = f"YUV4MPEG2 W{width} H{height} F{fps}:1 Ip A1:1 C420mpeg2 XCOLORRANGE=LIMITED\n".encode()
+            self.frame_header = b"FRAME\n"
+
+        # One buffer being rendered, one waiting in the mailbox, one being written
+        self.lock = threading.Lock()
+        self.free = [np.empty(self.frame_shape, dtype=np.uint8) for _ in range(3)]
+        self.latest = None
+        self.current = None
+
+        self.error = None
+        self.rendered = 0
+        self.written = 0
+        self.dropped = 0      # Rendered but replaced before the writer got to them
+        self.duplicated = 0   # Ticks that repeated the previous frame
+        self.stalled = 0      # Ticks skipped while the reader wasn't reading
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        """A free frame buffer to render into; never blocks."""
+        with self.lock:
+            return self.free.pop()
+
+    def publish(self, buffer):
+        """Hand a rendered frame to the writer, replacing one it hasn't taken yet."""
+        with self.lock:
+            if self.latest is not None:
+                self.free.append(self.latest)
+                self.dropped += 1
+            self.latest = buffer
+            self.rendered += 1
+
+    def _write_loop(self):
+        try:
+            self.output.write(self.header)
+        except OSError as e:
+            self.error = e
+            return
+        clock = FrameClock(self.fps)
+        while not self.stop_event.is_set():
+            clock.tick()
+            if self.written:
+                self.stalled += max(0, int(round(clock.delta * self.fps)) - 1)
+            with self.lock:
+                fresh = self.latest is not None
+                if fresh:
+                    if self.current is not None:
+                        self.free.append(self.current)
+                    self.current, self.latest = self.latest, None
+            if self.current is None:
+                continue  # Nothing rendered yet
+            if not fresh:
+                self.duplicated += 1
+            try:
+                self.output.write(self.frame_header)
+                self.output.write(memoryview(self.current).cast("B"))
+                self.output.flush()
+            except OSError as e:  # Including BrokenPipeError when the reader goes away
+                self.error = e
+                break
+            self.written += 1
+
+    def close(self):
+        """Stop the writer, close the output and return the run stats."""
+        self.stop_event.set()
+        self.thread.join()
+        try:
+            self.output.close()
+        except OSError:
+            pass
+        return self.stats()
+
+    def stats(self):
+        return {
+            "rendered": self.rendered,
+            "written": self.written,
+            "dropped": self.dropped,
+            "duplicated": self.duplicated,
+            "stalled": self.stalled,
+        }
+
+def stream_frames(renderer, timeline, stream, fps, start=0.0, loop=False):
+    """
+    Render the timeline in real time into `stream`, starting `start` seconds
+    in. Frames follow the wall clock: when rendering falls behind, the frames
+    it missed are skipped. Stops at the end of the mix (or starts over with
+    `loop`) or when the reader goes away.
+    """
+    cpu_backend = isinstance(renderer, CpuRenderer)
+    flip = cpu_backend or not renderer.gpu_yuv
+    # GL and CPU frames are bottom-up; raw RGB readers expect the top row first
+    scratch = np.empty(stream.frame_shape, dtype=np.uint8) if flip else None
+    total_frames = timeline.frame_count(fps)
+    start_frame = int(round(start * fps))
+    clock = FrameClock(fps)
+    last_frame = None
+    while stream.error is None:
+        clock.tick()
+        frame = start_frame + int(round(clock.time * fps))
+        if frame >= total_frames:
+            if not loop:
+                break
+            frame %= total_frames
+        if last_frame is not None and frame > last_frame + 1:
+            stream.dropped += frame - last_frame - 1
+        last_frame = frame
+
+        elapsed_time = frame / fps
+        point = timeline.at(elapsed_time)
+        buffer = stream.acquire()
+        if cpu_backend:
+            renderer.render(elapsed_time, point.palette, point.next_palette, point.progress, out=scratch)
+        else:
+            renderer.select(point.palette, point.next_palette, point.progress)
+            renderer.render(elapsed_time)
+            renderer.output_fbo.read_into(scratch if flip else buffer, components=renderer.output_components)
+        if flip:
+            np.copyto(buffer, scratch[::-1])
+        stream.publish(buffer)
+
+def open_output(path):
+    """
+    Binary output for the stream: stdout for '-', otherwise a named pipe,
+    created if it doesn't exist. Opening a pipe waits for a reader.
+    """
+    if path == "-":
+        # Keep the real stdout for frames and send everything printed to stderr,
+        # so no stray message can corrupt the stream
+        stream_fd = os.dup(sys.stdout.fileno())
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        return os.fdopen(stream_fd, "wb")
+    if not os.path.exists(path):
+        os.mkfifo(path)
+    elif not stat.S_ISFIFO(os.stat(path).st_mode):
+        raise ValueError(f"{path} exists and is not a named pipe")
+    print(f"Waiting for a reader on {path}...", file=sys.stderr)
+    return open(path, "wb")
+
+########################
+# Main
+########################
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Stream the shader animation for a mix live, as raw frames or y4m, "
+                    "e.g. into OBS or ffmpeg.")
+    parser.add_argument("mix_folder")
+    parser.add_argument("--output", default="-", help="'-' for stdout (default) or a named pipe")
+    parser.add_argument("--format", choices=FORMATS, default=FORMAT,
+                        help="y4m (YUV 4:2:0 with a header), raw yuv420p or raw rgb24")
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument("--start", type=float, default=0.0, help="Start this many seconds into the mix")
+    parser.add_argument("--loop", action="store_true", help="Start over at the end of the mix")
+    parser.add_argument("--backend", choices=["gl", "cpu"], default=BACKEND)
+    parser.add_argument("--cached-layers", action="store_true", default=CACHED_LAYERS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.format != "rgb24" and args.backend != "gl":
+        print(f"Error: {args.format} output is converted on the GPU and needs --backend gl.", file=sys.stderr)
+        exit(1)
+    try:
+        output = open_output(args.output)
+        timeline, image_paths = load_mix(args.mix_folder)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e} Exiting...", file=sys.stderr)
+        exit(1)
+
+    palettes = load_palettes(image_paths, mode=PALETTE_MODE, workers=PALETTE_WORKERS,
+                             max_pixels=PALETTE_MAX_PIXELS, progress=print_progress)
+    gpu_yuv = args.format != "rgb24"
+    renderer = create_renderer(args.width, args.height, palettes, args.backend, args.cached_layers, gpu_yuv)
+    pix_fmt = "rgb24" if args.format == "rgb24" else "yuv420p"
+    stream = LiveStream(output, args.width, args.height, args.fps, pix_fmt,
+                        container="y4m" if args.format == "y4m" else "raw")
+    print(f"Streaming {args.width}x{args.height} {args.format} at {args.fps} fps...", file=sys.stderr)
+    try:
+        stream_frames(renderer, timeline, stream, args.fps, args.start, args.loop)
+    except KeyboardInterrupt:
+        pass
+    stats = stream.close()
+    print(f"Streamed {stats['written']} frames: {stats['dropped']} dropped, {stats['duplicated']} duplicated, "
+          f"{stats['stalled']} skipped while the reader stalled.", file=sys.stderr)
+    if isinstance(stream.error, BrokenPipeError):
+        print("The reader closed the stream.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
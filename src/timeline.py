@@ -0,0 +1,183 @@
+import math
+from bisect import bisect_right
+from collections import namedtuple
+import numpy as np
+
+# Palettes and blend progress at one instant of the timeline
+TimelinePoint = namedtuple("TimelinePoint", "index palette next_palette progress transition")
+
+
+########################
+# Parsing Durations
+########################
+
+def parse_timestamp(text):
+    """
+    Parse 'SS', 'M:SS' or 'H:MM:SS' into seconds. The last field may have a
+    fractional part, e.g. '1:02.5'.
+    """
+    fields = text.split(':')
+    if not 1 <= len(fields) <= 3 or not all(fields):
+        raise ValueError(f"invalid timestamp '{text}'")
+    try:
+        seconds = float(fields[-1])
+        larger = [int(field) for field in fields[:-1]]
+    except ValueError:
+        raise ValueError(f"invalid timestamp '{text}'") from None
+    if seconds < 0 or any(value < 0 for value in larger) or not math.isfinite(seconds):
+        raise ValueError(f"invalid timestamp '{text}'")
+    if larger and seconds >= 60:
+        raise ValueError(f"seconds out of range in timestamp '{text}'")
+    if len(larger) == 2 and larger[1] >= 60:
+        raise ValueError(f"minutes out of range in timestamp '{text}'")
+    total = 0
+    for value in larger:
+        total = total * 60 + value
+    return total * 60 + seconds
+
+def format_timestamp(seconds):
+    """Seconds as 'M:SS.s', or 'H:MM:SS.s' past an hour."""
+    seconds = max(0.0, seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{int(hours)}:{int(minutes):02d}:{secs:04.1f}"
+    return f"{int(minutes)}:{secs:04.1f}"
+
+def parse_durations(file_path):
+    """
+    Parse song segments and transitions from a text file where lines are either:
+      'MM:SS-MM:SS' for a static segment
+      'MM:SS-MM:SS transition' for a transition
+    Timestamps may also be 'H:MM:SS' and have fractional seconds ('0:20.5').
+
+    Returns (starts, ends, is_transition) lists. Raises ValueError naming the
+    offending line for malformed or overlapping segments.
+    """
+    starts, ends, is_transition = [], [], []
+    with open(file_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            where = f"{file_path}, line {line_number}"
+            if len(parts) > 2 or (len(parts) == 2 and parts[1].lower() != "transition"):
+                raise ValueError(f"{where}: expected 'START-END' or 'START-END transition', got '{line.strip()}'")
+            if parts[0].count('-') != 1:
+                raise ValueError(f"{where}: expected a time range 'START-END', got '{parts[0]}'")
+            start_str, end_str = parts[0].split('-')
+            try:
+                start, end = parse_timestamp(start_str), parse_timestamp(end_str)
+            except ValueError as e:
+                raise ValueError(f"{where}: {e}") from None
+            if end <= start:
+                raise ValueError(f"{where}: segment ends ({end_str}) before it starts ({start_str})")
+            if ends and start < ends[-1]:
+                raise ValueError(f"{where}: segment starts ({start_str}) before the previous one ends")
+            starts.append(start)
+            ends.append(end)
+            is_transition.append(len(parts) == 2)
+    if not starts:
+        raise ValueError(f"{file_path}: no segments found")
+    return starts, ends, is_transition
+
+########################
+# Compiled Timeline
+########################
+
+class Timeline:
+    """
+    durations.txt compiled into parallel arrays with one entry per segment.
+    Static segments show `palette_a == palette_b`; transitions blend from
+    `palette_a` (the previous static segment) to `palette_b` (the next one).
+    """
+
+    def __init__(self, starts, ends, is_transition, duration=None):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.is_transition = np.asarray(is_transition, dtype=bool)
+
+        # Static segments get consecutive palette ids in order of appearance
+        static = ~self.is_transition
+        palette_ids = np.cumsum(static) - 1
+        self.num_palettes = int(static.sum())
+        if self.num_palettes == 0:
+            raise ValueError("Timeline has no static segments to take palettes from.")
+
+        # Previous / next static segment of every segment, via running max / min
+        indices = np.arange(len(static))
+        prev_static = np.maximum.accumulate(np.where(static, indices, -1))
+        next_static = np.minimum.accumulate(np.where(static, indices, len(static))[::-1])[::-1]
+        orphans = self.is_transition & ((prev_static < 0) | (next_static >= len(static)))
+        if orphans.any():
+            i = int(np.argmax(orphans))
+            raise ValueError(f"Transition segment {i + 1} ({self.starts[i]:g}s-{self.ends[i]:g}s) "
+                             f"needs a static segment before and after it.")
+        self.palette_a = palette_ids[np.clip(prev_static, 0, None)].astype(np.int32)
+        self.palette_b = palette_ids[np.clip(next_static, None, len(static) - 1)].astype(np.int32)
+
+        # Length of the video; past the last segment its palette is held
+        self._duration = duration
+
+        # Plain lists for the scalar lookups; bisect and indexing are fastest on them
+        self._starts = self.starts.tolist()
+        self._ends = self.ends.tolist()
+        self._transition = self.is_transition.tolist()
+        self._palette_a = self.palette_a.tolist()
+        self._palette_b = self.palette_b.tolist()
+
+    @classmethod
+    def from_file(cls, file_path):
+        return cls(*parse_durations(file_path))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def with_duration(self, duration):
+        """
+        The same timeline rendered for exactly `duration` seconds, e.g. to
+        match the mix audio: shorter cuts off the end, longer holds the
+        last palette.
+        """
+        return Timeline(self.starts, self.ends, self.is_transition, duration)
+
+    @property
+    def duration(self):
+        if self._duration is not None:
+            return float(self._duration)
+        return float(self.ends[-1])
+
+    def frame_count(self, fps):
+        return int(math.floor(self.duration * fps)) + 1
+
+    def index_at(self, t):
+        """Index of the segment playing at time `t`, in O(log n)."""
+        return max(0, bisect_right(self._starts, t) - 1)
+
+    def segment_bounds(self, i):
+        """(start, end) of segment `i` in seconds."""
+        return self._starts[i], self._ends[i]
+
+    def at(self, t):
+        """Palettes and transition progress at time `t`."""
+        i = self.index_at(t)
+        transition = self._transition[i]
+        progress = 0.0
+        if transition:
+            start, end = self._starts[i], self._ends[i]
+            progress = min(max((t - start) / (end - start), 0.0), 1.0)
+        return TimelinePoint(i, self._palette_a[i], self._palette_b[i], progress, transition)
+
+    def schedule(self, fps, start_frame=0, end_frame=None):
+        """
+        Vectorized per-frame schedule for frames [start_frame, end_frame).
+        Returns (times, palette_a, palette_b, progress) arrays.
+        """
+        if end_frame is None:
+            end_frame = self.frame_count(fps)
+        times = np.arange(start_frame, end_frame, dtype=np.float64) / fps
+        indices = np.clip(np.searchsorted(self.starts, times, side="right") - 1, 0, None)
+        starts, ends = self.starts[indices], self.ends[indices]
+        progress = np.where(self.is_transition[indices],
+                            np.clip((times - starts) / (ends - starts), 0.0, 1.0), 0.0)
+        return times, self.palette_a[indices], self.palette_b[indices], progress
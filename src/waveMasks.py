@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import hashlib
+import inspect
+import argparse
+import moderngl
+import numpy as np
+from paletteCache import load_palettes
+from extractColors import print_progress, pack_palettes
+from encoder import FFmpegPipeline, print_pipeline_stats
+from cpuRenderer import gradient_weights, blend_palette_colors
+import waves
+from waves import NUM_WAVES, wave_bands, upload_wave_table
+from record import (WIDTH, HEIGHT, FPS, GOP_SECONDS, PERIOD_SECONDS, ENCODER_PARAMS, FRAME_QUEUE_SIZE,
+                    load_shader, with_defines, load_mix, gpu_wave_parameters)
+from periodic import period_frames_for
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional, the NumPy path is used instead
+    njit = None
+
+# Add the root directory to the module search path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (FRAGMENT_SHADER_PATH, VERTEX_SHADER_PATH, PALETTE_MODE, PALETTE_WORKERS,
+                    PALETTE_MAX_PIXELS)
+
+# Bump when the mask file layout changes
+MASK_CACHE_VERSION = 1
+# Frames per memory-mapped mask file
+MASK_CHUNK_SECONDS = 5
+
+
+########################
+# Mask Layout
+########################
+
+def band_rows(params, height):
+    """
+    (first row, row count) of every wave's band in bottom-up row order, as a
+    (NUM_WAVES, 2) int array. A wave's alpha is 0 outside these rows, so only
+    they are stored.
+    """
+    st_y = (np.arange(height, dtype=np.float32) + np.float32(0.5)) / np.float32(height)
+    rows = np.zeros((NUM_WAVES, 2), dtype=np.int64)
+    for i, (low, high) in enumerate(wave_bands(params)):
+        inside = np.nonzero((st_y >= low) & (st_y <= high))[0]
+        if len(inside):
+            rows[i] = inside[0], len(inside)
+    return rows
+
+def mask_key(width, height, fps, start_frame, end_frame, period_frames):
+    """Hash of everything that determines the masks: format, frame range, loop length and the wave code."""
+    digest = hashlib.sha256()
+    digest.update(repr((MASK_CACHE_VERSION, width, height, fps, start_frame, end_frame, period_frames)).encode())
+    digest.update(load_shader(VERTEX_SHADER_PATH).encode())
+    digest.update(load_shader(FRAGMENT_SHADER_PATH).encode())
+    digest.update(inspect.getsource(waves).encode())
+    return digest.hexdigest()[:32]
+
+########################
+# Baking
+########################
+
+class MaskRenderer:
+    """
+    Renders the WAVE_MASKS variant of wiiU.frag: the 7 wave alphas and the dot
+    weight of every pixel, into two RGBA8 targets, independent of any palette.
+    """
+
+    def __init__(self, ctx, width, height, period=None):
+        self.ctx = ctx
+        self.width, self.height = width, height
+        self.program = ctx.program(
+            vertex_shader=load_shader(VERTEX_SHADER_PATH),
+            fragment_shader=with_defines(load_shader(FRAGMENT_SHADER_PATH), ["WAVE_MASKS"] + waves.wave_defines()),
+        )
+        vertices = np.array([[-1.0, -1.0], [1.0, -1.0], [-1.0, 1.0], [1.0, 1.0]], dtype="f4")
+        self.vbo = ctx.buffer(vertices)
+        self.vao = ctx.simple_vertex_array(self.program, self.vbo, "in_position")
+        self.fbo = ctx.framebuffer(color_attachments=[ctx.texture((width, height), 4) for _ in range(2)])
+        for name, value in (("u_resolution", (width, height)), ("u_lineAlpha", 1.0)):
+            uniform = self.program.get(name, None)
+            if uniform is not None:
+                uniform.value = value
+        self.wave_table = gpu_wave_parameters(ctx, period)
+        upload_wave_table(self.program, self.wave_table)
+        self.u_time = self.program["u_time"]
+        # Readback targets, bottom-up like every GL readback
+        self.attachments = [np.empty((height, width, 4), dtype=np.uint8) for _ in range(2)]
+
+    def render(self, elapsed_time):
+        """Render one frame's masks; `channel(i)` is wave i's alpha for i < NUM_WAVES, then the dot weight."""
+        self.u_time.value = elapsed_time
+        self.fbo.use()
+        self.ctx.clear(0.0, 0.0, 0.0, 0.0)
+        self.vao.render(moderngl.TRIANGLE_STRIP)
+        for i, buffer in enumerate(self.attachments):
+            self.fbo.read_into(buffer, components=4, attachment=i)
+
+    def channel(self, index):
+        return self.attachments[index // 4][:, :, index % 4]
+
+    def release(self):
+        self.vao.release()
+        self.vbo.release()
+        self.fbo.release()
+        self.program.release()
+
+def bake_masks(mask_dir, width, height, fps, start_frame=0, end_frame=None, period_frames=None):
+    """
+    Render the wave masks of frames [start_frame, end_frame) into `mask_dir`.
+
+    With `period_frames` (the loop length of a --periodic render) the flows
+    are snapped like `render_periodic` does and one loop is baked; it covers
+    every frame of any mix. The layout:
+
+    - masks.json: format, frame range, loop length and the band rows
+    - dots.npy: the time-invariant dot weight, (height, width) uint8
+    - masks_NNNNN.npy: MASK_CHUNK_SECONDS of frames each, as
+      (frames, rows, width) uint8 with the band rows of waves 0-6 stacked
+
+    Finished files are kept, so an interrupted bake resumes where it stopped.
+    A bake with different settings or wave code replaces the old one.
+    """
+    if period_frames:
+        start_frame, end_frame = 0, period_frames
+    period = period_frames / fps if period_frames else None
+    ctx = moderngl.create_standalone_context()
+    renderer = MaskRenderer(ctx, width, height, period)
+    try:
+        _bake_chunks(renderer, mask_dir, width, height, fps, start_frame, end_frame, period_frames)
+    finally:
+        renderer.release()
+        ctx.release()
+
+def _bake_chunks(renderer, mask_dir, width, height, fps, start_frame, end_frame, period_frames):
+    # The bands of the table the masks are rendered with
+    rows = band_rows(renderer.wave_table, height)
+    offsets = np.concatenate([[0], np.cumsum(rows[:, 1])])
+    chunk_frames = max(1, int(round(MASK_CHUNK_SECONDS * fps)))
+    chunks = [(start, min(start + chunk_frames, end_frame)) for start in range(start_frame, end_frame, chunk_frames)]
+    meta = {
+        "version": MASK_CACHE_VERSION,
+        "key": mask_key(width, height, fps, start_frame, end_frame, period_frames),
+        "width": width, "height": height, "fps": fps,
+        "start_frame": start_frame, "end_frame": end_frame, "period_frames": period_frames,
+        "chunk_frames": chunk_frames,
+        "band_rows": rows.tolist(),
+    }
+
+    os.makedirs(mask_dir, exist_ok=True)
+    meta_path = os.path.join(mask_dir, "masks.json")
+    old_meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            old_meta = json.load(f)
+    if old_meta != meta:
+        for name in os.listdir(mask_dir):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(mask_dir, name))
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    frame_bytes = int(offsets[-1]) * width
+    print(f"Wave masks: {frame_bytes / 2**20:.1f} MB per frame, "
+          f"{frame_bytes * (end_frame - start_frame) / 2**30:.1f} GB for {end_frame - start_frame} frames.")
+
+    for index, (start, end) in enumerate(chunks):
+        path = os.path.join(mask_dir, f"masks_{index:05d}.npy")
+        if os.path.exists(path):
+            continue
+        # Written under a temporary name so an interrupted chunk is never read
+        partial_path = os.path.join(mask_dir, f"masks_{index:05d}.partial.npy")
+        masks = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.uint8,
+                                          shape=(end - start, int(offsets[-1]), width))
+        for frame in range(start, end):
+            renderer.render((frame % period_frames if period_frames else frame) / fps)
+            for i, (first, count) in enumerate(rows):
+                masks[frame - start, offsets[i]:offsets[i + 1]] = renderer.channel(i)[first:first + count]
+        masks.flush()
+        del masks
+        os.replace(partial_path, path)
+        print(f"Mask chunk {index + 1}/{len(chunks)} done (frames {start}-{end - 1})")
+
+    dots_path = os.path.join(mask_dir, "dots.npy")
+    if not os.path.exists(dots_path):
+        renderer.render(0.0)
+        np.save(dots_path, np.ascontiguousarray(renderer.channel(NUM_WAVES)))
+
+########################
+# Recoloring
+########################
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _recolor_numba(out, gradient, masks, rows, offsets, wave_colors, dots):
+        height, width = dots.shape
+        scale = np.float32(1.0 / 255.0)
+        for y in prange(height):
+            for x in range(width):
+                r, g, b = gradient[y, 0], gradient[y, 1], gradient[y, 2]
+                for i in range(rows.shape[0]):
+                    row = y - rows[i, 0]
+                    if row < 0 or row >= rows[i, 1]:
+                        continue
+                    alpha = np.float32(masks[offsets[i] + row, x]) * scale
+                    r = r * (np.float32(1.0) - alpha) + wave_colors[i, 0] * alpha
+                    g = g * (np.float32(1.0) - alpha) + wave_colors[i, 1] * alpha
+                    b = b * (np.float32(1.0) - alpha) + wave_colors[i, 2] * alpha
+                d = np.float32(dots[y, x]) * scale
+                r = r * (np.float32(1.0) - d) + np.float32(1.3) * d
+                g = g * (np.float32(1.0) - d) + np.float32(1.3) * d
+                b = b * (np.float32(1.0) - d) + np.float32(1.3) * d
+                out[y, x, 0] = np.uint8(np.rint(min(max(r, np.float32(0.0)), np.float32(1.0)) * np.float32(255.0)))
+                out[y, x, 1] = np.uint8(np.rint(min(max(g, np.float32(0.0)), np.float32(1.0)) * np.float32(255.0)))
+                out[y, x, 2] = np.uint8(np.rint(min(max(b, np.float32(0.0)), np.float32(1.0)) * np.float32(255.0)))
+
+class WaveMaskStore:
+    """
+    Baked wave masks opened read-only through memory maps, and the recolor
+    stage that composites any palette (or transition between two) onto them:
+    the same blends as wiiU.frag, without evaluating a single wave.
+    """
+
+    def __init__(self, mask_dir, use_numba=True):
+        with open(os.path.join(mask_dir, "masks.json"), 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != MASK_CACHE_VERSION:
+            raise ValueError(f"{mask_dir} holds masks of an older format; bake them again.")
+        key = mask_key(meta["width"], meta["height"], meta["fps"], meta["start_frame"], meta["end_frame"],
+                       meta["period_frames"])
+        if meta.get("key") != key:
+            raise ValueError(f"{mask_dir} holds masks baked from different shader or wave code; bake them again.")
+        self.mask_dir = mask_dir
+        self.width, self.height, self.fps = meta["width"], meta["height"], meta["fps"]
+        self.start_frame, self.end_frame = meta["start_frame"], meta["end_frame"]
+        self.period_frames = meta["period_frames"]
+        self.chunk_frames = meta["chunk_frames"]
+        self.rows = np.array(meta["band_rows"], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.rows[:, 1])])
+        self.use_numba = use_numba and njit is not None
+        self.dots = np.load(os.path.join(mask_dir, "dots.npy"))
+        self.dot_weight = (self.dots * np.float32(1.0 / 255.0))[..., None]
+        self.gradient_t = gradient_weights(self.height)
+        self.chunk_index, self.chunk = None, None
+
+    def covers(self, start_frame, end_frame):
+        """True if the masks cover every frame of [start_frame, end_frame)."""
+        return bool(self.period_frames) or (self.start_frame <= start_frame and end_frame <= self.end_frame)
+
+    def frame(self, frame):
+        """Masks of one frame of the mix, as (rows, width) uint8 (a view into the memory map)."""
+        if self.period_frames:
+            frame %= self.period_frames
+        elif not self.start_frame <= frame < self.end_frame:
+            raise IndexError(f"Frame {frame} is outside the baked range "
+                             f"[{self.start_frame}, {self.end_frame}).")
+        index, row = divmod(frame - self.start_frame, self.chunk_frames)
+        if index != self.chunk_index:
+            path = os.path.join(self.mask_dir, f"masks_{index:05d}.npy")
+            self.chunk_index, self.chunk = index, np.load(path, mmap_mode="r")
+        return self.chunk[row]
+
+    def recolor(self, frame, packed_palettes, palette, next_palette, progress, out=None):
+        """Composite a palette pair onto the masks of `frame` as (height, width, 3) uint8, bottom-up."""
+        if out is None:
+            out = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        masks = self.frame(frame)
+        gradient, wave_colors = blend_palette_colors(packed_palettes, self.gradient_t,
+                                                     palette, next_palette, progress)
+        if self.use_numba:
+            _recolor_numba(out, gradient, masks, self.rows, self.offsets, wave_colors, self.dots)
+            return out
+
+        f32 = np.float32
+        color = np.repeat(gradient[:, None, :], self.width, axis=1)
+        for i, (first, count) in enumerate(self.rows):
+            if count == 0:
+                continue
+            alpha = masks[self.offsets[i]:self.offsets[i + 1], :, None] * f32(1.0 / 255.0)
+            band = color[first:first + count]
+            band += (wave_colors[i] - band) * alpha
+        color += (f32(1.3) - color) * self.dot_weight
+        np.rint(np.clip(color, 0.0, 1.0) * f32(255.0), out=color)
+        out[...] = color
+        return out
+
+def recolor_frames(store, timeline, palettes, output_path, start_frame=0, end_frame=None,
+                   encoder_params=ENCODER_PARAMS, frame_queue_size=FRAME_QUEUE_SIZE):
+    """
+    Encode frames [start_frame, end_frame) of the timeline from baked masks.
+    Returns the encoder pipeline stats.
+    """
+    if end_frame is None:
+        end_frame = timeline.frame_count(store.fps)
+    if not store.covers(start_frame, end_frame):
+        raise ValueError(f"The masks in {store.mask_dir} cover frames [{store.start_frame}, {store.end_frame}), "
+                         f"not [{start_frame}, {end_frame}).")
+    packed = pack_palettes(palettes)
+    _, palette_a, palette_b, progress = timeline.schedule(store.fps, start_frame, end_frame)
+    writer = FFmpegPipeline(output_path, store.width, store.height, store.fps, encoder_params,
+                            queue_size=frame_queue_size)
+    try:
+        for i, frame in enumerate(range(start_frame, end_frame)):
+            buffer = writer.acquire()
+            store.recolor(frame, packed, palette_a[i], palette_b[i], progress[i], out=buffer)
+            writer.submit(buffer)
+    finally:
+        stats = writer.close()
+    if writer.error is not None:
+        raise RuntimeError(f"Encoding {output_path} failed: {writer.error}")
+    return stats
+
+########################
+# Main
+########################
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Bake palette-independent wave masks once, then recolor them with any palettes.")
+    parser.add_argument("command", choices=["bake", "recolor"])
+    parser.add_argument("mix_folder")
+    parser.add_argument("--mask-dir", help="Where the masks are kept (default: .masks in the mix folder)")
+    parser.add_argument("--width", type=int, default=WIDTH, help="bake: output width")
+    parser.add_argument("--height", type=int, default=HEIGHT, help="bake: output height")
+    parser.add_argument("--fps", type=int, default=FPS, help="bake: frame rate")
+    parser.add_argument("--start", type=float, help="Start of the time range in seconds (default: 0, or "
+                                                    "the start of the baked range when recoloring)")
+    parser.add_argument("--end", type=float, help="End of the time range in seconds (default: end of the mix)")
+    parser.add_argument("--periodic", action="store_true",
+                        help="bake: snap the wave speeds like record.py --periodic and bake one loop, "
+                             "which covers the whole mix")
+    parser.add_argument("--period", type=float, default=PERIOD_SECONDS, help="Loop length in seconds for --periodic")
+    parser.add_argument("--palette-mode", choices=["full", "fast"], default=PALETTE_MODE,
+                        help="recolor: palette extraction mode")
+    parser.add_argument("--output", help="recolor: output path (default: recolor.mp4 in the mix folder)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    try:
+        timeline, image_paths = load_mix(args.mix_folder)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e} Exiting...")
+        exit(1)
+    mask_dir = args.mask_dir or os.path.join(args.mix_folder, ".masks")
+
+    if args.command == "bake":
+        fps = args.fps
+        # Every frame recolor renders by default, including the one at the very end
+        end_frame = int(round(args.end * fps)) if args.end is not None else timeline.frame_count(fps)
+        period_frames = None
+        if args.periodic:
+            period_frames = period_frames_for(args.period, fps, max(1, int(round(GOP_SECONDS * fps))))
+        bake_masks(mask_dir, args.width, args.height, fps, int(round((args.start or 0.0) * fps)),
+                   end_frame, period_frames)
+        print(f"Wave masks saved to {mask_dir}")
+        return
+
+    store = WaveMaskStore(mask_dir)
+    start_frame = int(round(args.start * store.fps)) if args.start is not None else store.start_frame
+    if store.period_frames and args.start is None:
+        start_frame = 0
+    end_frame = int(round(args.end * store.fps)) if args.end is not None else None
+    if end_frame is None and not store.period_frames:
+        end_frame = min(timeline.frame_count(store.fps), store.end_frame)
+    palettes = load_palettes(image_paths, mode=args.palette_mode, workers=PALETTE_WORKERS,
+                             max_pixels=PALETTE_MAX_PIXELS, progress=print_progress)
+    output_path = args.output or os.path.join(args.mix_folder, "recolor.mp4")
+    try:
+        stats = recolor_frames(store, timeline, palettes, output_path, start_frame, end_frame)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
+    print_pipeline_stats(stats)
+    print(f"Recoloring completed. Video saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import numpy as np
+
+# Wave constants of shaders/wiiU.frag. They are #defined into every variant
+# of the shader by `wave_defines`, so they live only here.
+NUM_WAVES = 7
+BASE_AMPLITUDE = 0.025
+BASE_FREQUENCY = 3.0
+BASE_FLOW = -0.1       # A fixed negative flow for horizontal wave motion
+THICKNESS = 0.005
+
+
+def shader_random(x):
+    """`random()` from wiiU.frag, evaluated in float32 like the GPU does."""
+    x = np.float32(x)
+    value = np.sin(x) * np.float32(43758.5453123)
+    return np.float32(value - np.floor(value))
+
+def mix(a, b, t):
+    """GLSL mix()."""
+    return a * (1 - t) + b * t
+
+def wave_defines():
+    """`#define` bodies for the wave constants, for record.with_defines(); wiiU.frag needs them."""
+    return [f"{name} ({value!r})" for name, value in
+            (("BASE_AMPLITUDE", BASE_AMPLITUDE), ("BASE_FREQUENCY", BASE_FREQUENCY), ("BASE_FLOW", BASE_FLOW),
+             ("THICKNESS", THICKNESS))]
+
+def wave_parameters(period=None):
+    """
+    Per-wave (vertical offset, amplitude, frequency, flow) table as wiiU.frag
+    derives it from the wave index, as a (NUM_WAVES, 4) float32 array. NumPy's
+    sin() can differ from the GPU's in the last bits, so the GL renderers use
+    record.gpu_wave_parameters() and this is for the CPU backend.
+    With a `period` in seconds the flows are snapped with `snap_flows`.
+    """
+    f32 = np.float32
+    params = np.zeros((NUM_WAVES, 4), dtype=np.float32)
+    for i in range(NUM_WAVES):
+        # Random vertical offset
+        vertical_offset = mix(f32(-.2), f32(0.6), shader_random(i)) + f32(0.9) * np.sin(f32(i) * f32(3.14))
+        # Random amplitude/frequency
+        amplitude = f32(BASE_AMPLITUDE) * mix(f32(1.0), f32(5.3), shader_random(i + 2.0))
+        frequency = f32(BASE_FREQUENCY) * mix(f32(0.2), f32(2.5), shader_random(i + 1.0))
+
+        # Random factor for wave flow
+        wave_flow = f32(BASE_FLOW) * mix(f32(0.4), f32(1.5), shader_random(i))
+
+        # Reverse direction for certain waves
+        if i == 3 or i == 5:
+            wave_flow = -wave_flow
+        if i == 6:
+            amplitude = amplitude + f32(.01)
+            frequency = frequency - f32(2.0)
+            wave_flow = wave_flow - f32(.15)
+
+        params[i] = (vertical_offset, amplitude, frequency, wave_flow)
+    if period:
+        params = snap_flows(params, period)
+    return params
+
+def snap_flows(params, period):
+    """
+    Round every wave's flow to the nearest non-zero multiple of 2*pi / period,
+    so each wave moves a whole number of cycles per period and the animation
+    repeats exactly every `period` seconds. A flow moves by up to pi / period,
+    which is large next to the slowest wave (|flow| ~ 0.04): about 31% at
+    120 s, 7% at 300 s and under 1% at 3000 s. See `flow_drift`.
+    """
+    params = params.copy()
+    step = 2.0 * np.pi / period
+    cycles = np.round(params[:, 3] / step)
+    cycles = np.where(cycles == 0, np.sign(params[:, 3]), cycles)
+    params[:, 3] = (cycles * step).astype(np.float32)
+    return params
+
+def flow_drift(period):
+    """Largest relative change of a wave's flow from `snap_flows`, e.g. 0.31 for 31%."""
+    params = wave_parameters()
+    flows, snapped = params[:, 3], snap_flows(params, period)[:, 3]
+    return float(np.max(np.abs(snapped - flows) / np.abs(flows)))
+
+def wave_bands(params, margin=1e-4):
+    """
+    Vertical band (min y, max y) in st units that each wave can touch:
+    [0.5 + offset - |amplitude| - 20 * thickness, 0.5 + offset + |amplitude| + thickness].
+    Outside it the wave's alpha is exactly 0. `margin` covers float rounding
+    in the shader, so skipping a wave outside its band never changes a pixel.
+    """
+    f32 = np.float32
+    offset, amplitude = f32(0.5) + params[:, 0], np.abs(params[:, 1])
+    return np.stack([
+        offset - amplitude - f32(THICKNESS) * f32(20.0) - f32(margin),
+        offset + amplitude + f32(THICKNESS) + f32(margin),
+    ], axis=1).astype(f32)
+
+def upload_wave_table(program, params):
+    """Write a wave parameter table and its bands into a shader program's uniform arrays."""
+    for name, table in (("waveParams", params), ("waveBands", wave_bands(params))):
+        uniform = program.get(name, None)
+        if uniform is not None:
+            uniform.write(np.ascontiguousarray(table, dtype=np.float32).tobytes())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Make src/ and the root directory importable, like benchmarks/benchmark.py
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "src"))
+sys.path.append(ROOT_DIR)
@@ -0,0 +1,18 @@
+import pytest
+from cpuRenderer import compare_with_gl
+
+moderngl = pytest.importorskip("moderngl")
+
+
+def gl_available():
+    try:
+        moderngl.create_standalone_context().release()
+    except Exception:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not gl_available(), reason="needs an OpenGL 3.3 driver")
+def test_cpu_renderer_matches_gl_shader():
+    # The original per-fragment wave math on the GPU is the reference
+    assert compare_with_gl(width=320, height=180, tolerance=2)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from PIL import Image
+from extractColors import extract_kmean_colors, palette_delta_e
+
+# Largest per-slot CIE76 difference allowed between two extraction paths.
+# Around 2.3 is just noticeable side by side; 5 is a small shift of a color
+# and well below what swapping two palette slots would cost.
+MAX_DELTA_E = 5.0
+
+# Nine well-separated colors (0-255), one per palette slot
+COVER_COLORS = [
+    (20, 24, 40), (235, 228, 210), (200, 40, 50), (40, 160, 70), (50, 80, 200),
+    (230, 190, 40), (150, 60, 170), (40, 190, 200), (240, 120, 30),
+]
+
+
+def make_cover(path, size, seed=0):
+    """A cover of nine flat color bands with a little noise, like scanned album art."""
+    rng = np.random.default_rng(seed)
+    bands = np.array(COVER_COLORS, dtype=np.float64)[np.arange(size) * len(COVER_COLORS) // size]
+    image = np.repeat(bands[:, None, :], size, axis=1) + rng.normal(0.0, 4.0, (size, size, 3))
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(path)
+    return str(path)
+
+
+def test_fast_mode_matches_full_kmeans(tmp_path):
+    path = make_cover(tmp_path / "cover.png", 600)
+    delta_e = palette_delta_e(extract_kmean_colors(path, mode="full"), extract_kmean_colors(path, mode="fast"))
+    assert delta_e.max() < MAX_DELTA_E
+
+
+@pytest.mark.parametrize("ext", [".jpg", ".bmp", ".png"])
+def test_budget_decode_matches_full_resolution(tmp_path, ext):
+    # 4 megapixels against a 1 megapixel budget: draft mode, raw sampling and thumbnailing
+    path = make_cover(tmp_path / f"cover{ext}", 2000)
+    full = extract_kmean_colors(path, mode="fast")
+    budget = extract_kmean_colors(path, mode="fast", max_pixels=1_000_000)
+    assert palette_delta_e(full, budget).max() < MAX_DELTA_E